@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+协议接收性能基准测试
+对比旧的 payload += chunk 拼接接收与 recv_into 预分配接收的吞吐量（MB/s）
+
+用法:
+    python bench_protocol.py
+"""
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.protocol import Protocol
+
+# 测试的帧大小：64B ~ 16MB
+FRAME_SIZES = [64, 1024, 8192, 65536, 1024 * 1024, 16 * 1024 * 1024]
+
+# 每种帧大小大约传输的总字节数
+TARGET_BYTES = 64 * 1024 * 1024
+MAX_FRAMES = 20000
+
+
+def legacy_receive_message(sock):
+    """旧版接收实现（逐块拼接），仅用于对比"""
+    header = b''
+    while len(header) < 5:
+        chunk = sock.recv(5 - len(header))
+        if not chunk:
+            return None, None
+        header += chunk
+
+    msg_len, msg_type = struct.unpack('!IB', header)
+
+    payload = b''
+    remaining = msg_len - 1
+    while len(payload) < remaining:
+        chunk = sock.recv(min(remaining - len(payload), 8192))
+        if not chunk:
+            return None, None
+        payload += chunk
+
+    return msg_type, Protocol.decode_payload(payload)
+
+
+def run_case(receive_func, frame_size):
+    """发送固定数量的帧并计时接收"""
+    count = max(1, min(MAX_FRAMES, TARGET_BYTES // frame_size))
+    # 二进制数据，触发与真实文件数据相同的解析路径
+    frame = Protocol.pack_message(Protocol.MSG_FILE_DATA, b'\xff' * frame_size)
+
+    sender_sock, receiver_sock = socket.socketpair()
+
+    def sender():
+        try:
+            for _ in range(count):
+                sender_sock.sendall(frame)
+        finally:
+            sender_sock.close()
+
+    thread = threading.Thread(target=sender)
+    thread.daemon = True
+
+    start = time.perf_counter()
+    thread.start()
+    for _ in range(count):
+        msg_type, _payload = receive_func(receiver_sock)
+        if msg_type is None:
+            raise RuntimeError("连接提前关闭")
+    elapsed = time.perf_counter() - start
+
+    thread.join()
+    receiver_sock.close()
+    return count * frame_size / elapsed / (1024 * 1024)
+
+
+def format_size(size):
+    """格式化帧大小"""
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size}{unit}"
+        size //= 1024
+    return f"{size}GB"
+
+
+def main():
+    print("=" * 60)
+    print("Protocol.receive_message 吞吐量测试")
+    print("=" * 60)
+    print(f"{'帧大小':<10} {'旧实现 MB/s':>14} {'recv_into MB/s':>16} {'提升':>8}")
+    print("-" * 60)
+
+    for size in FRAME_SIZES:
+        legacy = run_case(legacy_receive_message, size)
+        current = run_case(Protocol.receive_message, size)
+        print(f"{format_size(size):<10} {legacy:>14.1f} {current:>16.1f} {current / legacy:>7.2f}x")
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
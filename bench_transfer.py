@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+文件传输性能基准测试
+在本机TCP回环上对比各种下载发送路径的吞吐量（MB/s）和发送端CPU耗时（CPU秒/GB），
+以及计算BLAKE2b校验摘要带来的吞吐量损失
+
+用法:
+    python bench_transfer.py [文件大小MB]
+"""
+import hashlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.protocol import Protocol
+from common.transfer import StreamHasher, DIGEST_SIZE, file_digest
+
+CHUNK_SIZE = 65536
+
+
+def send_framed(sock, f, size):
+    """旧路径：每64KB读入Python、打包成MSG_FILE_DATA帧后发送"""
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        sock.sendall(Protocol.pack_message(Protocol.MSG_FILE_DATA, chunk, True))
+
+
+def send_sendfile(sock, f, size):
+    """数据流路径：os.sendfile 内核直接拷贝"""
+    Protocol.send_stream(sock, f, 0, size)
+
+
+def send_readinto(sock, f, size):
+    """数据流回退路径：readinto 到复用缓冲区"""
+    Protocol.send_stream(sock, f, 0, size, use_sendfile=False)
+
+
+def send_framed_inline_hash(sock, f, size):
+    """分帧发送，在发送线程中同步计算摘要（对照）"""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+        sock.sendall(Protocol.pack_message(Protocol.MSG_FILE_DATA, chunk, True))
+    h.hexdigest()
+
+
+def send_framed_stream_hash(sock, f, size):
+    """分帧发送，数据块交给哈希线程（FileHandler 的做法）"""
+    hasher = StreamHasher()
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        sock.sendall(Protocol.pack_message(Protocol.MSG_FILE_DATA, chunk, True))
+    hasher.hexdigest()
+
+
+def send_sendfile_second_pass(sock, f, size):
+    """sendfile 发送完后再读一遍文件计算摘要（对照）"""
+    Protocol.send_stream(sock, f, 0, size)
+    file_digest(f.name)
+
+
+def send_sendfile_stream_hash(sock, f, size):
+    """sendfile 发送，哈希线程同时从文件读取"""
+    hasher = StreamHasher()
+    hasher.update_file(f.name, 0, size)
+    Protocol.send_stream(sock, f, 0, size)
+    hasher.hexdigest()
+
+
+SENDERS = [
+    ("分帧发送(旧)", send_framed),
+    ("os.sendfile", send_sendfile),
+    ("readinto回退", send_readinto),
+]
+
+# 校验摘要的开销：(名称, 发送函数, 不校验时的对照路径)
+HASH_SENDERS = [
+    ("分帧+同步哈希", send_framed_inline_hash, send_framed),
+    ("分帧+哈希线程", send_framed_stream_hash, send_framed),
+    ("sendfile+再读一遍", send_sendfile_second_pass, send_sendfile),
+    ("sendfile+哈希线程", send_sendfile_stream_hash, send_sendfile),
+]
+
+
+def drain(sock):
+    """接收端：尽快读空socket"""
+    buffer = bytearray(Protocol.STREAM_CHUNK_SIZE)
+    while sock.recv_into(buffer):
+        pass
+    sock.close()
+
+
+def run_case(sender, file_path, size):
+    """返回 (MB/s, 发送端CPU秒/GB)"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    client = socket.create_connection(listener.getsockname())
+    server_sock, _ = listener.accept()
+    listener.close()
+
+    receiver = threading.Thread(target=drain, args=(client,))
+    receiver.start()
+
+    with open(file_path, 'rb') as f:
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        sender(server_sock, f, size)
+        cpu = time.thread_time() - cpu_start
+    server_sock.shutdown(socket.SHUT_WR)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    server_sock.close()
+
+    mb = size / (1024 * 1024)
+    return mb / elapsed, cpu / (size / (1024 ** 3))
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    size = size_mb * 1024 * 1024
+
+    with tempfile.NamedTemporaryFile(delete=False) as tmp:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            tmp.write(block)
+        file_path = tmp.name
+
+    try:
+        print("=" * 60)
+        print(f"下载发送路径对比（文件 {size_mb}MB，TCP回环）")
+        print("=" * 60)
+        print(f"{'路径':<16} {'MB/s':>10} {'CPU秒/GB':>12}")
+        print("-" * 60)
+        baseline = {}
+        for name, sender in SENDERS:
+            throughput, cpu_per_gb = run_case(sender, file_path, size)
+            baseline[sender] = throughput
+            print(f"{name:<16} {throughput:>10.1f} {cpu_per_gb:>12.3f}")
+        print("=" * 60)
+
+        print()
+        print(f"BLAKE2b校验开销（含等待摘要完成）")
+        print("=" * 60)
+        print(f"{'路径':<16} {'MB/s':>10} {'损失MB/s':>10} {'损失':>8}")
+        print("-" * 60)
+        for name, sender, plain in HASH_SENDERS:
+            throughput, _ = run_case(sender, file_path, size)
+            loss = baseline[plain] - throughput
+            print(f"{name:<16} {throughput:>10.1f} {loss:>10.1f} {loss / baseline[plain]:>8.1%}")
+        print("=" * 60)
+    finally:
+        os.unlink(file_path)
+
+
+if __name__ == '__main__':
+    main()
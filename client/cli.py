@@ -0,0 +1,341 @@
+"""
+命令行客户端（无界面）
+基于 ClientConnection，适用于定时任务和CI，结果以JSON输出到stdout
+
+用法:
+    python flashctl.py [--host 主机] [--port 端口] [--streams N] <子命令> ...
+
+    exec <命令...>          执行命令，返回退出码、stdout、stderr和耗时
+    upload [--delta] <本地文件> <远程目录>
+    upload [--include 规则] [--exclude 规则] <本地目录> <远程目录>
+                            上传整个目录（一个tar数据流）
+    upload <本地文件...> <远程目录>      多个文件一次上传
+    download <远程文件> <本地路径>
+    download <远程文件...> <本地目录>    多个文件一个批量请求下载
+    download -r [--include 规则] [--exclude 规则] <远程目录> <本地目录>
+                            下载整个目录到本地目录下
+    ls [远程目录]
+    shell                   交互式终端（Ctrl+] 退出）
+    fleet <清单文件> exec <命令...> | push <本地文件> <远程目录>
+                            对清单中的所有主机并发执行，每台主机完成后输出一行JSON，最后输出汇总
+
+密码通过 --password 或环境变量 FLASH_PASSWORD 提供，
+主机和端口也可通过 FLASH_HOST / FLASH_PORT 提供；
+--streams N 时文件传输另外使用N条数据连接，N大于1时大文件分段并行下载
+为保证启动速度，只在需要时才导入模块
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_PORT = 9999
+SHELL_ESCAPE = b'\x1d'  # Ctrl+]
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog='flashctl', description='FlashControler 命令行客户端')
+    parser.add_argument('--host', default=os.environ.get('FLASH_HOST'), help='服务器地址（默认取 FLASH_HOST）')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('FLASH_PORT', DEFAULT_PORT)), help='服务器端口')
+    parser.add_argument('--password', default=os.environ.get('FLASH_PASSWORD'), help='连接密码（默认取 FLASH_PASSWORD）')
+    parser.add_argument('--streams', type=int, default=0, metavar='N',
+                        help='文件传输使用的数据连接数（默认0，使用控制连接）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('exec', help='执行命令（不经过终端）')
+    p.add_argument('--timeout', type=float, help='超时秒数')
+    p.add_argument('--cwd', help='工作目录')
+    p.add_argument('argv', nargs=argparse.REMAINDER, help='命令；只有一个参数时由/bin/sh执行')
+
+    p = sub.add_parser('upload', help='上传文件')
+    p.add_argument('--delta', action='store_true', help='增量上传：只发送与远程已有文件不同的部分')
+    add_filter_arguments(p)
+    p.add_argument('local', nargs='+', help='本地文件或目录（多个文件时一次上传）')
+    p.add_argument('remote_dir')
+
+    p = sub.add_parser('download', help='下载文件')
+    p.add_argument('-r', '--recursive', action='store_true', help='下载整个目录')
+    add_filter_arguments(p)
+    p.add_argument('remote', nargs='+', help='远程文件（多个文件时批量下载到本地目录）')
+    p.add_argument('local')
+
+    p = sub.add_parser('ls', help='列出远程目录')
+    p.add_argument('path', nargs='?', default='/')
+
+    p = sub.add_parser('shell', help='交互式终端（Ctrl+] 退出）')
+    p.add_argument('--join', metavar='TOKEN', help='以观看者身份加入其他连接的会话')
+    p.add_argument('--write', action='store_true', help='加入会话时请求输入权限')
+
+    p = sub.add_parser('fleet', help='对服务器清单中的所有主机并发执行')
+    p.add_argument('inventory', help='清单文件：每行 主机[:端口] [密码]，或JSON列表')
+    p.add_argument('--concurrency', type=int, default=64, help='同时连接数上限')
+    p.add_argument('--slowest', type=int, default=5, help='汇总中列出最慢的主机数')
+    fleet = p.add_subparsers(dest='action', required=True)
+    q = fleet.add_parser('exec', help='执行命令')
+    q.add_argument('--timeout', type=float, help='超时秒数')
+    q.add_argument('--cwd', help='工作目录')
+    q.add_argument('argv', nargs=argparse.REMAINDER)
+    q = fleet.add_parser('push', help='推送文件')
+    q.add_argument('local')
+    q.add_argument('remote_dir')
+
+    return parser
+
+
+def add_filter_arguments(parser):
+    """目录传输的路径规则（可多次指定）"""
+    parser.add_argument('--include', action='append', metavar='规则', help='目录传输时只传输匹配的文件')
+    parser.add_argument('--exclude', action='append', metavar='规则', help='目录传输时跳过匹配的文件和目录')
+
+
+def open_connection(args, share=None, write=False, terminal=True):
+    """
+    连接并认证
+    返回: (ClientConnection, 错误信息)
+    """
+    from client.connection import ClientConnection
+
+    if not args.host:
+        return None, "缺少服务器地址（--host 或 FLASH_HOST）"
+    if args.password is None:
+        return None, "缺少密码（--password 或 FLASH_PASSWORD）"
+
+    conn = ClientConnection()
+    ok, message = conn.connect(args.host, args.port, args.password, share=share, write=write, terminal=terminal)
+    if not ok:
+        return None, message
+    return conn, None
+
+
+def parse_command(argv):
+    """命令行中的命令：只有一个参数时作为shell命令，否则为参数列表"""
+    if argv[:1] == ['--']:
+        argv = argv[1:]
+    if not argv:
+        return None
+    return argv[0] if len(argv) == 1 else argv
+
+
+def decode_output(result):
+    """把执行结果中的stdout/stderr解码为文本"""
+    for stream in ('stdout', 'stderr'):
+        if isinstance(result.get(stream), bytes):
+            result[stream] = result[stream].decode('utf-8', errors='replace')
+    return result
+
+
+def cmd_exec(conn, args):
+    """执行命令"""
+    command = parse_command(args.argv)
+    if command is None:
+        return {"ok": False, "error": "缺少命令"}, 2
+
+    result = conn.exec_command(command, cwd=args.cwd, timeout=args.timeout)
+    output = {
+        "ok": result['error'] is None and result['returncode'] == 0,
+        "returncode": result['returncode'],
+        "stdout": result['stdout'],
+        "stderr": result['stderr'],
+        "elapsed": result['elapsed'],
+        "error": result['error'],
+    }
+    decode_output(output)
+    if result['returncode'] is None:
+        return output, 255
+    # 被信号结束时按shell的习惯返回 128+信号值
+    return output, result['returncode'] if result['returncode'] >= 0 else 128 - result['returncode']
+
+
+def cmd_upload(conn, args):
+    """上传文件、多个文件或整个目录"""
+    start = time.perf_counter()
+    local = args.local[0]
+    if len(args.local) > 1:
+        ok, message = conn.upload_files(args.local, args.remote_dir)
+    elif os.path.isdir(local):
+        ok, message = conn.upload_dir(local, args.remote_dir, args.include, args.exclude)
+    elif args.delta:
+        ok, message = conn.upload_delta(local, args.remote_dir)
+    else:
+        ok, message = conn.upload_file(local, args.remote_dir)
+    result = {"ok": ok, "message": message}
+    if len(args.local) == 1 and os.path.isfile(local):
+        result["bytes"] = os.path.getsize(local) if ok else 0
+    result["elapsed"] = round(time.perf_counter() - start, 6)
+    return result, 0 if ok else 1
+
+
+def cmd_download(conn, args):
+    """下载文件、多个文件或整个目录"""
+    start = time.perf_counter()
+    if args.recursive:
+        ok, message = conn.download_dir(args.remote[0], args.local, args.include, args.exclude)
+    elif len(args.remote) > 1:
+        ok, message = conn.download_files(args.remote, args.local)
+    else:
+        ok, message = conn.download_file(args.remote[0], args.local)
+    result = {"ok": ok, "message": message}
+    if not args.recursive and len(args.remote) == 1:
+        result["bytes"] = os.path.getsize(args.local) if ok else 0
+    result["elapsed"] = round(time.perf_counter() - start, 6)
+    return result, 0 if ok else 1
+
+
+def cmd_ls(conn, args):
+    """列出远程目录"""
+    result, error = conn.list_files(args.path)
+    if error:
+        return {"ok": False, "error": error}, 1
+    return {"ok": True, "path": result.get('path', args.path), "items": result.get('items', [])}, 0
+
+
+def cmd_shell(conn, args, stdout):
+    """交互式终端：本地终端切换到原始模式，按键原样发送给远程shell"""
+    last_output = [0.0]
+
+    def write_output(data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        last_output[0] = time.monotonic()
+        stdout.buffer.write(data)
+        stdout.buffer.flush()
+
+    def drain():
+        """输入来自管道：读完后等输出停止再退出（最多等10秒）"""
+        deadline = time.monotonic() + 10
+        while conn.connected and time.monotonic() < deadline:
+            if last_output[0] and time.monotonic() - last_output[0] > 1:
+                break
+            time.sleep(0.1)
+
+    conn.register_callback('terminal_output', write_output)
+    conn.register_callback('terminal_skip', lambda n: write_output(f"\r\n[输出过快，已跳过 {n} 字节]\r\n"))
+    if conn.session_token:
+        print(f"[会话令牌: {conn.session_token}，其他人可用 shell --join 观看]", file=sys.stderr)
+
+    fd = sys.stdin.fileno()
+    try:
+        import termios
+        import tty
+        import select
+        saved = termios.tcgetattr(fd) if os.isatty(fd) else None
+    except ImportError:
+        # 没有termios（Windows）：按行发送
+        for line in sys.stdin:
+            if not conn.connected:
+                break
+            conn.send_terminal_input(line)
+        drain()
+        return None, 0
+
+    if saved is not None:
+        tty.setraw(fd)
+    try:
+        while conn.connected:
+            readable, _, _ = select.select([fd], [], [], 0.5)
+            if not readable:
+                continue
+            data = os.read(fd, 1024)
+            if not data:
+                drain()
+                break
+            if SHELL_ESCAPE in data:
+                break
+            conn.send_terminal_input(data)
+    finally:
+        if saved is not None:
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+    return None, 0
+
+
+def cmd_fleet(args, stdout):
+    """批量执行：每台主机完成后立即输出一行结果，最后输出汇总"""
+    from client.fleet import Fleet, load_inventory, summarize
+
+    if args.action == 'exec':
+        command = parse_command(args.argv)
+        if command is None:
+            return {"ok": False, "error": "缺少命令"}, 2
+    elif not os.path.isfile(args.local):
+        return {"ok": False, "error": f"文件不存在: {args.local}"}, 2
+
+    try:
+        hosts = load_inventory(args.inventory, args.port, args.password)
+    except (OSError, ValueError, KeyError) as e:
+        return {"ok": False, "error": f"读取清单失败: {e}"}, 2
+
+    fleet = Fleet(hosts, concurrency=args.concurrency)
+    if args.action == 'exec':
+        results = fleet.exec_command(command, cwd=args.cwd, timeout=args.timeout)
+    else:
+        results = fleet.push_file(args.local, args.remote_dir)
+
+    start = time.monotonic()
+    finished = []
+    for result in results:
+        finished.append(result)
+        stdout.write(json.dumps(decode_output(result), ensure_ascii=False) + '\n')
+        stdout.flush()
+
+    summary = summarize(finished, time.monotonic() - start, args.slowest)
+    return {"summary": summary}, 0 if not summary["failed"] else 1
+
+
+# 非交互子命令，返回 (JSON结果, 退出码)
+COMMANDS = {
+    'exec': cmd_exec,
+    'upload': cmd_upload,
+    'download': cmd_download,
+    'ls': cmd_ls,
+}
+
+
+def run_single(args, stdout):
+    """连接一台服务器执行子命令，返回 (JSON结果, 退出码)"""
+    if args.command == 'shell':
+        conn, error = open_connection(args, share=args.join, write=args.write)
+    else:
+        # 非交互命令不需要终端，服务端也就不用启动shell
+        conn, error = open_connection(args, terminal=False)
+    if error:
+        return {"ok": False, "error": error}, 255
+
+    try:
+        if args.command == 'shell':
+            return cmd_shell(conn, args, stdout)
+        if args.streams and args.command in ('upload', 'download'):
+            conn.open_data_connections(args.streams)
+        return COMMANDS[args.command](conn, args)
+    finally:
+        conn.disconnect()
+        # 等接收线程退出，它的输出不会在恢复stdout后混进结果
+        if conn.receive_thread is not None:
+            conn.receive_thread.join(1)
+
+
+def main(argv=None):
+    """主函数，返回进程退出码"""
+    args = build_parser().parse_args(argv)
+
+    # ClientConnection及其接收线程的调试输出转到stderr，stdout只留给结果
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        if args.command == 'fleet':
+            result, code = cmd_fleet(args, stdout)
+        else:
+            result, code = run_single(args, stdout)
+    finally:
+        sys.stdout = stdout
+
+    if result is not None:
+        stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+        stdout.flush()
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,6 +19,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from client.connection import ClientConnection
 from client.update_manager import UpdateManager
 from common.config import Config
+from common.protocol import Protocol
 from common.version import __version__
 
 
@@ -514,7 +515,7 @@ class FileBrowserDialog(QDialog):
         self.load_directory(self.current_path)
 
     def download_selected(self):
-        """下载选中的文件"""
+        """下载选中的文件和文件夹（文件夹整个下载）"""
         selected_items = self.tree.selectedItems()
         if not selected_items:
             QMessageBox.information(self, "提示", "请先选择要下载的文件")
@@ -523,7 +524,8 @@ class FileBrowserDialog(QDialog):
         files_to_download = []
         for item in selected_items:
             data = item.data(0, Qt.UserRole)
-            if data and not data.get('is_dir'):
+            # 上级目录项没有名称，不下载
+            if data and data.get('name'):
                 files_to_download.append(data)
 
         if not files_to_download:
@@ -535,9 +537,18 @@ class FileBrowserDialog(QDialog):
         if not save_dir:
             return
 
-        # 下载文件
+        # 文件夹作为一个数据流下载到保存目录下
+        files = [data for data in files_to_download if not data.get('is_dir')]
         for file_data in files_to_download:
-            self.download_file(file_data, save_dir)
+            if file_data.get('is_dir') and hasattr(self.parent(), 'download_remote_file'):
+                self.parent().download_remote_file(file_data['path'], save_dir, is_dir=True)
+
+        # 多个文件用一个批量请求下载
+        if len(files) > 1 and hasattr(self.parent(), 'download_remote_files'):
+            self.parent().download_remote_files([data['path'] for data in files], save_dir)
+        else:
+            for file_data in files:
+                self.download_file(file_data, save_dir)
 
     def download_file(self, file_data, save_dir=None):
         """下载单个文件"""
@@ -671,15 +682,19 @@ class ConnectionThread(QThread):
     """连接线程"""
     result = pyqtSignal(bool, str)
 
-    def __init__(self, connection, host, port, password):
+    def __init__(self, connection, host, port, password, data_connections=0):
         super().__init__()
         self.connection = connection
         self.host = host
         self.port = port
         self.password = password
+        self.data_connections = data_connections
 
     def run(self):
         success, message = self.connection.connect(self.host, self.port, self.password)
+        if success and self.data_connections:
+            # 文件传输使用单独的数据连接，建立失败时仍使用控制连接
+            self.connection.open_data_connections(self.data_connections)
         self.result.emit(success, message)
 
 
@@ -694,7 +709,10 @@ class UploadThread(QThread):
         self.target_path = target_path
 
     def run(self):
-        success, message = self.connection.upload_file(self.file_path, self.target_path)
+        if os.path.isdir(self.file_path):
+            success, message = self.connection.upload_dir(self.file_path, self.target_path)
+        else:
+            success, message = self.connection.upload_file(self.file_path, self.target_path)
         self.result.emit(success, message)
 
 
@@ -702,14 +720,33 @@ class DownloadThread(QThread):
     """下载线程"""
     result = pyqtSignal(bool, str)
 
-    def __init__(self, connection, remote_path, local_path):
+    def __init__(self, connection, remote_path, local_path, is_dir=False):
         super().__init__()
         self.connection = connection
         self.remote_path = remote_path
         self.local_path = local_path
+        self.is_dir = is_dir  # 为True时下载整个目录到 local_path 下
+
+    def run(self):
+        if self.is_dir:
+            success, message = self.connection.download_dir(self.remote_path, self.local_path)
+        else:
+            success, message = self.connection.download_file(self.remote_path, self.local_path)
+        self.result.emit(success, message)
+
+
+class BatchDownloadThread(QThread):
+    """批量下载线程"""
+    result = pyqtSignal(bool, str)
+
+    def __init__(self, connection, remote_paths, local_dir):
+        super().__init__()
+        self.connection = connection
+        self.remote_paths = remote_paths
+        self.local_dir = local_dir
 
     def run(self):
-        success, message = self.connection.download_file(self.remote_path, self.local_path)
+        success, message = self.connection.download_files(self.remote_paths, self.local_dir)
         self.result.emit(success, message)
 
 
@@ -733,7 +770,7 @@ class FlashClientGUI(QMainWindow):
     ANSI_ESCAPE_PATTERN = re.compile(r'\x1b\[[0-9;]*[a-zA-Z]|\x1b\][0-9;]*;[^\x07]*\x07|\x1b\][^\x07]*\x07|\x1b\[\?[0-9;]*[a-zA-Z]|\x1b[=>]|\r')
 
     # 定义信号（用于线程安全的GUI更新）
-    terminal_output_signal = pyqtSignal(str)
+    terminal_output_signal = pyqtSignal(str, int)
     disconnected_signal = pyqtSignal()
     file_progress_signal = pyqtSignal(float, int, int)
 
@@ -742,6 +779,7 @@ class FlashClientGUI(QMainWindow):
 
         self.config = Config("config/settings.json")
         self.connection = ClientConnection()
+        self.download_threads = set()  # 进行中的下载线程，服务端支持请求ID时可同时下载多个文件
         self.update_manager = UpdateManager(
             current_version=__version__,
             update_url=self.config.get('update', 'update_url', '')
@@ -915,7 +953,7 @@ class FlashClientGUI(QMainWindow):
 
         local_layout.addWidget(QLabel("本地文件:"))
         self.file_path_input = QLineEdit()
-        self.file_path_input.setPlaceholderText("选择要上传的文件...")
+        self.file_path_input.setPlaceholderText("选择要上传的文件或文件夹...")
         local_layout.addWidget(self.file_path_input)
 
         self.browse_btn = QPushButton("浏览...")
@@ -923,6 +961,11 @@ class FlashClientGUI(QMainWindow):
         self.browse_btn.clicked.connect(self.browse_file)
         local_layout.addWidget(self.browse_btn)
 
+        self.browse_folder_btn = QPushButton("选择文件夹...")
+        self.browse_folder_btn.setMinimumWidth(100)
+        self.browse_folder_btn.clicked.connect(self.browse_folder)
+        local_layout.addWidget(self.browse_folder_btn)
+
         file_select_layout.addWidget(local_container)
 
         # 目标路径
@@ -1195,7 +1238,10 @@ class FlashClientGUI(QMainWindow):
     def setup_callbacks(self):
         """设置回调函数 - 使用信号来确保线程安全"""
         # 使用 lambda 来发射信号，而不是直接调用方法
-        self.connection.register_callback('terminal_output', lambda output: self.terminal_output_signal.emit(self._process_output(output)))
+        # 终端输出在主线程显示后才发放流控额度，界面跟不上时服务端会暂停发送
+        self.connection.auto_credit = False
+        self.connection.register_callback('terminal_output', lambda output: self.terminal_output_signal.emit(self._process_output(output), len(output)))
+        self.connection.register_callback('terminal_skip', lambda skipped: self.terminal_output_signal.emit(f"\n[输出过快，已跳过 {skipped} 字节]\n", 0))
         self.connection.register_callback('disconnected', lambda: self.disconnected_signal.emit())
         self.connection.register_callback('file_progress', lambda p, s, t: self.file_progress_signal.emit(p, s, t))
 
@@ -1207,7 +1253,7 @@ class FlashClientGUI(QMainWindow):
 
     def _process_output(self, output):
         """处理输出数据（在接收线程中调用）"""
-        if isinstance(output, bytes):
+        if isinstance(output, (bytes, bytearray)):
             try:
                 output = output.decode('utf-8')
             except UnicodeDecodeError:
@@ -1242,7 +1288,8 @@ class FlashClientGUI(QMainWindow):
             self.connect_btn.setEnabled(False)
 
             # 在后台线程连接
-            self.conn_thread = ConnectionThread(self.connection, host, port, password)
+            self.conn_thread = ConnectionThread(self.connection, host, port, password,
+                                                self.config.get('client', 'data_connections', 1))
             self.conn_thread.result.connect(self.on_connect_result)
             self.conn_thread.start()
         else:
@@ -1325,11 +1372,12 @@ class FlashClientGUI(QMainWindow):
         """
         return FlashClientGUI.ANSI_ESCAPE_PATTERN.sub('', text)
 
-    def append_terminal_output(self, text):
-        """追加终端输出（在主线程中调用）"""
+    def append_terminal_output(self, text, nbytes=0):
+        """追加终端输出（在主线程中调用），显示后发放对应的流控额度"""
         self.terminal_output.moveCursor(QTextCursor.End)
         self.terminal_output.insertPlainText(text)
         self.terminal_output.moveCursor(QTextCursor.End)
+        self.connection.grant_credit(nbytes)
 
     def clear_terminal(self):
         """清空终端"""
@@ -1350,6 +1398,12 @@ class FlashClientGUI(QMainWindow):
         if filename:
             self.file_path_input.setText(filename)
 
+    def browse_folder(self):
+        """选择要上传的文件夹（整个目录作为一个数据流上传）"""
+        folder = QFileDialog.getExistingDirectory(self, "选择要上传的文件夹", "")
+        if folder:
+            self.file_path_input.setText(folder)
+
     def browse_remote_dir(self):
         """浏览远程目录"""
         if not self.connection.connected:
@@ -1406,6 +1460,10 @@ class FlashClientGUI(QMainWindow):
 
     def on_file_progress(self, progress, sent, total):
         """文件传输进度回调"""
+        if not total:
+            # 目录传输的总长度未知，只显示已传输的字节数
+            self.progress_label.setText(f"正在传输: {self.format_bytes(sent)}")
+            return
         self.progress_bar.setValue(int(progress))
         self.progress_label.setText(
             f"正在传输: {progress:.1f}% ({self.format_bytes(sent)} / {self.format_bytes(total)})"
@@ -1435,8 +1493,8 @@ class FlashClientGUI(QMainWindow):
         dialog = FileBrowserDialog(self.connection, self)
         dialog.exec_()
 
-    def download_remote_file(self, remote_path, local_path):
-        """下载远程文件"""
+    def download_remote_file(self, remote_path, local_path, is_dir=False):
+        """下载远程文件；is_dir=True 时下载整个目录到 local_path 下"""
         if not self.connection or not self.connection.connected:
             QMessageBox.warning(self, "错误", "请先连接到服务器")
             return
@@ -1445,14 +1503,37 @@ class FlashClientGUI(QMainWindow):
         self.progress_bar.setValue(0)
         self.progress_label.setText("准备下载...")
 
-        # 禁用按钮
-        self.browse_remote_files_btn.setEnabled(False)
-        self.upload_btn.setEnabled(False)
+        # 旧服务端同一时间只能进行一个请求，下载期间禁用浏览和上传
+        if Protocol.FEATURE_REQUEST_ID not in self.connection.features:
+            self.browse_remote_files_btn.setEnabled(False)
+            self.upload_btn.setEnabled(False)
+
+        # 创建下载线程（保留引用直到线程结束）
+        thread = DownloadThread(self.connection, remote_path, local_path, is_dir)
+        thread.result.connect(self.on_download_complete)
+        thread.finished.connect(lambda: self.download_threads.discard(thread))
+        self.download_threads.add(thread)
+        thread.start()
+
+    def download_remote_files(self, remote_paths, local_dir):
+        """批量下载多个远程文件到本地目录"""
+        if not self.connection or not self.connection.connected:
+            QMessageBox.warning(self, "错误", "请先连接到服务器")
+            return
+
+        self.log_transfer(f"开始批量下载: {len(remote_paths)} 个文件 -> {local_dir}")
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("准备下载...")
+
+        if Protocol.FEATURE_REQUEST_ID not in self.connection.features:
+            self.browse_remote_files_btn.setEnabled(False)
+            self.upload_btn.setEnabled(False)
 
-        # 创建下载线程
-        self.download_thread = DownloadThread(self.connection, remote_path, local_path)
-        self.download_thread.result.connect(self.on_download_complete)
-        self.download_thread.start()
+        thread = BatchDownloadThread(self.connection, remote_paths, local_dir)
+        thread.result.connect(self.on_download_complete)
+        thread.finished.connect(lambda: self.download_threads.discard(thread))
+        self.download_threads.add(thread)
+        thread.start()
 
     def on_download_complete(self, success, message):
         """下载完成回调"""
@@ -7,56 +7,173 @@ import sys
 import os
 import queue
 import time
+import itertools
+import mmap
+import posixpath
+import functools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.protocol import Protocol
+from common.channel import SendWindow, ReceiveWindow
+from common.transfer import transfer_id, part_path, StreamHasher
+from common.delta import parse_signature, compute_delta
+from common.archive import ChunkWriter, ChunkReader, write_tree, write_files, extract_tree
+from common.compression import OutputDecompressor
+
+
+def _bulk(method):
+    """文件传输方法：有数据连接时交给其中一条执行，控制连接只传终端和命令"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._bulk_connection() as conn:
+            return method(conn, *args, **kwargs)
+    return wrapper
 
 
 class ClientConnection:
     """客户端连接管理"""
 
+    # 交给等待中的请求的回复类型
+    REPLY_TYPES = (Protocol.MSG_FILE_UPLOAD, Protocol.MSG_FILE_DATA, Protocol.MSG_FILE_COMPLETE,
+                   Protocol.MSG_FILE_DOWNLOAD, Protocol.MSG_LIST_DIR, Protocol.MSG_FILE_LIST,
+                   Protocol.MSG_DELTA_SIGNATURE, Protocol.MSG_DELTA_COMPLETE,
+                   Protocol.MSG_DIR_UPLOAD, Protocol.MSG_DIR_DOWNLOAD, Protocol.MSG_DIR_DATA,
+                   Protocol.MSG_DIR_COMPLETE, Protocol.MSG_FILE_BATCH, Protocol.MSG_ERROR)
+
     def __init__(self):
         self.socket = None
         self.connected = False
         self.receive_thread = None
         self.callbacks = {}
-        # 添加文件传输消息队列
-        self.file_transfer_queue = queue.Queue()
-        self.uploading = False  # 标记是否正在上传
-        # 添加目录列表消息队列
-        self.dir_list_queue = queue.Queue()
-        self.listing_dir = False  # 标记是否正在获取目录列表
-        self.dir_list_lock = threading.Lock()  # 目录列表请求锁
-        # 添加文件下载消息队列和状态
-        self.download_queue = queue.Queue()
-        self.downloading = False  # 标记是否正在下载
-        self.download_lock = threading.Lock()  # 下载请求锁
-        # 添加文件列表消息队列
-        self.file_list_queue = queue.Queue()
-        self.listing_files = False  # 标记是否正在获取文件列表
-        self.file_list_lock = threading.Lock()  # 文件列表请求锁
-
-    def connect(self, host, port, password):
-        """连接到服务器"""
+        self.features = []  # 认证时协商的特性
+        self.typed_frames = False  # 是否使用类型帧
+        self.send_lock = threading.Lock()  # 多线程发送互斥，保证帧完整
+        self.chunk_size = 65536  # 64KB 块大小，与服务端下载保持一致
+        self.batch_workers = 8  # 批量下载时并行写入小文件的线程数
+        # 数据流下载在回复队列中最多积压的数据块数（每块最多1MB）；写盘跟不上时接收线程暂停读取，
+        # 由socket对服务端形成背压，不把整个文件缓存在内存中
+        self.stream_backlog = 16
+        self.transfer_window = 4  # 服务端不支持批量传输、但支持逻辑通道时，多个文件同时进行的传输数
+        # 终端输出流控：处理完输出后向服务端发放额度
+        self.flow_control = False
+        self.flow_window = Protocol.FLOW_WINDOW
+        self.auto_credit = True  # 为False时由界面在显示输出后调用 grant_credit
+        # 终端输出压缩：认证时请求，服务端同意后每个连接一个解压上下文
+        self.compress_output = True
+        self.decompressor = None
+        self.consumed_output = 0  # 已处理但尚未发放额度的字节数
+        self.credit_lock = threading.Lock()
+        # 会话接回：记录服务端分配的会话令牌和已收到的终端输出字节数
+        self.server_address = None
+        self.password = None
+        self.session_token = None
+        self.output_offset = 0
+        # 以观看者身份加入的共享会话: (会话令牌, 是否请求输入权限)
+        self.share = (None, False)
+        self.can_write = True
+        self.terminal = True  # 为False时连接不启动终端
+        # 等待回复的请求：请求ID（命令执行为exec_id）-> 接收回复的队列
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # 旧服务端的回复不带请求ID，请求只能逐个进行，回复交给当前请求
+        self.legacy_lock = threading.Lock()
+        self.legacy_request = None
+        # 不支持逻辑通道的服务端同一连接同时只接收一个上传的文件
+        self.upload_lock = threading.Lock()
+        # 逻辑通道：每个文件传输使用自己的通道（通道ID即请求ID），独立流控
+        self.channels = False
+        self.send_windows = {}  # 通道ID -> 上传的发送窗口
+        # 断点续传：传输中断后自动重连的次数和间隔（秒，按次数递增）
+        self.resume_attempts = 3
+        self.resume_delay = 1
+        self.generation = 0  # 每次连接成功加1，并发传输据此判断是否已有人重连
+        self.reconnect_lock = threading.Lock()
+        # 数据连接：文件传输使用另外的TCP连接，不与终端输出排在同一连接上
+        self.data_token = None  # 服务端为本连接分配的令牌，数据连接凭它认证
+        self.control_token = None  # 本连接是数据连接时，认证所用的令牌
+        self.data_count = 0  # 请求建立的数据连接数，重连后按此恢复
+        self.data_connections = []
+        self.bulk_transfers = {}  # 连接 -> 进行中的文件传输数
+        self.stripe_min_size = 16 * 1024 * 1024  # 不小于此大小的文件经多条数据连接分段并行下载
+        self.stripe_block = 4 * 1024 * 1024  # 分段下载时每次请求的块大小
+
+    def connect(self, host, port, password, share=None, write=False, terminal=True, timeout=10, data_token=None):
+        """
+        连接到服务器
+        指定 share 时以观看者身份加入该会话令牌对应的终端会话，write 请求输入权限
+        terminal 为False时服务端不启动终端，只用于执行命令和传输文件
+        指定 data_token 时作为该令牌所属控制连接的数据连接，不需要密码（见 open_data_connections）
+        """
         try:
+            if data_token:
+                terminal = False
+            # 换了服务器时不再尝试接回之前的会话
+            if self.server_address != (host, port):
+                self.session_token = None
+            self.server_address = (host, port)
+            self.password = password
+            self.share = (share, write)
+            self.terminal = terminal
+            self.control_token = data_token
+
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(10)
+            Protocol.set_nodelay(self.socket)
+            self.socket.settimeout(timeout)
             self.socket.connect((host, port))
 
-            # 发送认证
-            auth_msg = Protocol.pack_message(Protocol.MSG_AUTH, password)
-            self.socket.send(auth_msg)
+            # 发送认证（同时请求协商的特性）
+            self.typed_frames = False
+            features = Protocol.FEATURES
+            if not self.compress_output or not terminal:
+                features = [f for f in features if f != Protocol.FEATURE_COMPRESSION]
+            auth = {
+                'features': features,
+                'flow_window': self.flow_window
+            }
+            if data_token:
+                auth['data_token'] = data_token
+            else:
+                auth['password'] = password
+            if not terminal:
+                auth['terminal'] = False
+            elif share:
+                auth['share'] = share
+                auth['write'] = write
+            elif self.session_token:
+                auth['session_token'] = self.session_token
+                auth['resume_offset'] = self.output_offset
+            self.socket.sendall(Protocol.pack_message(Protocol.MSG_AUTH, auth))
 
             # 等待认证响应
             msg_type, payload = Protocol.receive_message(self.socket)
 
             if msg_type == Protocol.MSG_AUTH and payload.get('status') == 'success':
+                # 认证响应之后的所有帧按协商结果编码
+                self.features = payload.get('features', [])
+                self.typed_frames = Protocol.FEATURE_TYPED_FRAMES in self.features
+                self.flow_control = Protocol.FEATURE_FLOW_CONTROL in self.features
+                self.channels = self.typed_frames and Protocol.FEATURE_CHANNELS in self.features
+                self.decompressor = OutputDecompressor() if Protocol.FEATURE_COMPRESSION in self.features else None
+                self.consumed_output = 0
+                self.can_write = payload.get('can_write', True)
+                if share:
+                    print(f"已加入共享会话（{'可输入' if self.can_write else '只读'}）")
+                self.session_token = payload.get('session_token')
+                self.data_token = payload.get('data_token')
+                if payload.get('resumed'):
+                    print(f"已接回终端会话，从第 {self.output_offset} 字节继续接收输出")
+                else:
+                    self.output_offset = 0
                 self.connected = True
+                self.generation += 1
                 self.socket.settimeout(None)
 
                 # 启动接收线程
-                self.receive_thread = threading.Thread(target=self._receive_loop)
+                self.receive_thread = threading.Thread(target=self._receive_loop, args=(self.socket,))
                 self.receive_thread.daemon = True
                 self.receive_thread.start()
 
@@ -70,110 +187,498 @@ class ClientConnection:
         except Exception as e:
             return False, f"连接失败: {str(e)}"
 
+    def reconnect(self):
+        """
+        使用上次的地址和密码重新连接
+        服务端仍保留会话时接回原终端，只接收断开期间错过的输出
+        """
+        if not self.server_address:
+            return False, "尚未连接过服务器"
+        self.disconnect()
+        host, port = self.server_address
+        ok, message = self.connect(host, port, self.password, *self.share, terminal=self.terminal,
+                                   data_token=self.control_token)
+        if ok and self.data_count:
+            # 控制连接断开时服务端已关闭原来的数据连接，凭新令牌重新建立
+            self.open_data_connections(self.data_count)
+        return ok, message
+
     def disconnect(self):
-        """断开连接"""
+        """断开连接（同时关闭数据连接）"""
         self.connected = False
+        self.close_data_connections()
         if self.socket:
+            try:
+                # 先shutdown唤醒阻塞在recv上的接收线程
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             try:
                 self.socket.close()
             except:
                 pass
         self.socket = None
+        self._fail_pending()
+
+    def open_data_connections(self, count):
+        """
+        另外建立 count 条数据连接（凭服务端分配的令牌认证，绑定到本连接），
+        之后的文件传输经由数据连接进行，大文件传输不再拖慢终端交互；
+        count 大于1时多个传输分摊到各条连接，大文件分段并行下载（适合高延迟、高带宽的链路）
+        返回: 成功建立的数据连接数
+        """
+        self.close_data_connections()
+        self.data_count = count
+        if not self.connected or count <= 0:
+            return 0
+        if not self.data_token:
+            print("[数据连接] 服务器不支持数据连接，文件传输使用控制连接")
+            return 0
+        host, port = self.server_address
+        for _ in range(count):
+            conn = ClientConnection()
+            conn.chunk_size = self.chunk_size
+            conn.resume_attempts = self.resume_attempts
+            conn.resume_delay = self.resume_delay
+            conn.register_callback('file_progress', self._forward_progress)
+            ok, message = conn.connect(host, port, None, data_token=self.data_token)
+            if not ok:
+                print(f"[数据连接] 建立失败: {message}")
+                break
+            self.data_connections.append(conn)
+        print(f"[数据连接] 已建立 {len(self.data_connections)} 条数据连接")
+        return len(self.data_connections)
+
+    def close_data_connections(self):
+        """关闭数据连接，之后的文件传输使用控制连接"""
+        connections, self.data_connections = self.data_connections, []
+        for conn in connections:
+            conn.disconnect()
+        with self.pending_lock:
+            self.bulk_transfers.clear()
+
+    def _forward_progress(self, *args):
+        """数据连接上的传输进度交给本连接的回调"""
+        callback = self.callbacks.get('file_progress')
+        if callback:
+            callback(*args)
+
+    def _live_data_connections(self):
+        """当前可用的数据连接"""
+        return [conn for conn in self.data_connections if conn.connected]
+
+    @contextmanager
+    def _bulk_connection(self):
+        """选择进行中的传输最少的数据连接，没有可用的数据连接时使用本连接"""
+        connections = self._live_data_connections() or [self]
+        with self.pending_lock:
+            conn = min(connections, key=lambda c: self.bulk_transfers.get(c, 0))
+            self.bulk_transfers[conn] = self.bulk_transfers.get(conn, 0) + 1
+        try:
+            yield conn
+        finally:
+            with self.pending_lock:
+                if conn in self.bulk_transfers:
+                    self.bulk_transfers[conn] -= 1
+
+    def _send_message(self, msg_type, data, channel=0):
+        """打包并完整发送一条消息"""
+        msg = Protocol.pack_message(msg_type, data, self.typed_frames, channel)
+        sock = self.socket
+        if sock is None:
+            raise ConnectionError("连接已断开")
+        try:
+            with self.send_lock:
+                sock.sendall(msg)
+        except OSError as e:
+            raise ConnectionError(f"发送失败: {e}") from e
 
     def send_terminal_input(self, command):
         """发送终端输入"""
-        if not self.connected:
+        if not self.connected or not self.can_write:
             return False
 
         try:
-            msg = Protocol.pack_message(Protocol.MSG_TERMINAL_INPUT, command)
-            self.socket.send(msg)
+            self._send_message(Protocol.MSG_TERMINAL_INPUT, command)
             return True
         except Exception as e:
             print(f"发送终端输入失败: {e}")
             self.connected = False
             return False
 
-    def upload_file(self, file_path, target_path):
-        """上传文件"""
-        if not self.connected:
-            return False, "未连接到服务器"
+    def grant_credit(self, nbytes):
+        """
+        终端输出处理完成后发放流控额度
+        累计到窗口的1/4时才发送一次，避免每块输出都回一帧
+        """
+        if not self.flow_control or not self.connected or nbytes <= 0:
+            return
 
-        try:
-            # 设置上传标志
-            self.uploading = True
-            # 清空队列
-            while not self.file_transfer_queue.empty():
-                try:
-                    self.file_transfer_queue.get_nowait()
-                except:
-                    break
-
-            # 获取文件信息
-            filename = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
+        with self.credit_lock:
+            self.consumed_output += nbytes
+            if self.consumed_output < self.flow_window // 4:
+                return
+            amount, self.consumed_output = self.consumed_output, 0
 
-            # 发送文件上传请求
-            file_info = {
-                'filename': filename,
-                'target_path': target_path,
-                'size': file_size
-            }
-            msg = Protocol.pack_message(Protocol.MSG_FILE_UPLOAD, file_info)
-            self.socket.send(msg)
-
-            # 从队列等待服务器准备好（超时10秒）
-            try:
-                msg_type, payload = self.file_transfer_queue.get(timeout=10)
-                if msg_type != Protocol.MSG_FILE_UPLOAD or payload.get('status') != 'ready':
-                    self.uploading = False
-                    return False, "服务器未准备好接收文件"
-            except queue.Empty:
-                self.uploading = False
-                return False, "等待服务器响应超时"
+        try:
+            self._send_message(Protocol.MSG_FLOW_CREDIT, {'bytes': amount})
+        except Exception as e:
+            print(f"发送流控额度失败: {e}")
+
+    def exec_command(self, command, cwd=None, env=None, timeout=None, on_output=None):
+        """
+        在服务端执行命令（管道方式，不经过终端和登录shell）
+        可在多个线程中同时调用，各命令的输出互不干扰
+
+        Args:
+            command: 字符串（由/bin/sh执行）或参数列表
+            cwd: 工作目录
+            env: 额外的环境变量
+            timeout: 超时秒数，超时后服务端结束命令
+            on_output: 收到输出时调用 on_output(stream, data)，stream为 'stdout' 或 'stderr'
+        返回: {"returncode", "stdout", "stderr", "elapsed", "error"}
+        """
+        result = {"returncode": None, "stdout": b'', "stderr": b'', "elapsed": 0, "error": None}
+        if not self.connected:
+            result["error"] = "未连接到服务器"
+            return result
+        if Protocol.FEATURE_EXEC not in self.features:
+            result["error"] = "服务端不支持命令执行"
+            return result
 
-            # 读取并发送文件数据
-            with open(file_path, 'rb') as f:
-                sent_size = 0
+        try:
+            with self._request(reply_id=True) as (exec_id, replies):
+                self._send_message(Protocol.MSG_EXEC, {
+                    'exec_id': exec_id,
+                    'command': command,
+                    'cwd': cwd,
+                    'env': env,
+                    'timeout': timeout
+                })
+
+                output = {'stdout': bytearray(), 'stderr': bytearray()}
                 while True:
-                    chunk = f.read(8192)
-                    if not chunk:
+                    msg_type, payload = replies.get()
+                    if msg_type is None:
+                        result["error"] = "连接已断开"
+                        break
+                    if msg_type == Protocol.MSG_EXEC_OUTPUT:
+                        stream = payload.get('stream', 'stdout')
+                        output[stream] += payload['data']
+                        if on_output:
+                            on_output(stream, payload['data'])
+                    elif msg_type == Protocol.MSG_EXEC_EXIT:
+                        result["returncode"] = payload.get('returncode')
+                        result["elapsed"] = payload.get('elapsed', 0)
+                        result["error"] = payload.get('error')
                         break
 
-                    # 发送数据块
-                    import base64
-                    data_msg = Protocol.pack_message(
-                        Protocol.MSG_FILE_DATA,
-                        {'data': base64.b64encode(chunk).decode('ascii')}
-                    )
-                    self.socket.send(data_msg)
-
-                    sent_size += len(chunk)
+            result["stdout"] = bytes(output['stdout'])
+            result["stderr"] = bytes(output['stderr'])
+            return result
 
-                    # 调用进度回调
-                    if 'file_progress' in self.callbacks:
-                        progress = (sent_size / file_size * 100) if file_size > 0 else 0
-                        self.callbacks['file_progress'](progress, sent_size, file_size)
+        except Exception as e:
+            result["error"] = f"执行命令失败: {str(e)}"
+            return result
+
+    @contextmanager
+    def _request(self, reply_id=False):
+        """
+        登记一个等待回复的请求，返回 (请求ID, 回复队列)
+        协商了 request_id 时回复按ID分发，多个请求可以同时进行；
+        旧服务端的回复不带ID，请求只能逐个进行
+        reply_id=True 表示回复总是带ID（如命令执行的exec_id），无需逐个进行
+        """
+        legacy = not reply_id and Protocol.FEATURE_REQUEST_ID not in self.features
+        if legacy:
+            self.legacy_lock.acquire()
+        req_id = next(self.request_ids)
+        replies = queue.Queue()
+        with self.pending_lock:
+            self.pending[req_id] = replies
+            if legacy:
+                self.legacy_request = req_id
+        try:
+            yield req_id, replies
+        finally:
+            with self.pending_lock:
+                self.pending.pop(req_id, None)
+                if legacy:
+                    self.legacy_request = None
+            if legacy:
+                self.legacy_lock.release()
+
+    def _reply_queue(self, req_id):
+        """
+        查找等待回复的请求
+        不带ID的回复交给旧服务端模式下进行中的请求
+        返回: 回复队列，没有等待的请求时返回None
+        """
+        with self.pending_lock:
+            if req_id is None:
+                req_id = self.legacy_request
+            return self.pending.get(req_id)
+
+    def _put_stream_chunk(self, req_id, replies, chunk):
+        """
+        把数据流的一块交给下载线程，积压达到 stream_backlog 块时等它写盘
+        返回: 下载已放弃（请求已结束）或连接已断开时返回False
+        """
+        while replies.qsize() >= self.stream_backlog:
+            if not self.connected or self._reply_queue(req_id) is not replies:
+                return False
+            time.sleep(0.005)
+        replies.put((Protocol.MSG_FILE_DATA, chunk))
+        return True
+
+    def _fail_pending(self):
+        """连接断开时唤醒所有等待回复的请求和等待通道额度的上传"""
+        with self.pending_lock:
+            for replies in self.pending.values():
+                replies.put((None, None))
+        for window in list(self.send_windows.values()):
+            window.close()
 
-            # 发送完成消息
-            complete_msg = Protocol.pack_message(Protocol.MSG_FILE_COMPLETE, {})
-            self.socket.send(complete_msg)
+    def upload_file(self, file_path, target_path):
+        """
+        上传文件
+        使用逻辑通道时多个上传可以同时进行，否则依次进行；
+        服务端支持续传时，连接中断后自动重连，从服务端已收到的位置继续
+        """
+        try:
+            return self._upload_file(file_path, target_path)
+        except ConnectionError as e:
+            return False, str(e)
+
+    @_bulk
+    def _upload_file(self, file_path, target_path):
+        """上传文件；连接中断且续传的次数用完时抛出 ConnectionError"""
+        return self._with_resume(self._upload_once, file_path, target_path)
+
+    def _upload_once(self, file_path, target_path):
+        """上传一次；连接中断时抛出 ConnectionError"""
+        channel = 0
+        hasher = StreamHasher()
+        try:
+            with nullcontext() if self.channels else self.upload_lock, self._request() as (req_id, replies):
+                if self.channels:
+                    channel = req_id
+                # 获取文件信息
+                filename = os.path.basename(file_path)
+                stat = os.stat(file_path)
+                file_size = stat.st_size
+
+                # 发送文件上传请求
+                file_info = {
+                    'filename': filename,
+                    'target_path': target_path,
+                    'size': file_size,
+                    'checksum': 'blake2b',
+                    'req_id': req_id
+                }
+                if channel:
+                    file_info['channel'] = channel
+                resumable = Protocol.FEATURE_RESUME in self.features
+                if resumable:
+                    # 同一文件传到同一位置时ID相同，服务端据此找到上次未传完的数据
+                    file_info['transfer_id'] = transfer_id(
+                        os.path.abspath(file_path), file_size, stat.st_mtime_ns, target_path)
+                self._send_message(Protocol.MSG_FILE_UPLOAD, file_info)
 
-            # 从队列等待确认（超时10秒）
-            try:
-                msg_type, payload = self.file_transfer_queue.get(timeout=10)
-                self.uploading = False
+                # 等待服务器准备好（超时10秒）
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '服务器未准备好接收文件')
+                if msg_type != Protocol.MSG_FILE_UPLOAD or payload.get('status') != 'ready':
+                    return False, "服务器未准备好接收文件"
+                offset = payload.get('offset', 0)
+                if offset:
+                    print(f"[DEBUG] 服务端已有 {offset} 字节，从此处续传")
+                    hasher.update_file(file_path, 0, offset)
+                window = None
+                if channel:
+                    window = self.send_windows[channel] = SendWindow(payload.get('window', Protocol.CHANNEL_WINDOW))
+
+                # 读取并发送文件数据
+                with open(file_path, 'rb') as f:
+                    f.seek(offset)
+                    sent_size = offset
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+
+                        # 发送数据块：类型帧直接发送原始字节，旧服务端仍使用base64包装
+                        if window:
+                            # 未确认的数据不超过服务端的窗口，服务端写入磁盘后发放额度
+                            window.acquire(len(chunk), timeout=30)
+                            self._send_message(Protocol.MSG_FILE_DATA, chunk, channel)
+                        elif self.typed_frames:
+                            self._send_message(Protocol.MSG_FILE_DATA, chunk)
+                        else:
+                            import base64
+                            self._send_message(
+                                Protocol.MSG_FILE_DATA,
+                                {'data': base64.b64encode(chunk).decode('ascii')}
+                            )
+
+                        sent_size += len(chunk)
+
+                        # 调用进度回调
+                        if 'file_progress' in self.callbacks:
+                            progress = (sent_size / file_size * 100) if file_size > 0 else 0
+                            self.callbacks['file_progress'](progress, sent_size, file_size)
+
+                # 发送完成消息，带上发送数据的摘要由服务端校验
+                digest = hasher.hexdigest()
+                complete = {'req_id': req_id, 'blake2b': digest}
+                if channel:
+                    complete['channel'] = channel
+                self._send_message(Protocol.MSG_FILE_COMPLETE, complete)
+
+                # 等待确认（超时10秒）
+                try:
+                    msg_type, payload = replies.get(timeout=10)
+                except queue.Empty:
+                    return False, "等待服务器确认超时"
+                if msg_type is None:
+                    raise ConnectionError("连接已断开")
                 if msg_type == Protocol.MSG_FILE_COMPLETE and payload.get('status') == 'success':
+                    if payload.get('blake2b', digest) != digest:
+                        return False, "文件校验失败，服务器收到的数据与本地文件不一致"
                     return True, f"文件上传成功: {payload.get('path')}"
-                else:
-                    return False, "文件上传失败"
-            except queue.Empty:
-                self.uploading = False
-                return False, "等待服务器确认超时"
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '文件上传失败')
+                return False, "文件上传失败"
 
+        except ConnectionError:
+            raise
         except Exception as e:
-            self.uploading = False
             return False, f"上传文件失败: {str(e)}"
+        finally:
+            self.send_windows.pop(channel, None)
+            hasher.close()
+
+    def _with_resume(self, transfer, *args):
+        """
+        执行一次文件传输；服务端支持续传时，连接中断后重连并再次执行，
+        服务端和本地的 .part 文件保证只传剩下的部分，最多重试 resume_attempts 次；
+        仍然中断时抛出 ConnectionError
+        """
+        if not self.connected:
+            raise ConnectionError("未连接到服务器")
+        resumable = Protocol.FEATURE_RESUME in self.features
+        retries = 0
+        while True:
+            generation = self.generation
+            try:
+                return transfer(*args)
+            except ConnectionError as e:
+                error = str(e) or "连接已断开"
+            if not resumable or retries >= self.resume_attempts:
+                raise ConnectionError(error)
+            retries += 1
+            print(f"[文件传输] 连接中断（{error}），第 {retries} 次重连后续传")
+            time.sleep(self.resume_delay * retries)
+            self._restore_connection(generation)
+
+    def _restore_connection(self, generation):
+        """传输中断后重新连接；同时进行的其他传输已经重连过时直接使用新连接"""
+        with self.reconnect_lock:
+            if self.connected and self.generation != generation:
+                return True
+            ok, message = self.reconnect()
+            print(f"[文件传输] 重新连接: {message}")
+            return ok
+
+    def _wait_reply(self, replies, timeout, message):
+        """等待一条回复；超时或连接断开时抛出 ConnectionError"""
+        try:
+            msg_type, payload = replies.get(timeout=timeout)
+        except queue.Empty:
+            raise ConnectionError(message)
+        if msg_type is None:
+            raise ConnectionError("连接已断开")
+        return msg_type, payload
+
+    @_bulk
+    def upload_delta(self, file_path, target_path):
+        """
+        增量上传：服务端已有同名文件时只发送变化的部分
+        服务端不支持时退回普通上传
+        """
+        if not self.connected:
+            return False, "未连接到服务器"
+        if Protocol.FEATURE_DELTA not in self.features or not self.typed_frames:
+            return self.upload_file(file_path, target_path)
+
+        hasher = StreamHasher()
+        try:
+            with self._request() as (req_id, replies):
+                filename = os.path.basename(file_path)
+                file_size = os.path.getsize(file_path)
+                # 新文件的摘要由哈希线程读取计算，与查找变化同时进行
+                hasher.update_file(file_path, 0, file_size)
+
+                # 请求服务端已有文件的块签名（大文件需要时间，超时60秒）
+                self._send_message(Protocol.MSG_DELTA_SIGNATURE, {
+                    'filename': filename,
+                    'target_path': target_path,
+                    'req_id': req_id
+                })
+                msg_type, payload = self._wait_reply(replies, 60, "等待服务器签名超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '增量上传失败')
+                if msg_type != Protocol.MSG_DELTA_SIGNATURE or payload.get('status') != 'ready':
+                    return False, "服务器未准备好接收文件"
+                block_size = payload.get('block_size', 0)
+                index = parse_signature(payload.get('data', b''), block_size, payload.get('size', 0)) if block_size else {}
+
+                # 发送复制指令和变化的数据
+                sent_size = 0
+                position = 0
+                with open(file_path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if file_size else b''
+                    try:
+                        for op in compute_delta(data, index, block_size):
+                            if op[0] == 'copy':
+                                self._send_message(Protocol.MSG_DELTA_DATA, {'req_id': req_id, 'copy': [op[1], op[2]]})
+                                position += op[2] * block_size
+                            else:
+                                for start in range(op[1], op[2], self.chunk_size):
+                                    chunk = data[start:min(start + self.chunk_size, op[2])]
+                                    self._send_message(Protocol.MSG_DELTA_DATA, {'req_id': req_id, 'data': chunk})
+                                    sent_size += len(chunk)
+                                position = op[2]
+
+                            # 调用进度回调
+                            if 'file_progress' in self.callbacks:
+                                progress = (position / file_size * 100) if file_size > 0 else 0
+                                self.callbacks['file_progress'](progress, position, file_size)
+                    finally:
+                        if file_size:
+                            data.close()
+
+                # 发送完成消息，服务端校验新文件的大小和摘要后替换目标文件
+                self._send_message(Protocol.MSG_DELTA_COMPLETE, {
+                    'req_id': req_id,
+                    'size': file_size,
+                    'blake2b': hasher.hexdigest()
+                })
+                msg_type, payload = self._wait_reply(replies, 30, "等待服务器确认超时")
+                if msg_type == Protocol.MSG_DELTA_COMPLETE and payload.get('status') == 'success':
+                    return True, f"增量上传成功: {payload.get('path')}（发送 {sent_size}/{file_size} 字节）"
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '增量上传失败')
+                return False, "增量上传失败"
+
+        except ConnectionError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"增量上传失败: {str(e)}"
+        finally:
+            hasher.close()
 
     def check_update(self):
         """检查更新"""
@@ -181,189 +686,689 @@ class ClientConnection:
             return None
 
         try:
-            msg = Protocol.pack_message(Protocol.MSG_UPDATE_CHECK, {})
-            self.socket.send(msg)
+            self._send_message(Protocol.MSG_UPDATE_CHECK, {})
             return True
         except Exception as e:
             print(f"检查更新失败: {e}")
             return False
 
     def list_dir(self, path='/'):
-        """获取远程目录列表"""
-        if not self.connected:
-            return None, "未连接到服务器"
-
-        # 使用锁确保一次只有一个目录列表请求
-        with self.dir_list_lock:
-            try:
-                print(f"[DEBUG] 开始请求目录列表: {path}")
-                # 设置列表标志
-                self.listing_dir = True
-                # 清空队列
-                while not self.dir_list_queue.empty():
-                    try:
-                        self.dir_list_queue.get_nowait()
-                    except:
-                        break
-
-                # 发送目录列表请求
-                msg = Protocol.pack_message(Protocol.MSG_LIST_DIR, {'path': path})
-                self.socket.send(msg)
-                print(f"[DEBUG] 已发送目录列表请求，等待响应...")
-
-                # 从队列等待响应（超时10秒，增加超时时间）
-                try:
-                    msg_type, payload = self.dir_list_queue.get(timeout=10)
-                    print(f"[DEBUG] 收到响应: msg_type={msg_type}, payload={payload}")
-                    self.listing_dir = False
-                    if msg_type == Protocol.MSG_LIST_DIR:
-                        return payload, None
-                    elif msg_type == Protocol.MSG_ERROR:
-                        return None, payload.get('error', '未知错误')
-                    else:
-                        return None, "响应格式错误"
-                except queue.Empty:
-                    self.listing_dir = False
-                    print(f"[DEBUG] 等待响应超时！listing_dir={self.listing_dir}")
-                    return None, "等待服务器响应超时"
-
-            except Exception as e:
-                self.listing_dir = False
-                print(f"[DEBUG] 异常: {e}")
-                return None, f"获取目录列表失败: {str(e)}"
+        """获取远程目录列表（只包含目录）"""
+        return self._list(Protocol.MSG_LIST_DIR, path, "目录列表")
 
     def list_files(self, path='/'):
         """获取远程文件和文件夹列表"""
+        return self._list(Protocol.MSG_FILE_LIST, path, "文件列表")
+
+    def _list(self, msg_type, path, name):
+        """
+        发送列表请求并等待回复，可在多个线程中同时调用
+        返回: (结果, 错误信息)
+        """
         if not self.connected:
             return None, "未连接到服务器"
 
-        with self.file_list_lock:
-            try:
-                print(f"[DEBUG] 开始请求文件列表: {path}")
-                # 设置列表标志
-                self.listing_files = True
-                # 清空队列
-                while not self.file_list_queue.empty():
-                    try:
-                        self.file_list_queue.get_nowait()
-                    except:
-                        break
-
-                # 发送文件列表请求
-                msg = Protocol.pack_message(Protocol.MSG_FILE_LIST, {'path': path})
-                self.socket.send(msg)
-                print(f"[DEBUG] 已发送文件列表请求，等待响应...")
+        try:
+            with self._request() as (req_id, replies):
+                print(f"[DEBUG] 开始请求{name}: {path} (req_id={req_id})")
+                self._send_message(msg_type, {'path': path, 'req_id': req_id})
 
-                # 从队列等待响应（超时10秒）
+                # 等待响应（超时10秒）
                 try:
-                    msg_type, payload = self.file_list_queue.get(timeout=10)
-                    print(f"[DEBUG] 收到响应: msg_type={msg_type}")
-                    self.listing_files = False
-                    if msg_type == Protocol.MSG_FILE_LIST and payload.get('status') == 'success':
-                        return payload, None
-                    elif msg_type == Protocol.MSG_ERROR:
-                        return None, payload.get('error', '未知错误')
-                    else:
-                        return None, "响应格式错误"
+                    reply_type, payload = replies.get(timeout=10)
                 except queue.Empty:
-                    self.listing_files = False
-                    print(f"[DEBUG] 等待文件列表响应超时！")
+                    print(f"[DEBUG] 等待{name}响应超时！")
                     return None, "等待服务器响应超时"
+        except Exception as e:
+            print(f"[DEBUG] 获取{name}异常: {e}")
+            return None, f"获取{name}失败: {str(e)}"
 
-            except Exception as e:
-                self.listing_files = False
-                print(f"[DEBUG] 获取文件列表异常: {e}")
-                return None, f"获取文件列表失败: {str(e)}"
+        if reply_type is None:
+            return None, "连接已断开"
+        if reply_type == Protocol.MSG_ERROR:
+            return None, payload.get('error', '未知错误')
+        if reply_type == msg_type and payload.get('status', 'success') == 'success':
+            return payload, None
+        return None, "响应格式错误"
 
     def download_file(self, remote_file_path, local_save_path):
-        """下载文件"""
-        if not self.connected:
-            return False, "未连接到服务器"
-
-        with self.download_lock:
+        """
+        下载文件（服务端支持请求ID时可同时进行多个下载和其他请求）
+        服务端支持续传时先写入本地的 .part 文件，连接中断后自动重连，
+        从已收到的位置继续，校验整个文件的摘要后才改名为目标文件；
+        有多条数据连接时按块下载，不小于 stripe_min_size 的文件由各条连接并行下载
+        """
+        try:
+            return self._download_file(remote_file_path, local_save_path)
+        except ConnectionError as e:
+            return False, str(e)
+
+    def _download_file(self, remote_file_path, local_save_path):
+        """下载文件；连接中断且续传的次数用完时抛出 ConnectionError"""
+        connections = self._live_data_connections()
+        if len(connections) > 1:
+            return self._download_striped(connections, remote_file_path, local_save_path)
+        with self._bulk_connection() as conn:
+            return conn._with_resume(conn._download_once, remote_file_path, local_save_path)
+
+    def _download_striped(self, connections, remote_file_path, local_save_path):
+        """
+        把文件按 stripe_block 分块，各条连接依次领取未完成的块，并行下载到 .part 文件的对应位置，
+        每块分别校验摘要，全部成功后改名为目标文件
+        第一块的响应带回文件大小和修改时间，据此算出传输ID并分配其余的块，不需要另外查询文件大小；
+        校验通过的块记入 .part 旁的 .blocks 文件，中断后再次下载同一文件时只下载其余的块（连接数可以不同）
+        返回: (是否成功, 信息)；有连接中断时抛出 ConnectionError
+        """
+        block = self.stripe_block
+        state = {}
+        blocks = queue.Queue()
+        failed = []
+        interrupted = []
+        started = threading.Event()
+        lock = threading.Lock()
+
+        def on_ready(reply):
+            """每块的响应：第一块确定 .part 文件和其余的块，之后的块确认文件未被修改"""
+            with lock:
+                if not state:
+                    size = reply.get('size', 0)
+                    tid = transfer_id(*self.server_address, remote_file_path, os.path.abspath(local_save_path),
+                                      size, reply.get('mtime'))
+                    save_path = part_path(local_save_path, tid)
+                    done = self._stripes_done(save_path + '.blocks') if os.path.isfile(save_path) else set()
+                    if not done:
+                        with open(save_path, 'wb') as f:
+                            f.truncate(size)
+                    for offset in range(block, size, block):
+                        if offset not in done:
+                            blocks.put(offset)
+                    state.update(size=size, mtime=reply.get('mtime'), save_path=save_path,
+                                 received=sum(min(block, size - offset) for offset in done if offset),
+                                 workers=len(connections) if size >= self.stripe_min_size else 1)
+                    print(f"[DEBUG] 分段下载文件: {remote_file_path}, 大小: {size}, "
+                          f"{-(-size // block)} 块, 已完成 {len(done)} 块, {state['workers']} 条连接")
+                    if done:
+                        print(f"[DEBUG] 续传分段下载，跳过已校验的块")
+                elif (reply.get('size'), reply.get('mtime')) != (state['size'], state['mtime']):
+                    raise ValueError("文件在下载期间被修改")
+                return state['save_path']
+
+        def on_data(nbytes):
+            with lock:
+                state['received'] += nbytes
+                done, size = state['received'], state['size']
+            self._forward_progress(done / size * 100 if size else 100, done, size)
+
+        def download(conn, offset, length):
             try:
-                # 设置下载标志
-                self.downloading = True
-                # 清空队列
-                while not self.download_queue.empty():
-                    try:
-                        self.download_queue.get_nowait()
-                    except:
-                        break
+                ok, message = conn._download_range(remote_file_path, offset, length, on_ready, on_data)
+            except ConnectionError as e:
+                interrupted.append(str(e) or "连接已断开")
+                return False
+            if not ok:
+                failed.append(message)
+                return False
+            try:
+                with lock, open(state['save_path'] + '.blocks', 'a') as f:
+                    f.write(f"{offset}\n")
+            except OSError as e:
+                failed.append(f"记录已完成的块失败: {str(e)}")
+                return False
+            return True
 
-                print(f"[DEBUG] 开始下载文件: {remote_file_path}")
+        def worker(index, conn):
+            if index == 0:
+                # 第一块的响应到达之前不知道文件大小，其他连接等它分配好块再开始
+                try:
+                    download(conn, 0, block)
+                finally:
+                    started.set()
+            else:
+                started.wait()
+                if failed or interrupted or index >= state['workers']:
+                    return
+            while not failed and not interrupted:
+                try:
+                    offset = blocks.get_nowait()
+                except queue.Empty:
+                    return
+                download(conn, offset, min(block, state['size'] - offset))
+
+        with ThreadPoolExecutor(len(connections)) as pool:
+            list(pool.map(worker, range(len(connections)), connections))
+        if interrupted:
+            raise ConnectionError(f"分段下载中断: {interrupted[0]}")
+        if failed:
+            return False, f"分段下载失败: {failed[0]}"
+        try:
+            os.replace(state['save_path'], local_save_path)
+            os.remove(state['save_path'] + '.blocks')
+            return True, f"文件下载成功: {local_save_path}"
+        except OSError as e:
+            return False, f"下载文件失败: {str(e)}"
+
+    @staticmethod
+    def _stripes_done(record_path):
+        """已下载并校验通过的块的起始位置"""
+        try:
+            with open(record_path) as f:
+                return {int(line) for line in f if line.strip().isdigit()}
+        except OSError:
+            return set()
+
+    def _download_range(self, remote_file_path, offset, length, on_ready, on_data=None):
+        """
+        下载文件从 offset 开始的 length 字节并校验摘要
+        收到服务端的响应后调用 on_ready(响应)，返回值为写入的文件（写到相同位置）；
+        收到数据时调用 on_data(字节数)
+        返回: (True, 文件大小) 或 (False, 错误信息)；连接中断或超时时抛出 ConnectionError
+        """
+        hasher = StreamHasher()
+        try:
+            with self._request() as (req_id, replies):
+                request = {
+                    'file_path': remote_file_path,
+                    'offset': offset,
+                    'length': length,
+                    'stream': Protocol.FEATURE_FILE_STREAM in self.features,
+                    'checksum': 'blake2b',
+                    'req_id': req_id
+                }
+                window = None
+                if self.channels:
+                    request['channel'] = req_id
+                    request['window'] = Protocol.CHANNEL_WINDOW
+                    window = ReceiveWindow(Protocol.CHANNEL_WINDOW)
+                self._send_message(Protocol.MSG_FILE_DOWNLOAD, request)
+
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '下载失败')
+                if msg_type != Protocol.MSG_FILE_DOWNLOAD or payload.get('status') != 'ready':
+                    return False, "服务器未准备好发送文件"
+                if payload.get('stream'):
+                    window = None  # 服务端改用数据流发送，不在通道上流控
+                size = payload.get('size', 0)
+                length = payload.get('length', length)  # 超出文件末尾的部分由服务端截掉
+
+                with open(on_ready(payload), 'r+b') as f:
+                    f.seek(offset)
+                    while True:
+                        msg_type, payload = self._wait_reply(replies, 30, "接收文件数据超时")
+                        if msg_type == Protocol.MSG_FILE_DATA:
+                            f.write(payload)
+                            hasher.update(payload)
+                            if window:
+                                credit = window.consume(len(payload))
+                                if credit:
+                                    self._send_message(Protocol.MSG_FLOW_CREDIT, {'channel': req_id, 'bytes': credit})
+                            if on_data:
+                                on_data(len(payload))
+                        elif msg_type == Protocol.MSG_FILE_COMPLETE:
+                            if payload.get('status') != 'success' or payload.get('size') != length:
+                                return False, "文件下载失败"
+                            break
+                        elif msg_type == Protocol.MSG_ERROR:
+                            return False, payload.get('error', '下载失败')
+
+            expected = payload.get('blake2b')
+            if expected and hasher.hexdigest() != expected:
+                return False, f"第 {offset} 字节开始的分段校验失败"
+            return True, size
+
+        except ConnectionError:
+            raise
+        except Exception as e:
+            return False, f"下载文件失败: {str(e)}"
+        finally:
+            hasher.close()
 
-                # 发送文件下载请求
-                msg = Protocol.pack_message(
-                    Protocol.MSG_FILE_DOWNLOAD,
-                    {'file_path': remote_file_path}
-                )
-                self.socket.send(msg)
+    def _download_once(self, remote_file_path, local_save_path):
+        """下载一次；连接中断时抛出 ConnectionError"""
+        hasher = StreamHasher()
+        try:
+            save_path = local_save_path
+            offset = 0
+            resumable = Protocol.FEATURE_RESUME in self.features
+            if resumable:
+                tid = transfer_id(*self.server_address, remote_file_path, os.path.abspath(local_save_path))
+                save_path = part_path(local_save_path, tid)
+                if os.path.isfile(save_path):
+                    offset = os.path.getsize(save_path)
+
+            with self._request() as (req_id, replies):
+                print(f"[DEBUG] 开始下载文件: {remote_file_path} (req_id={req_id})")
+
+                # 发送文件下载请求；使用逻辑通道时数据在通道上分帧发送，与终端输出交错
+                request = {
+                    'file_path': remote_file_path,
+                    'stream': Protocol.FEATURE_FILE_STREAM in self.features,
+                    'checksum': 'blake2b',
+                    'req_id': req_id
+                }
+                if resumable:
+                    request['transfer_id'] = tid
+                    request['offset'] = offset
+                window = None
+                if self.channels:
+                    request['channel'] = req_id
+                    request['window'] = Protocol.CHANNEL_WINDOW
+                    window = ReceiveWindow(Protocol.CHANNEL_WINDOW)
+                self._send_message(Protocol.MSG_FILE_DOWNLOAD, request)
 
                 # 等待服务器准备好（超时10秒）
-                try:
-                    msg_type, payload = self.download_queue.get(timeout=10)
-                    if msg_type == Protocol.MSG_ERROR:
-                        self.downloading = False
-                        return False, payload.get('error', '下载失败')
-                    if msg_type != Protocol.MSG_FILE_DOWNLOAD or payload.get('status') != 'ready':
-                        self.downloading = False
-                        return False, "服务器未准备好发送文件"
-                except queue.Empty:
-                    self.downloading = False
-                    return False, "等待服务器响应超时"
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '下载失败')
+                if msg_type != Protocol.MSG_FILE_DOWNLOAD or payload.get('status') != 'ready':
+                    return False, "服务器未准备好发送文件"
 
-                # 获取文件信息
+                if payload.get('stream'):
+                    window = None  # 服务端改用数据流发送，不在通道上流控
+
+                # 获取文件信息；服务端从它确认的位置开始发送
                 filename = payload.get('filename', 'download')
                 file_size = payload.get('size', 0)
+                offset = payload.get('offset', 0)
 
                 print(f"[DEBUG] 开始接收文件数据: {filename}, 大小: {file_size}")
+                if offset:
+                    print(f"[DEBUG] 本地已有 {offset} 字节，从此处续传")
+                    hasher.update_file(save_path, 0, offset)
+
+                # 接收文件数据并保存
+                received_size = offset
+                with open(save_path, 'r+b' if offset else 'wb') as f:
+                    f.seek(offset)
+                    f.truncate()
+                    while True:
+                        msg_type, payload = self._wait_reply(replies, 30, "接收文件数据超时")
+
+                        if msg_type == Protocol.MSG_FILE_DATA:
+                            # 写入数据块
+                            if isinstance(payload, (bytes, bytearray)):
+                                f.write(payload)
+                                hasher.update(payload)
+                                received_size += len(payload)
+                            elif isinstance(payload, dict) and 'data' in payload:
+                                import base64
+                                data = base64.b64decode(payload['data'])
+                                f.write(data)
+                                hasher.update(data)
+                                received_size += len(data)
+
+                            # 写入磁盘后向服务端发放通道额度
+                            if window:
+                                credit = window.consume(len(payload))
+                                if credit:
+                                    self._send_message(Protocol.MSG_FLOW_CREDIT, {'channel': req_id, 'bytes': credit})
+
+                            # 调用进度回调
+                            if 'file_progress' in self.callbacks:
+                                progress = (received_size / file_size * 100) if file_size > 0 else 0
+                                self.callbacks['file_progress'](progress, received_size, file_size)
+
+                        elif msg_type == Protocol.MSG_FILE_COMPLETE:
+                            # 文件传输完成
+                            print(f"[DEBUG] 文件下载完成: {received_size} 字节")
+                            if payload.get('status') != 'success':
+                                return False, "文件下载失败"
+                            break
+
+                        elif msg_type == Protocol.MSG_ERROR:
+                            return False, payload.get('error', '下载失败')
+
+            # 与服务端发送数据的摘要比较，可续传的下载校验通过后再改名为目标文件
+            expected = payload.get('blake2b')
+            if expected and hasher.hexdigest() != expected:
+                os.remove(save_path)
+                return False, "文件校验失败，已删除下载的数据"
+            if save_path != local_save_path:
+                os.replace(save_path, local_save_path)
+            return True, f"文件下载成功: {local_save_path}"
+
+        except ConnectionError:
+            raise
+        except Exception as e:
+            print(f"[DEBUG] 下载文件异常: {e}")
+            return False, f"下载文件失败: {str(e)}"
+        finally:
+            hasher.close()
+
+    @_bulk
+    def upload_dir(self, local_dir, target_path, include=None, exclude=None):
+        """
+        上传整个目录：打包为tar数据流边读边发送，服务端边收边解包到 target_path 下
+        include/exclude 为路径规则列表（见 common/archive.py）
+        """
+        if not os.path.isdir(local_dir):
+            return False, f"目录不存在: {local_dir}"
+        ok, result = self._upload_archive(lambda output: write_tree(output, local_dir, include or (), exclude or ()), target_path)
+        if not ok:
+            return False, result
+        return True, (f"目录上传成功: {os.path.join(result.get('path', target_path), os.path.basename(os.path.abspath(local_dir)))}"
+                      f"（{result.get('files', 0)} 个文件，{result.get('bytes', 0)} 字节）"
+                      + self._skipped_note(result['skipped']))
+
+    @_bulk
+    def upload_files(self, file_paths, target_path):
+        """
+        上传多个文件到 target_path：所有文件打包为一个tar数据流，
+        小文件首尾相接共用数据帧，不再每个文件等待一次服务端的回复
+        服务端不支持时逐个上传
+        """
+        if Protocol.FEATURE_DIR_STREAM not in self.features or not self.typed_frames:
+            transfers = TransferQueue(self, self._queue_window())
+            for file_path in file_paths:
+                transfers.upload(file_path, target_path)
+            return self._run_queue(transfers, "上传")
+
+        ok, result = self._upload_archive(lambda output: write_files(output, file_paths), target_path)
+        if not ok:
+            return False, result
+        return self._batch_result("上传", len(file_paths), result['skipped'])
+
+    def _upload_archive(self, write, target_path):
+        """
+        把 write(输出) 写出的tar数据流发送给服务端解包到 target_path
+        返回: (True, 服务端的结果，skipped 为本地打包和服务端解包时跳过的文件) 或 (False, 错误信息)
+        """
+        if not self.connected:
+            return False, "未连接到服务器"
+        if Protocol.FEATURE_DIR_STREAM not in self.features or not self.typed_frames:
+            return False, "服务器不支持目录传输"
+
+        channel = 0
+        try:
+            with self._request() as (req_id, replies):
+                request = {'target_path': target_path, 'req_id': req_id}
+                if self.channels:
+                    channel = request['channel'] = req_id
+                self._send_message(Protocol.MSG_DIR_UPLOAD, request)
+
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '服务器未准备好接收目录')
+                if msg_type != Protocol.MSG_DIR_UPLOAD or payload.get('status') != 'ready':
+                    return False, "服务器未准备好接收目录"
+                window = None
+                if channel:
+                    window = self.send_windows[channel] = SendWindow(payload.get('window', Protocol.CHANNEL_WINDOW))
+
+                def send(chunk):
+                    if window:
+                        # 未确认的数据不超过服务端的窗口，服务端解包写入磁盘后发放额度
+                        window.acquire(len(chunk), timeout=30)
+                    self._send_message(Protocol.MSG_DIR_DATA, {'req_id': req_id, 'data': chunk}, channel)
+                    if 'file_progress' in self.callbacks:
+                        # 数据流总长度未知，只报告已发送的字节数
+                        self.callbacks['file_progress'](0, output.total, 0)
+
+                output = ChunkWriter(send)
+                try:
+                    stats = write(output)
+                except OSError as e:
+                    # 文件写到一半读取失败，数据流已不完整：仍然结束数据流，让服务端解包出错后释放
+                    output.flush()
+                    self._send_message(Protocol.MSG_DIR_COMPLETE, {'req_id': req_id})
+                    self._wait_reply(replies, 60, "等待服务器确认超时")
+                    return False, f"读取文件失败，上传中止: {e}"
+                output.flush()
+                for skipped in stats['skipped']:
+                    print(f"[DEBUG] 跳过无法读取的文件: {skipped}")
+
+                # 数据流结束，服务端解包完剩余数据后回复
+                self._send_message(Protocol.MSG_DIR_COMPLETE, {'req_id': req_id})
+                msg_type, payload = self._wait_reply(replies, 60, "等待服务器确认超时")
+                if msg_type == Protocol.MSG_DIR_COMPLETE and payload.get('status') == 'success':
+                    payload['skipped'] = stats['skipped'] + payload.get('skipped', [])
+                    return True, payload
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '目录上传失败')
+                return False, "目录上传失败"
+
+        except ConnectionError as e:
+            return False, str(e)
+        except Exception as e:
+            return False, f"上传目录失败: {str(e)}"
+        finally:
+            self.send_windows.pop(channel, None)
+
+    def _queue_window(self):
+        """
+        逐个传输多个文件时同时进行的传输数
+        回复按请求ID分发、数据走各自的逻辑通道时多个传输才能交错，否则只能一个接一个
+        """
+        if Protocol.FEATURE_REQUEST_ID in self.features and self.channels:
+            return self.transfer_window
+        return 1
+
+    def _run_queue(self, transfers, action):
+        """逐个传输多个文件（见 _queue_window），返回与批量传输相同格式的结果"""
+        failed = [f"{(os.path if r['kind'] == 'upload' else posixpath).basename(r['source'])}: {r['message']}"
+                  for r in transfers.run() if not r['ok']]
+        summary = transfers.summary()
+        print(f"[文件传输] {summary['succeeded']}/{summary['total']} 个文件, {summary['bytes']} 字节, "
+              f"耗时 {summary['elapsed']:.2f} 秒, 平均延迟 {summary['latency']['avg'] or 0:.3f} 秒")
+        return self._batch_result(action, summary['total'], failed)
+
+    @staticmethod
+    def _skipped_note(skipped):
+        """目录传输结果中跳过的条目（无法读取的文件、指向目录外的链接等）"""
+        if not skipped:
+            return ""
+        return f"，跳过 {len(skipped)} 个:\n" + "\n".join(skipped)
+
+    @staticmethod
+    def _batch_result(action, total, failed):
+        """多个文件传输的结果：全部成功才算成功，失败的文件逐个列出"""
+        if not failed:
+            return True, f"{total} 个文件{action}成功"
+        return False, f"{total - len(failed)}/{total} 个文件{action}成功，失败:\n" + "\n".join(failed)
+
+    @_bulk
+    def download_dir(self, remote_dir, local_dir, include=None, exclude=None):
+        """
+        下载整个目录：服务端边打包边发送tar数据流，本地边收边解包到 local_dir 下
+        include/exclude 为路径规则列表（见 common/archive.py）
+        """
+        if not self.connected:
+            return False, "未连接到服务器"
+        if Protocol.FEATURE_DIR_STREAM not in self.features or not self.typed_frames:
+            return False, "服务器不支持目录传输"
 
-                # 准备保存文件
+        try:
+            with self._request() as (req_id, replies):
+                request = {
+                    'path': remote_dir,
+                    'include': list(include or ()),
+                    'exclude': list(exclude or ()),
+                    'req_id': req_id
+                }
+                window = None
+                if self.channels:
+                    request['channel'] = req_id
+                    request['window'] = Protocol.CHANNEL_WINDOW
+                    window = ReceiveWindow(Protocol.CHANNEL_WINDOW)
+                self._send_message(Protocol.MSG_DIR_DOWNLOAD, request)
+
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '目录下载失败')
+                if msg_type != Protocol.MSG_DIR_DOWNLOAD or payload.get('status') != 'ready':
+                    return False, "服务器未准备好发送目录"
+
+                result = {}
+
+                def next_chunk():
+                    """解包时取下一块数据；数据流结束返回空字节"""
+                    if result:
+                        return b''
+                    msg_type, payload = self._wait_reply(replies, 30, "接收目录数据超时")
+                    if msg_type == Protocol.MSG_DIR_DATA:
+                        data = payload.get('data', b'')
+                        # 上一块已解包写入磁盘，向服务端发放通道额度
+                        if window:
+                            credit = window.consume(len(data))
+                            if credit:
+                                self._send_message(Protocol.MSG_FLOW_CREDIT, {'channel': req_id, 'bytes': credit})
+                        if 'file_progress' in self.callbacks:
+                            self.callbacks['file_progress'](0, reader.total + len(data), 0)
+                        return data
+                    result['message'] = (msg_type, payload)
+                    return b''
+
+                reader = ChunkReader(next_chunk)
+                try:
+                    stats = extract_tree(reader, local_dir)
+                except Exception:
+                    if not result:
+                        raise
+                    stats = None
+
+                # tar结束标记之后可能还有填充数据，读到完成消息为止
+                while not result and next_chunk():
+                    pass
+                msg_type, payload = result['message']
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '目录下载失败')
+                if msg_type != Protocol.MSG_DIR_COMPLETE or payload.get('status') != 'success' or stats is None:
+                    return False, "目录下载失败"
+                print(f"[DEBUG] 目录下载完成: {stats['files']} 个文件, {reader.total} 字节数据流")
+                for skipped in payload.get('skipped', []):
+                    print(f"[DEBUG] 服务器跳过无法读取的文件: {skipped}")
+                return True, (f"目录下载成功: {os.path.join(local_dir, os.path.basename(remote_dir.rstrip('/')))}"
+                              f"（{stats['files']} 个文件，{stats['bytes']} 字节）"
+                              + self._skipped_note(payload.get('skipped', []) + stats['skipped']))
+
+        except ConnectionError as e:
+            return False, str(e)
+        except Exception as e:
+            print(f"[DEBUG] 下载目录异常: {e}")
+            return False, f"下载目录失败: {str(e)}"
+
+    @_bulk
+    def download_files(self, remote_paths, local_dir):
+        """
+        批量下载多个文件到 local_dir：一个请求取回所有文件，不再每个文件等待一次回复；
+        拼帧收到的小文件由写入线程并行写盘，大文件随后按顺序接收
+        服务端不支持时逐个下载
+        """
+        if not self.connected:
+            return False, "未连接到服务器"
+        if not remote_paths:
+            return self._batch_result("下载", 0, [])
+        os.makedirs(local_dir, exist_ok=True)
+        if Protocol.FEATURE_FILE_BATCH not in self.features or not self.typed_frames:
+            transfers = TransferQueue(self, self._queue_window())
+            for remote_path in remote_paths:
+                transfers.download(remote_path, os.path.join(local_dir, posixpath.basename(remote_path)))
+            return self._run_queue(transfers, "下载")
+
+        failed = {}  # 序号 -> 错误信息
+        writes = {}  # 写入任务 -> 序号
+        large = None  # 正在接收的大文件: (序号, 文件对象)
+        credit_lock = threading.Lock()
+        try:
+            with ThreadPoolExecutor(self.batch_workers) as pool, self._request() as (req_id, replies):
+                request = {'paths': list(remote_paths), 'req_id': req_id}
+                window = None
+                if self.channels:
+                    request['channel'] = req_id
+                    request['window'] = Protocol.CHANNEL_WINDOW
+                    window = ReceiveWindow(Protocol.CHANNEL_WINDOW)
+                self._send_message(Protocol.MSG_FILE_BATCH, request)
+
+                msg_type, payload = self._wait_reply(replies, 10, "等待服务器响应超时")
+                if msg_type == Protocol.MSG_ERROR:
+                    return False, payload.get('error', '批量下载失败')
+                if msg_type != Protocol.MSG_FILE_BATCH or payload.get('status') != 'ready':
+                    return False, "服务器未准备好发送文件"
+                manifest = payload.get('files', [])
+                local_paths = [os.path.join(local_dir, posixpath.basename(entry['path'])) for entry in manifest]
+                for i, entry in enumerate(manifest):
+                    if 'error' in entry:
+                        failed[i] = entry['error']
+                total_size = sum(entry.get('size', 0) for entry in manifest)
                 received_size = 0
-                with open(local_save_path, 'wb') as f:
-                    # 接收文件数据
-                    while True:
+
+                def written(nbytes):
+                    """数据写入磁盘后向服务端发放通道额度（可在写入线程中调用）"""
+                    if not window:
+                        return
+                    with credit_lock:
+                        credit = window.consume(nbytes)
+                    if credit:
                         try:
-                            msg_type, payload = self.download_queue.get(timeout=30)
-
-                            if msg_type == Protocol.MSG_FILE_DATA:
-                                # 写入数据块
-                                if isinstance(payload, bytes):
-                                    f.write(payload)
-                                    received_size += len(payload)
-                                elif isinstance(payload, dict) and 'data' in payload:
-                                    import base64
-                                    data = base64.b64decode(payload['data'])
-                                    f.write(data)
-                                    received_size += len(data)
-
-                                # 调用进度回调
-                                if 'file_progress' in self.callbacks:
-                                    progress = (received_size / file_size * 100) if file_size > 0 else 0
-                                    self.callbacks['file_progress'](progress, received_size, file_size)
-
-                            elif msg_type == Protocol.MSG_FILE_COMPLETE:
-                                # 文件传输完成
-                                print(f"[DEBUG] 文件下载完成: {received_size} 字节")
-                                self.downloading = False
-                                if payload.get('status') == 'success':
-                                    return True, f"文件下载成功: {local_save_path}"
-                                else:
-                                    return False, "文件下载失败"
-
-                            elif msg_type == Protocol.MSG_ERROR:
-                                self.downloading = False
-                                return False, payload.get('error', '下载失败')
-
-                        except queue.Empty:
-                            self.downloading = False
-                            return False, "接收文件数据超时"
+                            self._send_message(Protocol.MSG_FLOW_CREDIT, {'channel': req_id, 'bytes': credit})
+                        except ConnectionError:
+                            pass
 
-            except Exception as e:
-                self.downloading = False
-                print(f"[DEBUG] 下载文件异常: {e}")
-                return False, f"下载文件失败: {str(e)}"
+                while True:
+                    msg_type, payload = self._wait_reply(replies, 30, "接收文件数据超时")
+
+                    if msg_type == Protocol.MSG_FILE_BATCH:
+                        data = memoryview(payload.get('data', b''))
+                        if 'files' in payload:
+                            # 一帧中的多个小文件，交给写入线程并行写盘
+                            position = 0
+                            for i, length in payload['files']:
+                                chunk = data[position:position + length]
+                                position += length
+                                future = pool.submit(self._write_file, local_paths[i], chunk)
+                                future.add_done_callback(lambda _, n=length: written(n))
+                                writes[future] = i
+                        elif 'file' in payload:
+                            # 大文件的一块，按顺序写入
+                            i = payload['file']
+                            if large is None or large[0] != i:
+                                if large:
+                                    large[1].close()
+                                large = (i, open(local_paths[i], 'wb'))
+                            large[1].write(data)
+                            written(len(data))
+                        elif 'failed' in payload:
+                            i = payload['failed']
+                            failed[i] = payload.get('error', '读取失败')
+                            if large and large[0] == i:
+                                large[1].close()
+                                large = None
+                                os.remove(local_paths[i])
+                        received_size += len(data)
+
+                        if 'file_progress' in self.callbacks:
+                            progress = (received_size / total_size * 100) if total_size > 0 else 0
+                            self.callbacks['file_progress'](progress, received_size, total_size)
+
+                    elif msg_type == Protocol.MSG_FILE_COMPLETE:
+                        print(f"[DEBUG] 批量下载完成: {payload.get('files', 0)} 个文件, {received_size} 字节")
+                        break
+
+                    elif msg_type == Protocol.MSG_ERROR:
+                        return False, payload.get('error', '批量下载失败')
+
+            # 退出线程池时所有写入已完成
+            for future, i in writes.items():
+                if future.exception():
+                    failed[i] = str(future.exception())
+            return self._batch_result(
+                "下载", len(remote_paths),
+                [f"{posixpath.basename(remote_paths[i])}: {error}" for i, error in sorted(failed.items())])
+
+        except ConnectionError as e:
+            return False, str(e)
+        except Exception as e:
+            print(f"[DEBUG] 批量下载异常: {e}")
+            return False, f"批量下载失败: {str(e)}"
+        finally:
+            if large:
+                large[1].close()
+
+    @staticmethod
+    def _write_file(path, data):
+        """写入一个完整的小文件"""
+        with open(path, 'wb') as f:
+            f.write(data)
 
     def set_custom_message(self, message):
         """设置自定义留言"""
@@ -371,8 +1376,7 @@ class ClientConnection:
             return False, "未连接到服务器"
 
         try:
-            msg = Protocol.pack_message(Protocol.MSG_SET_MESSAGE, {'message': message})
-            self.socket.send(msg)
+            self._send_message(Protocol.MSG_SET_MESSAGE, {'message': message})
             return True, "留言设置成功"
         except Exception as e:
             return False, f"设置留言失败: {str(e)}"
@@ -381,64 +1385,207 @@ class ClientConnection:
         """注册回调函数"""
         self.callbacks[event] = callback
 
-    def _receive_loop(self):
-        """接收循环"""
-        while self.connected:
+    def output_compression_stats(self):
+        """
+        终端输出压缩统计
+        返回: {"received", "output", "saved"}，未协商压缩时返回None
+        """
+        return self.decompressor.stats() if self.decompressor else None
+
+    def _receive_loop(self, sock):
+        """接收循环（重连后旧连接的接收线程自行退出，不影响新连接）"""
+        decompressor = self.decompressor  # 解压上下文属于这一条连接
+        while self.connected and self.socket is sock:
             try:
-                msg_type, payload = Protocol.receive_message(self.socket)
+                msg_type, payload, channel = Protocol.receive_frame(sock, self.typed_frames)
 
                 if msg_type is None:
+                    if self.socket is not sock:
+                        break
                     print("连接已断开")
                     self.connected = False
+                    self._fail_pending()
                     if 'disconnected' in self.callbacks:
                         self.callbacks['disconnected']()
                     break
 
-                # 打印收到的消息类型（用于调试）
-                if msg_type == Protocol.MSG_LIST_DIR:
-                    print(f"[DEBUG] 接收循环收到 MSG_LIST_DIR 消息, listing_dir={self.listing_dir}")
-                elif msg_type not in (Protocol.MSG_TERMINAL_OUTPUT, Protocol.MSG_HEARTBEAT):
-                    print(f"[DEBUG] 接收循环收到消息: msg_type={msg_type}")
-
-                # 文件传输相关消息 - 放入队列
-                if self.uploading and msg_type in (Protocol.MSG_FILE_UPLOAD, Protocol.MSG_FILE_COMPLETE, Protocol.MSG_ERROR):
-                    self.file_transfer_queue.put((msg_type, payload))
-
-                # 文件下载相关消息 - 放入队列
-                elif self.downloading and msg_type in (Protocol.MSG_FILE_DOWNLOAD, Protocol.MSG_FILE_DATA, Protocol.MSG_FILE_COMPLETE, Protocol.MSG_ERROR):
-                    self.download_queue.put((msg_type, payload))
-
-                # 目录列表相关消息 - 放入队列
-                elif self.listing_dir and msg_type in (Protocol.MSG_LIST_DIR, Protocol.MSG_ERROR):
-                    print(f"[DEBUG] 接收到目录列表消息: msg_type={msg_type}, listing_dir={self.listing_dir}")
-                    self.dir_list_queue.put((msg_type, payload))
-
-                # 文件列表相关消息 - 放入队列
-                elif self.listing_files and msg_type in (Protocol.MSG_FILE_LIST, Protocol.MSG_ERROR):
-                    print(f"[DEBUG] 接收到文件列表消息: msg_type={msg_type}")
-                    self.file_list_queue.put((msg_type, payload))
+                # 文件数据流 - 头帧之后是原始文件内容，必须在接收线程中读完
+                if msg_type == Protocol.MSG_FILE_STREAM:
+                    req_id = payload.get('req_id')
+                    replies = self._reply_queue(req_id)
+                    for chunk in Protocol.recv_stream(sock, payload.get('size', 0)):
+                        if replies is not None and not self._put_stream_chunk(req_id, replies, chunk):
+                            replies = None  # 下载已放弃，剩余数据读出后丢弃
+
+                # 文件传输、目录列表等请求的回复 - 按请求ID交给等待的调用方（通道ID即请求ID）
+                elif msg_type in self.REPLY_TYPES:
+                    req_id = channel or (payload.get('req_id') if isinstance(payload, dict) else None)
+                    replies = self._reply_queue(req_id)
+                    if replies is not None:
+                        replies.put((msg_type, payload))
+                    elif msg_type == Protocol.MSG_ERROR and 'error' in self.callbacks:
+                        # 不属于任何请求的错误
+                        self.callbacks['error'](payload)
+                    else:
+                        print(f"[DEBUG] 收到无人等待的回复: msg_type={msg_type}, req_id={req_id}")
 
-                # 终端输出
-                elif msg_type == Protocol.MSG_TERMINAL_OUTPUT:
+                # 终端输出（压缩的输出解压后同样处理）
+                elif msg_type in (Protocol.MSG_TERMINAL_OUTPUT, Protocol.MSG_TERMINAL_OUTPUT_Z):
+                    if msg_type == Protocol.MSG_TERMINAL_OUTPUT_Z:
+                        payload = decompressor.decompress(payload)
+                    self.output_offset += len(payload)
                     if 'terminal_output' in self.callbacks:
                         self.callbacks['terminal_output'](payload)
+                    if self.auto_credit:
+                        self.grant_credit(len(payload))
+
+                # 服务端为上传通道发放的额度
+                elif msg_type == Protocol.MSG_FLOW_CREDIT:
+                    window = self.send_windows.get(payload.get('channel'))
+                    if window:
+                        window.release(payload.get('bytes', 0))
+
+                # 命令输出和退出状态 - 按 exec_id 交给等待的调用方
+                elif msg_type in (Protocol.MSG_EXEC_OUTPUT, Protocol.MSG_EXEC_EXIT):
+                    replies = self._reply_queue(payload.get('exec_id'))
+                    if replies is not None:
+                        replies.put((msg_type, payload))
+
+                # 服务端因输出过快跳过的字节数
+                elif msg_type == Protocol.MSG_TERMINAL_SKIP:
+                    self.output_offset += payload.get('skipped', 0)
+                    if 'terminal_skip' in self.callbacks:
+                        self.callbacks['terminal_skip'](payload.get('skipped', 0))
 
                 # 更新信息
                 elif msg_type == Protocol.MSG_UPDATE_INFO:
                     if 'update_info' in self.callbacks:
                         self.callbacks['update_info'](payload)
 
-                # 错误消息
-                elif msg_type == Protocol.MSG_ERROR:
-                    if 'error' in self.callbacks:
-                        self.callbacks['error'](payload)
-
             except Exception as e:
-                if self.connected:
+                if self.connected and self.socket is sock:
                     print(f"接收消息失败: {e}")
                     self.connected = False
+                    self._fail_pending()
                     if 'disconnected' in self.callbacks:
                         self.callbacks['disconnected']()
                 break
 
         print("接收线程已停止")
+
+
+class TransferQueue:
+    """
+    多文件传输队列
+    同时进行最多 window 个传输（各自的请求ID和逻辑通道），一个完成后立即开始下一个，
+    不再逐个等待“就绪—数据—完成”；因连接中断或超时失败的传输放回队尾重试，不阻塞其他传输，
+    服务端回复的错误（文件不存在、权限不足等）重试也不会成功，直接作为结果返回
+    """
+
+    def __init__(self, connection, window=4, retries=2):
+        """
+        初始化
+
+        Args:
+            connection: 已连接的 ClientConnection
+            window: 同时进行的传输数
+            retries: 每个传输因连接中断或超时失败后的重试次数
+        """
+        self.connection = connection
+        self.window = max(1, window)
+        self.retries = retries
+        self.items = []
+        self.results = []
+        self.elapsed = None
+
+    def upload(self, file_path, target_path):
+        """加入一个上传"""
+        self.items.append({"kind": "upload", "source": file_path, "target": target_path})
+
+    def download(self, remote_path, local_path):
+        """加入一个下载"""
+        self.items.append({"kind": "download", "source": remote_path, "target": local_path})
+
+    def run(self):
+        """
+        执行队列中的所有传输，按完成顺序逐个返回结果（失败的在重试用完后返回）
+
+        返回: 结果字典的生成器
+            {"kind", "source", "target", "ok", "message", "attempts", "latency", "bytes", "interrupted"}
+            latency 为最后一次尝试的耗时（秒）
+        """
+        pending = [dict(item, attempts=0) for item in self.items]
+        self.items = []
+        self.results = []
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.window) as pool:
+            running = set()
+            while pending or running:
+                # 补满窗口
+                while pending and len(running) < self.window:
+                    running.add(pool.submit(self._transfer, pending.pop(0)))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = future.result()
+                    if item["interrupted"] and item["attempts"] <= self.retries and self.connection.connected:
+                        print(f"[文件传输] {item['source']} 失败（{item['message']}），第 {item['attempts']} 次重试")
+                        pending.append(item)
+                        continue
+                    self.results.append(item)
+                    yield item
+        self.elapsed = time.monotonic() - start
+
+    def _transfer(self, item):
+        """执行一次传输（在线程池中执行）"""
+        item["attempts"] += 1
+        item["interrupted"] = False
+        start = time.monotonic()
+        try:
+            if item["kind"] == "upload":
+                ok, message = self.connection._upload_file(item["source"], item["target"])
+                size_path = item["source"]
+            else:
+                ok, message = self.connection._download_file(item["source"], item["target"])
+                size_path = item["target"]
+            item["bytes"] = os.path.getsize(size_path) if ok else 0
+        except (ConnectionError, socket.timeout) as e:
+            # 连接中断或超时：重连后重试可能成功
+            ok, message = False, str(e) or "连接已断开"
+            item.update(bytes=0, interrupted=True)
+        except Exception as e:
+            ok, message = False, str(e)
+            item["bytes"] = 0
+        item.update(ok=ok, message=message, latency=round(time.monotonic() - start, 6))
+        return item
+
+    def summary(self):
+        """
+        汇总已完成的传输
+
+        返回: {"total", "succeeded", "failed", "bytes", "elapsed", "throughput",
+               "latency": {"avg", "p50", "p95", "max"}, "retried"}
+            throughput 为成功传输的字节数/总耗时（字节/秒）
+        """
+        succeeded = [r for r in self.results if r["ok"]]
+        latencies = sorted(r["latency"] for r in self.results)
+        total_bytes = sum(r["bytes"] for r in succeeded)
+        elapsed = self.elapsed or 0
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else None
+
+        return {
+            "total": len(self.results),
+            "succeeded": len(succeeded),
+            "failed": [{"source": r["source"], "message": r["message"]} for r in self.results if not r["ok"]],
+            "bytes": total_bytes,
+            "elapsed": round(elapsed, 6),
+            "throughput": round(total_bytes / elapsed) if elapsed else None,
+            "latency": {
+                "avg": round(sum(latencies) / len(latencies), 6) if latencies else None,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": latencies[-1] if latencies else None
+            },
+            "retried": sum(1 for r in self.results if r["attempts"] > 1)
+        }
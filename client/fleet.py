@@ -0,0 +1,157 @@
+"""
+批量执行
+对服务器清单中的所有主机并发连接认证，执行同一条命令或推送同一个文件；
+每台主机完成后立即返回结果，最后汇总成功、失败和最慢的主机
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.connection import ClientConnection
+
+DEFAULT_PORT = 9999
+
+
+def load_inventory(path, default_port=DEFAULT_PORT, default_password=None):
+    """
+    读取服务器清单
+
+    文本格式每行一台主机: 主机[:端口] [密码]，空行和 # 开头的行忽略；
+    .json 文件为列表，元素为 "主机[:端口]" 或 {"host", "port", "password", "name"}
+
+    返回: [{"name", "host", "port", "password"}, ...]
+    """
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.json'):
+            entries = json.load(f)
+        else:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split(None, 1)
+                entry = {"host": fields[0]}
+                if len(fields) > 1:
+                    entry["password"] = fields[1]
+                entries.append(entry)
+
+    hosts = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"host": entry}
+        host = entry["host"]
+        port = entry.get("port")
+        if port is None and host.count(':') == 1:
+            host, port = host.split(':')
+        hosts.append({
+            "name": entry.get("name") or entry["host"],
+            "host": host,
+            "port": int(port or default_port),
+            "password": entry.get("password", default_password)
+        })
+    return hosts
+
+
+class Fleet:
+    """对一组服务器并发执行同一操作"""
+
+    def __init__(self, hosts, concurrency=64, timeout=10):
+        """
+        初始化
+
+        Args:
+            hosts: load_inventory 返回的主机列表
+            concurrency: 同时进行的连接数上限
+            timeout: 连接和认证的超时秒数
+        """
+        self.hosts = hosts
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def run(self, action):
+        """
+        对每台主机连接认证后执行 action(conn)，按完成顺序逐个返回结果
+        action 返回的字典合并到该主机的结果中，其中 ok 表示是否成功
+
+        返回: 结果字典的生成器
+            {"name", "host", "port", "ok", "error", "connect_time", "elapsed", ...}
+        """
+        if not self.hosts:
+            return
+        # 每个连接的建立、认证和执行在各自的线程中进行，多台主机的往返互相重叠
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(self.hosts))) as pool:
+            futures = [pool.submit(self._run_host, host, action) for host in self.hosts]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def exec_command(self, command, cwd=None, env=None, timeout=None):
+        """在所有主机上执行命令（不经过终端），结果包含 returncode、stdout、stderr"""
+        def action(conn):
+            result = conn.exec_command(command, cwd=cwd, env=env, timeout=timeout)
+            result["ok"] = result["error"] is None and result["returncode"] == 0
+            return result
+        return self.run(action)
+
+    def push_file(self, local_path, remote_dir):
+        """把本地文件上传到所有主机的同一目录"""
+        def action(conn):
+            ok, message = conn.upload_file(local_path, remote_dir)
+            return {"ok": ok, "message": message}
+        return self.run(action)
+
+    def _run_host(self, host, action):
+        """连接一台主机并执行操作（在线程池中执行）"""
+        result = {
+            "name": host["name"],
+            "host": host["host"],
+            "port": host["port"],
+            "ok": False,
+            "error": None,
+            "connect_time": None
+        }
+        start = time.monotonic()
+        conn = ClientConnection()
+        try:
+            ok, message = conn.connect(host["host"], host["port"], host["password"] or '',
+                                       terminal=False, timeout=self.timeout)
+            result["connect_time"] = round(time.monotonic() - start, 6)
+            if not ok:
+                result["error"] = message
+            else:
+                result.update(action(conn))
+        except Exception as e:
+            result["error"] = str(e)
+        finally:
+            conn.disconnect()
+            if conn.receive_thread is not None:
+                conn.receive_thread.join(1)
+        result["elapsed"] = round(time.monotonic() - start, 6)
+        return result
+
+
+def summarize(results, elapsed=None, slowest=5):
+    """
+    汇总批量执行结果
+
+    Args:
+        results: Fleet.run 返回的结果列表
+        elapsed: 整批的实际耗时
+        slowest: 列出最慢的主机数
+
+    返回: {"total", "succeeded", "failed", "elapsed", "slowest"}
+    """
+    failed = [r for r in results if not r["ok"]]
+    ranked = sorted(results, key=lambda r: r["elapsed"], reverse=True)[:slowest]
+    return {
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": [{"name": r["name"], "error": r.get("error") or r.get("message") or
+                    f"退出码 {r.get('returncode')}"} for r in failed],
+        "elapsed": round(elapsed, 6) if elapsed is not None else None,
+        "slowest": [{"name": r["name"], "elapsed": r["elapsed"]} for r in ranked]
+    }
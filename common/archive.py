@@ -0,0 +1,185 @@
+"""
+目录传输
+整个目录树打包成一个tar数据流，边打包边发送、边接收边解包，不落临时文件；
+一次请求传完所有文件，保留权限和修改时间；多个文件上传也使用同样的数据流
+
+路径规则按相对于目录的路径（/分隔）匹配，也匹配文件名本身：
+    include 只传输匹配的文件（目录总是遍历），为空时传输全部文件
+    exclude 跳过匹配的文件和目录（目录下的内容一并跳过）
+"""
+import fnmatch
+import os
+import stat
+import tarfile
+
+CHUNK_SIZE = 65536
+
+
+class ChunkWriter:
+    """tarfile 流模式的输出：攒够一块后交给 send 发送"""
+
+    def __init__(self, send, chunk_size=CHUNK_SIZE):
+        self.send = send
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.total += len(data)
+        while len(self.buffer) >= self.chunk_size:
+            self.send(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        """发送剩余的数据"""
+        if self.buffer:
+            self.send(bytes(self.buffer))
+            self.buffer.clear()
+
+
+class ChunkReader:
+    """tarfile 流模式的输入：从 next_chunk 逐块取数据，返回空字节表示结束"""
+
+    def __init__(self, next_chunk):
+        self.next_chunk = next_chunk
+        self.buffer = bytearray()
+        self.eof = False
+        self.total = 0
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.next_chunk()
+            if not chunk:
+                self.eof = True
+                break
+            self.buffer += chunk
+            self.total += len(chunk)
+        if size < 0 or size >= len(self.buffer):
+            data, self.buffer = bytes(self.buffer), bytearray()
+            return data
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def _matches(relpath, patterns):
+    """相对路径或文件名是否匹配任一规则"""
+    name = relpath.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatchcase(relpath, p) or fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+def iter_tree(root, include=(), exclude=()):
+    """
+    按目录在前的顺序列出要传输的条目
+    返回: (本地路径, 包内名称) 的生成器，包内名称以目录名开头
+    """
+    root = os.path.abspath(root)
+    base = os.path.basename(root.rstrip(os.sep)) or 'root'
+    yield root, base
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        rel_dir = '' if rel_dir == '.' else rel_dir + '/'
+        # 原地删除排除的目录，os.walk 不再进入
+        dirnames[:] = sorted(d for d in dirnames if not _matches(rel_dir + d, exclude))
+        for d in dirnames:
+            path = os.path.join(dirpath, d)
+            if include and not os.path.islink(path):
+                # 只传输部分文件时不单独传目录，解包时自动创建
+                continue
+            yield path, f"{base}/{rel_dir}{d}"
+        for f in sorted(filenames):
+            relpath = rel_dir + f
+            if _matches(relpath, exclude) or (include and not _matches(relpath, include)):
+                continue
+            yield os.path.join(dirpath, f), f"{base}/{relpath}"
+
+
+def write_tree(fileobj, root, include=(), exclude=()):
+    """
+    把目录打包写入 fileobj（tar 流模式）
+    无法读取的文件跳过，不影响其他文件
+    返回: {"files", "bytes", "skipped"}
+    """
+    return _write_entries(fileobj, iter_tree(root, include, exclude))
+
+
+def write_files(fileobj, paths):
+    """
+    把多个文件打包写入 fileobj（tar 流模式），包内名称为文件名
+    小文件在数据流中首尾相接，一起分块发送
+    返回: {"files", "bytes", "skipped"}
+    """
+    return _write_entries(fileobj, ((path, os.path.basename(path)) for path in paths))
+
+
+def _write_entries(fileobj, entries):
+    """把 (本地路径, 包内名称) 依次写入tar数据流"""
+    stats = {"files": 0, "bytes": 0, "skipped": []}
+    with tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        for path, arcname in entries:
+            try:
+                info = tar.gettarinfo(path, arcname)
+                f = open(path, 'rb') if info is not None and info.isreg() else None
+            except OSError as e:
+                # 读取属性或打开失败时还没有写入任何数据，数据流仍然完整
+                stats["skipped"].append(f"{arcname}: {e.strerror or e}")
+                continue
+            if info is None:
+                # 套接字等无法打包的类型
+                continue
+            if f is None:
+                tar.addfile(info)
+                continue
+            # 头部已写出后读取失败（文件被截断等）时数据流不再完整，异常直接中止传输
+            with f:
+                tar.addfile(info, f)
+            stats["files"] += 1
+            stats["bytes"] += info.size
+    return stats
+
+
+def extract_tree(fileobj, target):
+    """
+    从 fileobj（tar 流模式）解包到 target 目录
+    路径超出目标目录时中止解包；指向目录外的链接和设备文件跳过，清除 setuid 等权限位
+    返回: {"files", "bytes", "skipped"}
+    """
+    skipped = []
+    os.makedirs(target, exist_ok=True)
+    # 所有版本都由 _checked_members 逐个检查；有解包过滤器的版本不再叠加默认过滤器，
+    # 否则组和其他用户的写权限会被清除
+    options = {'filter': 'fully_trusted'} if hasattr(tarfile, 'fully_trusted_filter') else {}
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        tar.extractall(target, members=_checked_members(tar, target, skipped), **options)
+        members = tar.getmembers()
+    return {
+        "files": sum(1 for m in members if m.isreg()),
+        "bytes": sum(m.size for m in members if m.isreg()),
+        "skipped": skipped
+    }
+
+
+def _checked_members(tar, target, skipped):
+    """
+    逐个检查成员（边解包边检查，之前解出的链接也会被跟随）
+    绝对路径、.. 等超出目标目录的路径抛出 TarError；指向目录外或绝对路径的链接
+    （如 lib -> /usr/lib）和设备文件不解包，记入 skipped；只清除 setuid、setgid 和粘滞位
+    """
+    root = os.path.realpath(target)
+    for member in tar:
+        path = os.path.realpath(os.path.join(root, member.name))
+        if os.path.isabs(member.name) or os.path.commonpath([root, path]) != root:
+            raise tarfile.TarError(f"路径超出目标目录: {member.name}")
+        if member.issym() or member.islnk():
+            link_base = os.path.dirname(path) if member.issym() else root
+            link = os.path.realpath(os.path.join(link_base, member.linkname))
+            if os.path.isabs(member.linkname) or os.path.commonpath([root, link]) != root:
+                skipped.append(f"{member.name}: 链接指向目标目录外 ({member.linkname})")
+                continue
+        if member.ischr() or member.isblk() or member.isfifo():
+            skipped.append(f"{member.name}: 不支持的文件类型")
+            continue
+        member.mode &= ~(stat.S_ISUID | stat.S_ISGID | stat.S_ISVTX)
+        yield member
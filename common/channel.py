@@ -0,0 +1,60 @@
+"""
+逻辑通道的窗口流控
+每个通道（一次文件传输）有独立的窗口：发送方最多发出窗口大小的未确认数据，
+接收方处理（写入磁盘）后通过 MSG_FLOW_CREDIT {"channel", "bytes"} 发放额度，
+一个慢的传输不会占满连接，也不会让对端的内存堆积
+"""
+import threading
+
+
+class SendWindow:
+    """发送方的通道窗口"""
+
+    def __init__(self, size):
+        self.credit = size
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes, timeout=None):
+        """
+        等待有额度后占用 nbytes
+        额度可以暂时为负，单块大于窗口时也能发送
+        超时或通道关闭时抛出 ConnectionError
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or self.credit > 0, timeout):
+                raise ConnectionError("等待通道额度超时")
+            if self.closed:
+                raise ConnectionError("通道已关闭")
+            self.credit -= nbytes
+
+    def release(self, nbytes):
+        """收到接收方发放的额度"""
+        with self.condition:
+            self.credit += nbytes
+            self.condition.notify_all()
+
+    def close(self):
+        """关闭通道，唤醒等待额度的发送方"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ReceiveWindow:
+    """接收方的通道窗口：累计已处理的字节数，达到窗口的1/4时发放一次额度"""
+
+    def __init__(self, size):
+        self.size = size
+        self.consumed = 0
+
+    def consume(self, nbytes):
+        """
+        记录已处理的字节数
+        返回: 此时应发放的额度，0表示暂不发放
+        """
+        self.consumed += nbytes
+        if self.consumed < self.size // 4:
+            return 0
+        amount, self.consumed = self.consumed, 0
+        return amount
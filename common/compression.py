@@ -0,0 +1,115 @@
+"""
+终端输出压缩
+每个连接一个持续的 deflate 上下文，每块输出以 Z_SYNC_FLUSH 结束后立即发送，
+后面的小帧也能引用之前输出的内容（提示符、重复的日志前缀），压缩效果远好于逐帧独立压缩
+
+压缩帧（MSG_TERMINAL_OUTPUT_Z）的内容为原始 deflate 数据（不带zlib头），
+去掉了每次同步刷新末尾固定的 00 00 ff ff，由解压方补回
+测得压缩率太差时（已压缩的数据、二进制输出）一段时间内改为发送普通输出帧，之后再尝试压缩
+"""
+import zlib
+
+from common.protocol import Protocol
+
+SYNC_TAIL = b'\x00\x00\xff\xff'  # Z_SYNC_FLUSH 产生的空存储块
+
+
+class OutputCompressor:
+    """一个连接的终端输出压缩上下文（只在发送线程中使用，无需加锁）"""
+
+    def __init__(self, level=6, min_size=8, sample_size=65536, bypass_ratio=0.9, bypass_size=1024 * 1024):
+        """
+        初始化
+
+        Args:
+            level: 压缩级别（1-9）
+            min_size: 小于此字节数的输出不压缩（单个按键回显压缩后反而更大）
+            sample_size: 每压缩这么多字节统计一次压缩率
+            bypass_ratio: 压缩后与压缩前的比值高于此值时暂停压缩
+            bypass_size: 暂停压缩期间直接发送的字节数，之后再尝试压缩
+        """
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.bypass_ratio = bypass_ratio
+        self.bypass_size = bypass_size
+        self.bypass_remaining = 0
+        self.sample_in = 0
+        self.sample_out = 0
+
+        # 统计
+        self.raw_bytes = 0  # 输出的原始字节数
+        self.sent_bytes = 0  # 实际发送的字节数（压缩后的和直接发送的）
+        self.bypassed_bytes = 0  # 因压缩率太差而直接发送的字节数
+        self.bypasses = 0
+
+    def pack(self, output):
+        """
+        打包一块终端输出
+        返回: 压缩帧，或不压缩时的普通输出帧
+        """
+        self.raw_bytes += len(output)
+        if self.bypass_remaining > 0 or len(output) < self.min_size:
+            if self.bypass_remaining > 0:
+                self.bypass_remaining -= len(output)
+                self.bypassed_bytes += len(output)
+            self.sent_bytes += len(output)
+            return Protocol.pack_message(Protocol.MSG_TERMINAL_OUTPUT, output, True)
+
+        data = self.compressobj.compress(output) + self.compressobj.flush(zlib.Z_SYNC_FLUSH)
+        data = data[:-len(SYNC_TAIL)]
+        self.sent_bytes += len(data)
+        self._measure(len(output), len(data))
+        return Protocol.pack_message(Protocol.MSG_TERMINAL_OUTPUT_Z, data, True)
+
+    def _measure(self, raw, compressed):
+        """累计一段输出的压缩率，太差时暂停压缩"""
+        self.sample_in += raw
+        self.sample_out += compressed
+        if self.sample_in < self.sample_size:
+            return
+        if self.sample_out > self.sample_in * self.bypass_ratio:
+            self.bypass_remaining = self.bypass_size
+            self.bypasses += 1
+        self.sample_in = self.sample_out = 0
+
+    def stats(self):
+        """返回压缩统计"""
+        return {
+            "raw": self.raw_bytes,
+            "sent": self.sent_bytes,
+            "saved": self.raw_bytes - self.sent_bytes,
+            "bypassed": self.bypassed_bytes,
+            "bypasses": self.bypasses,
+        }
+
+    def summary(self):
+        """一行统计信息"""
+        stats = self.stats()
+        percent = stats['saved'] / stats['raw'] * 100 if stats['raw'] else 0
+        return (f"原始 {stats['raw']} 字节, 发送 {stats['sent']} 字节, 节省 {stats['saved']} 字节 ({percent:.1f}%)"
+                + (f", {stats['bypasses']} 次因压缩率低暂停压缩" if stats['bypasses'] else ""))
+
+
+class OutputDecompressor:
+    """与服务端 OutputCompressor 对应的解压上下文（只在接收线程中使用）"""
+
+    def __init__(self):
+        self.decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.received_bytes = 0  # 收到的压缩数据字节数
+        self.output_bytes = 0  # 解压得到的字节数
+
+    def decompress(self, data):
+        """解压一个压缩帧的内容"""
+        output = self.decompressobj.decompress(bytes(data) + SYNC_TAIL)
+        self.received_bytes += len(data)
+        self.output_bytes += len(output)
+        return output
+
+    def stats(self):
+        """返回解压统计"""
+        return {
+            "received": self.received_bytes,
+            "output": self.output_bytes,
+            "saved": self.output_bytes - self.received_bytes,
+        }
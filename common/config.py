@@ -19,11 +19,15 @@ class Config:
         "server": {
             "host": "0.0.0.0",
             "port": 9999,
-            "password": "flashcontrol123"
+            "password": "flashcontrol123",
+            "mode": "thread",
+            "max_data_connections": 8,
+            "executor_workers": 32
         },
         "client": {
             "last_host": "",
-            "last_port": 9999
+            "last_port": 9999,
+            "data_connections": 1
         },
         "update": {
             "check_on_startup": True,
@@ -31,7 +35,18 @@ class Config:
         },
         "terminal": {
             "shell": "/bin/bash",
-            "encoding": "utf-8"
+            "encoding": "utf-8",
+            "coalesce_bytes": 65536,
+            "coalesce_delay_ms": 5,
+            "flood_mode": False,
+            "flood_tail": 4096,
+            "pool_size": 2,
+            "pool_idle_timeout": 600,
+            "session_grace": 300,
+            "scrollback_size": 1048576,
+            "share_write": False,
+            "compression": True,
+            "compression_level": 6
         }
     }
 
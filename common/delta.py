@@ -0,0 +1,156 @@
+"""
+增量传输（rsync算法）
+服务端把已有的目标文件按块计算签名（可滚动的弱校验和 + BLAKE2b强哈希），
+客户端在本地文件中查找与这些块相同的内容，只发送变化的部分：
+    ('copy', 块序号, 块数)   由服务端从原文件复制连续的若干块
+    ('data', 起始, 结束)     本地文件中的一段原始数据
+服务端按指令写出新文件，校验后原子替换目标文件
+
+弱校验和与 zlib.adler32 相同，对齐的块直接用 zlib 计算；
+只有在变化区域才在Python中逐字节滚动查找错位的块
+"""
+import hashlib
+import math
+import struct
+import zlib
+
+MIN_BLOCK_SIZE = 2048
+MAX_BLOCK_SIZE = 65536
+STRONG_SIZE = 16  # 块强哈希的字节数
+
+# 一个块的签名: [4字节弱校验和][16字节强哈希]
+SIGNATURE_FORMAT = f'!I{STRONG_SIZE}s'
+SIGNATURE_SIZE = struct.calcsize(SIGNATURE_FORMAT)
+
+# 连续未匹配时逐字节查找的间隔（块数）按1、2、4……增长，最多每隔这么多块查找一次
+MAX_SEARCH_INTERVAL = 128
+
+_ADLER_MOD = 65521
+
+
+def block_size_for(size):
+    """按文件大小选择块大小（约为大小的平方根，签名数量随之为平方根级）"""
+    block = 1 << max(0, int(math.sqrt(size)) - 1).bit_length()
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block))
+
+
+def strong_hash(data):
+    """块的强哈希"""
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def file_signature(f, block_size):
+    """
+    计算文件每个块的签名
+    返回: 打包后的签名（每块 SIGNATURE_SIZE 字节），块数
+    """
+    signature = bytearray()
+    count = 0
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            break
+        block = view[:n]
+        signature += struct.pack(SIGNATURE_FORMAT, zlib.adler32(block), strong_hash(block))
+        count += 1
+    return bytes(signature), count
+
+
+def parse_signature(data, block_size, size):
+    """
+    把签名整理成按弱校验和查找的索引
+    只收录完整的块（原文件大小为 size），新文件末尾不足一块的部分总是作为原始数据发送
+    返回: {弱校验和: [(强哈希, 块序号), ...]}
+    """
+    index = {}
+    full_blocks = size // block_size
+    for i, (weak, strong) in enumerate(struct.iter_unpack(SIGNATURE_FORMAT, data)):
+        if i >= full_blocks:
+            break
+        index.setdefault(weak, []).append((strong, i))
+    return index
+
+
+def compute_delta(data, index, block_size):
+    """
+    计算把原文件变成 data 的指令
+    data 为本地文件内容（bytes 或 mmap），index 为 parse_signature 的结果
+    返回: 指令的生成器，相邻块的复制合并为一条
+    """
+    n = len(data)
+    if not index:
+        # 服务端没有可用的原文件
+        if n:
+            yield ('data', 0, n)
+        return
+
+    view = memoryview(data)
+    pos = 0
+    literal_start = 0
+    copy = None  # 尚未发出的复制指令 [起始块, 块数]
+    misses = 0
+    next_search = 0
+
+    def match_at(p, weak):
+        candidates = index.get(weak)
+        if candidates:
+            strong = strong_hash(view[p:p + block_size])
+            for candidate, i in candidates:
+                if candidate == strong:
+                    return i
+        return None
+
+    while pos + block_size <= n:
+        block = match_at(pos, zlib.adler32(view[pos:pos + block_size]))
+        if block is None and misses == next_search:
+            # 从这里开始逐字节查找错位的块（插入或删除了数据）
+            found = _search(data, view, pos, block_size, n, match_at)
+            next_search = misses + min(max(1, misses), MAX_SEARCH_INTERVAL)
+            if found is not None:
+                pos, block = found
+        if block is None:
+            misses += 1
+            pos += block_size
+            continue
+
+        if literal_start < pos:
+            if copy:
+                yield ('copy', *copy)
+                copy = None
+            yield ('data', literal_start, pos)
+        if copy and copy[0] + copy[1] == block:
+            copy[1] += 1
+        else:
+            if copy:
+                yield ('copy', *copy)
+            copy = [block, 1]
+        pos += block_size
+        literal_start = pos
+        misses = 0
+        next_search = 0
+
+    if copy:
+        yield ('copy', *copy)
+    if literal_start < n:
+        yield ('data', literal_start, n)
+
+
+def _search(data, view, pos, block_size, n, match_at):
+    """
+    从 pos+1 开始逐字节滚动弱校验和，最多查找一个块的距离
+    返回: (位置, 块序号)，没有找到时返回None
+    """
+    weak = zlib.adler32(view[pos:pos + block_size])
+    a, b = weak & 0xffff, weak >> 16
+    end = min(pos + block_size, n - block_size)
+    while pos < end:
+        out, new = data[pos], data[pos + block_size]
+        a = (a - out + new) % _ADLER_MOD
+        b = (b - block_size * out + a - 1) % _ADLER_MOD
+        pos += 1
+        block = match_at(pos, (b << 16) | a)
+        if block is not None:
+            return pos, block
+    return None
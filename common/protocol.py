@@ -1,8 +1,56 @@
 """
 通信协议定义
 定义客户端和服务端之间的通信格式
+
+帧格式:
+    传统帧: [4字节长度][1字节类型][数据]，接收方需要逐个尝试解析payload
+    类型帧: [4字节长度][1字节类型][1字节编码][数据]，按编码字段一次解析
+类型帧需要双方在 MSG_AUTH 阶段协商 typed_frames 特性后才会启用
+
+协商 request_id 特性后，客户端在字典请求中带上 req_id，服务端的回复
+（包括 MSG_ERROR 和 MSG_FILE_STREAM 头帧）原样带回，同一连接可以同时进行多个请求
+
+协商 channels 特性后，类型帧的编码字节可带 FLAG_CHANNEL 标志，帧头后紧跟4字节通道ID:
+    [4字节长度][1字节类型][1字节编码|0x80][4字节通道ID][数据]
+文件传输的数据在各自的通道上分帧发送，与终端输出按帧交错，每个通道有独立的窗口流控；
+通道0（不带标志）为终端和控制消息
+
+协商 resume 特性后，文件传输可以断点续传（见 common/transfer.py）:
+    上传请求带 transfer_id，服务端在就绪回复中给出已收到的字节数 offset，
+    完成消息带源文件的 blake2b，服务端校验一致后才改名为目标文件；
+    下载请求可带 offset 和 length 只取文件的一段，带 transfer_id 时
+    完成消息附带整个文件的 blake2b 供客户端校验
+
+协商 delta 特性后（需要类型帧），客户端可以增量上传（见 common/delta.py）:
+    MSG_DELTA_SIGNATURE 请求目标文件的块签名，回复的 data 为打包的签名；
+    MSG_DELTA_DATA 为 {"copy": [起始块, 块数]} 或 {"data": 原始数据}；
+    MSG_DELTA_COMPLETE 带新文件的 blake2b，服务端校验后原子替换目标文件
+
+协商 dir_stream 特性后（需要类型帧），整个目录树作为一个tar数据流传输（见 common/archive.py）:
+    MSG_DIR_UPLOAD / MSG_DIR_DOWNLOAD 请求后，MSG_DIR_DATA 的 data 依次为tar数据流的各块，
+    MSG_DIR_COMPLETE 表示数据流结束；目录上传时服务端边收边解包，完成后回复文件数和字节数
+
+协商 file_batch 特性后（需要类型帧），一个 MSG_FILE_BATCH 请求下载多个文件:
+    回复先是清单 {"status": "ready", "files": [{"path", "size"} 或 {"path", "error"}]}；
+    小文件拼在同一帧中 {"files": [[序号, 长度], ...], "data": 依次拼接的内容}；
+    大文件单独分块 {"file": 序号, "offset", "data"}，读取失败时 {"failed": 序号, "error"}；
+    最后是 MSG_FILE_COMPLETE
+
+协商 data_connection 特性后，认证响应带 data_token；客户端可以凭它另外建立数据连接，
+认证消息为 {"data_token", "features", "terminal": false}，不需要密码；
+数据连接只用于文件传输，控制连接断开时服务端一并关闭
+
+协商 compression 特性后（需要类型帧），终端输出可以压缩发送（见 common/compression.py）:
+    MSG_TERMINAL_OUTPUT_Z 的内容为连接内持续的 deflate 数据流中的一段，
+    与普通的 MSG_TERMINAL_OUTPUT 可以交替出现；流控额度和输出偏移量都按解压后的字节数计算
 """
+import base64
+import errno
+import io
 import json
+import os
+import select
+import socket
 import struct
 
 class Protocol:
@@ -22,79 +70,417 @@ class Protocol:
     MSG_FILE_DOWNLOAD = 11    # 文件下载请求
     MSG_FILE_LIST = 12        # 文件列表（包含文件和文件夹）
     MSG_SET_MESSAGE = 13      # 设置留言
+    MSG_FILE_STREAM = 14      # 文件数据流头（其后紧跟size字节的原始数据，不分帧）
+    MSG_FLOW_CREDIT = 15      # 终端输出流控额度（客户端处理完输出后发放）
+    MSG_TERMINAL_SKIP = 16    # 终端输出过快时被跳过的字节数
+    MSG_EXEC = 17             # 执行命令（管道，不经过终端）
+    MSG_EXEC_OUTPUT = 18      # 命令输出（stdout/stderr）
+    MSG_EXEC_EXIT = 19        # 命令退出码和耗时
+    MSG_DELTA_SIGNATURE = 20  # 增量上传：请求/返回目标文件的块签名
+    MSG_DELTA_DATA = 21       # 增量上传：复制指令或原始数据
+    MSG_DELTA_COMPLETE = 22   # 增量上传完成
+    MSG_DIR_UPLOAD = 23       # 目录上传请求
+    MSG_DIR_DOWNLOAD = 24     # 目录下载请求
+    MSG_DIR_DATA = 25         # 目录tar数据流的一块
+    MSG_DIR_COMPLETE = 26     # 目录数据流结束/目录传输结果
+    MSG_FILE_BATCH = 27       # 批量下载请求/清单/数据
+    MSG_TERMINAL_OUTPUT_Z = 28  # 压缩的终端输出
     MSG_ERROR = 99            # 错误消息
 
+    # payload编码（类型帧）
+    ENC_RAW = 0               # 原始字节
+    ENC_UTF8 = 1              # UTF-8文本
+    ENC_JSON = 2              # JSON对象
+    ENC_BINARY = 3            # 紧凑二进制: [4字节JSON长度][JSON元数据][原始数据]
+
+    # 可协商的特性
+    FEATURE_TYPED_FRAMES = 'typed_frames'
+    FEATURE_FILE_STREAM = 'file_stream'
+    FEATURE_FLOW_CONTROL = 'flow_control'
+    FEATURE_SESSION_RESUME = 'session_resume'
+    FEATURE_SHARED_SESSION = 'shared_session'
+    FEATURE_EXEC = 'exec'
+    FEATURE_REQUEST_ID = 'request_id'
+    FEATURE_CHANNELS = 'channels'
+    FEATURE_RESUME = 'resume'
+    FEATURE_DELTA = 'delta'
+    FEATURE_DIR_STREAM = 'dir_stream'
+    FEATURE_FILE_BATCH = 'file_batch'
+    FEATURE_DATA_CONNECTION = 'data_connection'
+    FEATURE_COMPRESSION = 'compression'
+    FEATURES = [FEATURE_TYPED_FRAMES, FEATURE_FILE_STREAM, FEATURE_FLOW_CONTROL,
+                FEATURE_SESSION_RESUME, FEATURE_SHARED_SESSION, FEATURE_EXEC,
+                FEATURE_REQUEST_ID, FEATURE_CHANNELS, FEATURE_RESUME, FEATURE_DELTA,
+                FEATURE_DIR_STREAM, FEATURE_FILE_BATCH, FEATURE_DATA_CONNECTION,
+                FEATURE_COMPRESSION]
+
+    # 类型帧编码字节中的通道标志，置位时帧头后紧跟4字节通道ID
+    FLAG_CHANNEL = 0x80
+
+    # 终端输出流控的默认初始窗口（字节）
+    FLOW_WINDOW = 256 * 1024
+
+    # 文件传输通道的默认窗口（字节）
+    CHANNEL_WINDOW = 4 * 1024 * 1024
+
+    # 不超过此大小的帧优先尝试单次recv接收
+    SMALL_FRAME_SIZE = 65536
+
+    # 原始数据流的读写缓冲区大小
+    STREAM_CHUNK_SIZE = 1024 * 1024
+
+    # 帧长度上限：帧头中的长度来自对端，超过时断开连接；认证前只接受很小的帧
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
+    AUTH_FRAME_SIZE = 64 * 1024
+
+    @staticmethod
+    def set_nodelay(sock):
+        """
+        关闭Nagle算法：请求和回复多为小帧，否则与对端的延迟确认叠加，
+        每次“请求—回复”往返多等约40ms（asyncio的连接默认已关闭）
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
     @staticmethod
-    def pack_message(msg_type, data):
+    def encode_payload(data):
+        """
+        编码payload
+        返回: (编码类型, 字节数据)
+        包含二进制 'data' 字段的字典使用紧凑二进制编码，避免base64
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return Protocol.ENC_RAW, data
+        if isinstance(data, str):
+            return Protocol.ENC_UTF8, data.encode('utf-8')
+        if isinstance(data, dict):
+            blob = data.get('data')
+            if isinstance(blob, (bytes, bytearray, memoryview)):
+                meta = {k: v for k, v in data.items() if k != 'data'}
+                meta_bytes = json.dumps(meta).encode('utf-8')
+                return Protocol.ENC_BINARY, struct.pack('!I', len(meta_bytes)) + meta_bytes + blob
+            return Protocol.ENC_JSON, json.dumps(data).encode('utf-8')
+        if isinstance(data, list):
+            return Protocol.ENC_JSON, json.dumps(data).encode('utf-8')
+        return Protocol.ENC_UTF8, str(data).encode('utf-8')
+
+    @staticmethod
+    def pack_message(msg_type, data, typed=False, channel=0):
         """
         打包消息
         格式: [4字节长度][1字节类型][数据]
+        typed=True 时使用类型帧: [4字节长度][1字节类型][1字节编码][数据]
+        channel 非0时（仅类型帧）编码带通道标志，帧头后紧跟4字节通道ID
         """
-        if isinstance(data, str):
-            data = data.encode('utf-8')
-        elif isinstance(data, dict):
-            data = json.dumps(data).encode('utf-8')
-        elif not isinstance(data, bytes):
-            data = str(data).encode('utf-8')
+        encoding, body = Protocol.encode_payload(data)
 
-        msg_len = len(data) + 1  # +1 for msg_type
+        if typed:
+            if channel:
+                msg_len = len(body) + 6  # +6 for msg_type, encoding and channel
+                header = struct.pack('!IBBI', msg_len, msg_type, encoding | Protocol.FLAG_CHANNEL, channel)
+                return header + body
+            msg_len = len(body) + 2  # +2 for msg_type and encoding
+            header = struct.pack('!IBB', msg_len, msg_type, encoding)
+            return header + body
+
+        # 传统帧无法携带二进制字段，按旧格式转为base64字符串
+        if encoding == Protocol.ENC_BINARY:
+            data = dict(data)
+            data['data'] = base64.b64encode(data['data']).decode('ascii')
+            body = json.dumps(data).encode('utf-8')
+
+        msg_len = len(body) + 1  # +1 for msg_type
         header = struct.pack('!IB', msg_len, msg_type)
-        return header + data
+        return header + body
+
+    @staticmethod
+    def header_size(typed=False):
+        """帧头长度"""
+        return 6 if typed else 5
 
     @staticmethod
-    def unpack_message(data):
+    def unpack_message(data, typed=False):
         """
         解包消息
         返回: (msg_type, payload)
         """
-        if len(data) < 5:
+        size = Protocol.header_size(typed)
+        if len(data) < size:
             return None, None
 
-        msg_len, msg_type = struct.unpack('!IB', data[:5])
-        payload = data[5:5+msg_len-1]
+        body_len, msg_type, encoding = Protocol.parse_header(data[:size], typed)
+        payload = data[size:size+body_len]
+
+        return msg_type, Protocol.decode_body(encoding, payload)
+
+    @staticmethod
+    def recv_exact(sock, size):
+        """
+        从socket接收指定长度的数据
+        通过memoryview + recv_into原地填充bytearray，避免逐块拼接带来的重复拷贝；
+        缓冲区随收到的数据成倍扩大，不按对端声明的长度一次分配
+        返回: bytes/bytearray，连接断开时返回None
+        """
+        # 小帧通常一次recv即可收齐，直接返回，省去预分配的开销
+        first = b''
+        if size <= Protocol.SMALL_FRAME_SIZE:
+            first = sock.recv(size)
+            if not first:
+                return None
+            if len(first) == size:
+                return first
 
-        # 尝试解析为JSON
+        buffer = bytearray(min(size, max(len(first), Protocol.STREAM_CHUNK_SIZE)))
+        view = memoryview(buffer)
+        received = len(first)
+        view[:received] = first
+        while received < size:
+            if received == len(buffer):
+                view.release()
+                buffer.extend(bytes(min(len(buffer), size - len(buffer))))
+                view = memoryview(buffer)
+            n = sock.recv_into(view[received:], len(buffer) - received)
+            if not n:
+                return None
+            received += n
+        return buffer
+
+    @staticmethod
+    def decode_payload(payload):
+        """
+        解析payload
+        依次尝试JSON、UTF-8文本，失败则保持为原始字节
+        """
         try:
-            payload = json.loads(payload.decode('utf-8'))
+            return json.loads(payload.decode('utf-8'))
         except:
             try:
-                payload = payload.decode('utf-8')
+                return payload.decode('utf-8')
             except:
-                pass  # 保持为bytes
+                return payload  # 保持为bytes/bytearray
 
-        return msg_type, payload
+    @staticmethod
+    def decode_typed_payload(encoding, payload):
+        """按类型帧的编码字段解析payload，只解析一次"""
+        if encoding == Protocol.ENC_RAW:
+            return payload
+        if encoding == Protocol.ENC_UTF8:
+            return bytes(payload).decode('utf-8')
+        if encoding == Protocol.ENC_JSON:
+            return json.loads(bytes(payload).decode('utf-8'))
+        if encoding == Protocol.ENC_BINARY:
+            meta_len = struct.unpack('!I', payload[:4])[0]
+            result = json.loads(bytes(payload[4:4+meta_len]).decode('utf-8'))
+            if isinstance(payload, bytearray):
+                # bytearray删除头部是O(1)操作，数据部分无需拷贝
+                del payload[:4+meta_len]
+                result['data'] = payload
+            else:
+                result['data'] = payload[4+meta_len:]
+            return result
+        raise ValueError(f"未知的payload编码: {encoding}")
+
+    @staticmethod
+    def parse_header(header, typed=False, max_size=None):
+        """
+        解析帧头
+        max_size 为允许的最大帧长度（默认 MAX_FRAME_SIZE），超过时抛出 ValueError
+        返回: (payload长度, msg_type, 编码)，传统帧的编码为None
+        """
+        if typed:
+            msg_len, msg_type, encoding = struct.unpack('!IBB', header)
+            body_len = msg_len - 2
+        else:
+            msg_len, msg_type = struct.unpack('!IB', header)
+            encoding = None
+            body_len = msg_len - 1
+        if msg_len > (max_size or Protocol.MAX_FRAME_SIZE):
+            raise ValueError(f"帧长度 {msg_len} 超过上限")
+        return body_len, msg_type, encoding
+
+    @staticmethod
+    def decode_body(encoding, payload):
+        """按帧头中的编码解析payload，传统帧逐个尝试"""
+        if encoding is None:
+            return Protocol.decode_payload(payload)
+        return Protocol.decode_typed_payload(encoding, payload)
+
+    @staticmethod
+    def decode_frame(encoding, payload):
+        """
+        解析帧的数据部分，取出通道ID
+        返回: (payload, 通道ID)
+        """
+        channel = 0
+        if encoding is not None and encoding & Protocol.FLAG_CHANNEL:
+            encoding &= ~Protocol.FLAG_CHANNEL
+            channel = struct.unpack('!I', payload[:4])[0]
+            if isinstance(payload, bytearray):
+                del payload[:4]  # bytearray删除头部是O(1)操作
+            else:
+                payload = payload[4:]
+        return Protocol.decode_body(encoding, payload), channel
 
     @staticmethod
-    def receive_message(sock):
+    def receive_message(sock, typed=False, max_size=None):
         """
         从socket接收完整消息
+        原始数据直接返回，不再额外拷贝
+        typed=True 时按类型帧解析；需要通道ID时使用 receive_frame
+        max_size 为帧长度上限（认证前应传 AUTH_FRAME_SIZE），超过时抛出 ValueError
+        返回: (msg_type, payload)，连接断开时返回 (None, None)
+        """
+        # 先接收头部（传统帧5字节，类型帧6字节）
+        header = Protocol.recv_exact(sock, Protocol.header_size(typed))
+        if header is None:
+            return None, None
+
+        body_len, msg_type, encoding = Protocol.parse_header(header, typed, max_size)
+
+        # 接收数据部分
+        payload = Protocol.recv_exact(sock, body_len)
+        if payload is None:
+            return None, None
+
+        if encoding is not None and encoding & Protocol.FLAG_CHANNEL:
+            return msg_type, Protocol.decode_frame(encoding, payload)[0]
+        return msg_type, Protocol.decode_body(encoding, payload)
+
+    @staticmethod
+    def receive_frame(sock, typed=False, max_size=None):
+        """
+        从socket接收完整消息及其通道ID
+        帧长度超过 max_size（默认 MAX_FRAME_SIZE）时抛出 ValueError
+        返回: (msg_type, payload, 通道ID)，连接断开时返回 (None, None, 0)
         """
-        # 先接收头部（5字节）
-        header = b''
-        while len(header) < 5:
-            chunk = sock.recv(5 - len(header))
-            if not chunk:
-                return None, None
-            header += chunk
+        # 先接收头部（传统帧5字节，类型帧6字节）
+        header = Protocol.recv_exact(sock, Protocol.header_size(typed))
+        if header is None:
+            return None, None, 0
 
-        msg_len, msg_type = struct.unpack('!IB', header)
+        body_len, msg_type, encoding = Protocol.parse_header(header, typed, max_size)
 
         # 接收数据部分
-        payload = b''
-        remaining = msg_len - 1
-        while len(payload) < remaining:
-            chunk = sock.recv(min(remaining - len(payload), 8192))
-            if not chunk:
-                return None, None
-            payload += chunk
-
-        # 尝试解析payload
+        payload = Protocol.recv_exact(sock, body_len)
+        if payload is None:
+            return None, None, 0
+
+        return (msg_type,) + Protocol.decode_frame(encoding, payload)
+
+    @staticmethod
+    async def read_message(reader, typed=False, max_size=None):
+        """
+        从 asyncio.StreamReader 接收完整消息
+        连接断开时返回 (None, None)
+        """
+        msg_type, payload, _ = await Protocol.read_frame(reader, typed, max_size)
+        return msg_type, payload
+
+    @staticmethod
+    async def read_frame(reader, typed=False, max_size=None):
+        """
+        从 asyncio.StreamReader 接收完整消息及其通道ID
+        帧长度超过 max_size（默认 MAX_FRAME_SIZE）时抛出 ValueError
+        连接断开时返回 (None, None, 0)
+        """
+        import asyncio  # 只有asyncio服务端用到，客户端不必加载
+
         try:
-            payload = json.loads(payload.decode('utf-8'))
-        except:
+            header = await reader.readexactly(Protocol.header_size(typed))
+            body_len, msg_type, encoding = Protocol.parse_header(header, typed, max_size)
+            payload = await reader.readexactly(body_len)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None, None, 0
+
+        return (msg_type,) + Protocol.decode_frame(encoding, payload)
+
+    @staticmethod
+    def send_stream(sock, f, offset, count, use_sendfile=True, hasher=None):
+        """
+        把文件内容作为原始字节流发送到socket（不分帧）
+        优先使用 os.sendfile 由内核直接拷贝，不支持时回退到
+        readinto + 复用缓冲区的循环
+        hasher（StreamHasher）: 回退时直接哈希读出的数据块，不再读第二遍；
+        sendfile 的数据不经过Python，由哈希线程从文件读取同一段（通常命中页缓存）
+        返回: 实际发送的字节数
+        """
+        sent = 0
+
+        if use_sendfile and hasattr(os, 'sendfile'):
             try:
-                payload = payload.decode('utf-8')
-            except:
-                pass  # 保持为bytes
+                sock_fd = sock.fileno()
+                file_fd = f.fileno()
+                while sent < count:
+                    try:
+                        n = os.sendfile(sock_fd, file_fd, offset + sent, count - sent)
+                    except BlockingIOError:
+                        # 带超时的socket处于非阻塞模式，等待可写
+                        select.select([], [sock], [], sock.gettimeout())
+                        continue
+                    if n == 0:
+                        break
+                    if hasher and not sent:
+                        # 确认sendfile可用后才交给哈希线程，避免回退时重复哈希
+                        hasher.update_file(f.name, offset, count)
+                    sent += n
+                if sent < count:
+                    raise IOError(f"文件在发送过程中被截断: {sent}/{count}")
+                return sent
+            except OSError as e:
+                # 只有sendfile本身不可用且尚未发出数据时才回退
+                if sent or not Protocol._sendfile_unsupported(e):
+                    raise
 
-        return msg_type, payload
+        buffer = None
+        f.seek(offset)
+        while sent < count:
+            if buffer is None or hasher:
+                # 交给哈希线程的数据块由它异步处理，不能复用
+                buffer = bytearray(min(Protocol.STREAM_CHUNK_SIZE, max(count - sent, 1)))
+                view = memoryview(buffer)
+            n = f.readinto(view[:min(len(buffer), count - sent)])
+            if not n:
+                raise IOError(f"文件在发送过程中被截断: {sent}/{count}")
+            sock.sendall(view[:n])
+            if hasher:
+                hasher.update(view[:n])
+            sent += n
+        return sent
+
+    @staticmethod
+    def _sendfile_unsupported(error):
+        """判断异常是否表示当前文件/socket不支持sendfile"""
+        if isinstance(error, io.UnsupportedOperation):
+            return True
+        return error.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+
+    @staticmethod
+    def recv_stream(sock, count, chunk_size=None):
+        """
+        接收count字节的原始数据流
+        逐块生成bytearray，每块独立分配，可以直接交给其他线程写盘
+        """
+        chunk_size = chunk_size or Protocol.STREAM_CHUNK_SIZE
+        remaining = count
+        while remaining > 0:
+            chunk = Protocol.recv_exact(sock, min(chunk_size, remaining))
+            if chunk is None:
+                raise ConnectionError("数据流接收中断")
+            remaining -= len(chunk)
+            yield chunk
+
+    @staticmethod
+    def negotiate_features(requested):
+        """
+        协商特性
+        返回双方都支持的特性列表
+        """
+        if not isinstance(requested, list):
+            return []
+        return [feature for feature in Protocol.FEATURES if feature in requested]
+
+    @staticmethod
+    def reply_to(request, reply):
+        """在回复中带上请求的 req_id，客户端据此把回复交给对应的请求"""
+        if isinstance(request, dict) and 'req_id' in request:
+            reply['req_id'] = request['req_id']
+        return reply
@@ -0,0 +1,110 @@
+"""
+可续传的文件传输
+未完成的传输写入目标旁边的 .part 文件，传完并校验通过后才改名为目标文件；
+传输ID由发起方根据源文件和目标位置算出，断线重连后同一传输得到相同的ID，
+接收方据此找到已有的 .part 文件，从其长度处继续
+
+两端在数据经过时用 StreamHasher 计算BLAKE2b，完成消息中比较摘要，
+不需要传完后再读一遍文件
+"""
+import hashlib
+import os
+import queue
+import re
+import threading
+
+PART_SUFFIX = '.part'
+DIGEST_SIZE = 32  # BLAKE2b摘要字节数
+
+_TRANSFER_ID = re.compile(r'[0-9a-f]{16}')
+
+
+def transfer_id(*parts):
+    """由源文件和目标位置（路径、大小、修改时间等）算出传输ID"""
+    h = hashlib.blake2b(digest_size=8)
+    h.update('\0'.join(str(part) for part in parts).encode('utf-8'))
+    return h.hexdigest()
+
+
+def valid_transfer_id(value):
+    """传输ID会成为文件名的一部分，只接受 transfer_id 生成的格式"""
+    return isinstance(value, str) and _TRANSFER_ID.fullmatch(value) is not None
+
+
+def part_path(path, tid):
+    """传输未完成时使用的临时文件"""
+    return f"{path}.{tid}{PART_SUFFIX}"
+
+
+def file_digest(path):
+    """文件内容的BLAKE2b摘要（十六进制）"""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    _hash_file(h, path, 0, None)
+    return h.hexdigest()
+
+
+def _hash_file(h, path, offset, length, chunk_size=1024 * 1024):
+    """把文件中从 offset 开始的 length 字节（None 表示到文件末尾）加入哈希"""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining is None or remaining > 0:
+            n = f.readinto(buffer if remaining is None or remaining >= chunk_size else view[:remaining])
+            if not n:
+                break
+            h.update(view[:n])
+            if remaining is not None:
+                remaining -= n
+
+
+class StreamHasher:
+    """
+    流式计算BLAKE2b摘要
+    传输线程只把数据块放入队列，由后台线程计算（hashlib 处理大块数据时释放GIL），
+    哈希与网络收发同时进行；队列有上限，哈希跟不上时传输线程才会等待
+    """
+
+    def __init__(self, max_pending=64):
+        self.hash = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def update(self, data):
+        """加入一块数据（之后调用方不能再修改它）"""
+        self.pending.put(data)
+
+    def update_file(self, path, offset, length):
+        """加入文件中的一段，由后台线程读取（sendfile 发送的数据、续传前已有的部分）"""
+        self.pending.put((path, offset, length))
+
+    def hexdigest(self):
+        """等已加入的数据处理完，返回十六进制摘要"""
+        self.close()
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.hash.hexdigest()
+
+    def close(self):
+        """不再加入数据（传输中断时调用，后台线程处理完队列后退出）"""
+        self.pending.put(None)
+
+    def _run(self):
+        """后台线程：依次处理队列中的数据块和文件段"""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            if self.error:
+                continue
+            try:
+                if isinstance(item, tuple):
+                    _hash_file(self.hash, *item)
+                else:
+                    self.hash.update(item)
+            except OSError as e:
+                self.error = e
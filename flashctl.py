@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+FlashControler 命令行客户端启动脚本（无界面，不需要PyQt5）
+"""
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from client.cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
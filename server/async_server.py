@@ -0,0 +1,301 @@
+"""
+asyncio服务端
+单个事件循环处理所有连接的认证、消息分发和终端输出，
+文件读写放到执行器线程中完成
+在 config/settings.json 中设置 "server": {"mode": "asyncio"} 启用
+"""
+import asyncio
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.protocol import Protocol
+from server.server import FlashServer
+from server.terminal_handler import TerminalHandler
+from server.file_handler import FileHandler
+from server.exec_handler import ExecHandler
+from server.connection_writer import AsyncConnectionWriter
+
+
+class AsyncFlashServer(FlashServer):
+    """FlashControler服务端（asyncio模式）"""
+
+    def __init__(self, config_file="config/settings.json"):
+        super().__init__(config_file)
+        # 文件操作执行器线程数（所有连接共享）
+        self.executor_workers = self.config.get('server', 'executor_workers', 32)
+        # 每个连接排队等待执行的文件操作上限，超过后暂停读取该连接
+        self.max_file_tasks = 64
+
+        self.loop = None
+        self.executor = None
+        self.auth_executor = None
+        self.async_server = None
+
+    def start(self):
+        """启动服务器"""
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print(f"[错误] 服务器启动失败: {e}")
+        finally:
+            self.stop()
+
+    async def serve(self):
+        """在事件循环中监听并处理连接"""
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers,
+            thread_name_prefix='flash-io'
+        )
+        self.loop.set_default_executor(self.executor)
+        # 认证单独使用执行器，文件传输占满线程时新连接仍能完成认证
+        self.auth_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='flash-auth')
+
+        self.async_server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=128
+        )
+        self.running = True
+        self.start_shell_pool()
+
+        print(f"[FlashControler] 服务器启动成功（asyncio模式）")
+        print(f"[FlashControler] 监听地址: {self.host}:{self.port}")
+        print(f"[FlashControler] 等待客户端连接...")
+
+        async with self.async_server:
+            try:
+                await self.async_server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    async def handle_connection(self, reader, stream_writer):
+        """处理客户端连接"""
+        client_address = stream_writer.get_extra_info('peername')
+        client_ip = client_address[0]
+        print(f"[FlashControler] 新连接来自: {client_address}")
+
+        writer = None
+        terminal_handler = None
+        file_handler = None
+        file_worker = None
+        session_token = None
+        viewer = None
+        exec_handler = None
+        data_token, is_data = None, False
+
+        def close_data():
+            """控制连接断开时关闭这条数据连接（可在任意线程调用）"""
+            self.loop.call_soon_threadsafe(stream_writer.close)
+
+        try:
+            # 检查IP是否被封锁
+            blocked_response = self.check_blocked(client_ip)
+            if blocked_response:
+                stream_writer.write(Protocol.pack_message(Protocol.MSG_AUTH, blocked_response))
+                await stream_writer.drain()
+                return
+
+            # 等待认证
+            msg_type, payload = await Protocol.read_message(reader, max_size=Protocol.AUTH_FRAME_SIZE)
+
+            if msg_type != Protocol.MSG_AUTH:
+                # 非标准客户端，直接发送字符串
+                stream_writer.write(self.custom_message.encode('utf-8'))
+                await stream_writer.drain()
+                return
+
+            # 认证结果需要写黑名单文件，放到执行器中完成
+            payload = self.auth_payload(payload)
+            authenticated, features, auth_response = await self.loop.run_in_executor(
+                self.auth_executor, self.authenticate, client_ip, payload
+            )
+            if not authenticated:
+                stream_writer.write(Protocol.pack_message(Protocol.MSG_AUTH, auth_response))
+                await stream_writer.drain()
+                return
+
+            # 认证响应之后的所有帧按协商结果编码
+            typed = Protocol.FEATURE_TYPED_FRAMES in features
+            writer = AsyncConnectionWriter(self.loop, stream_writer, typed)
+
+            data_token, is_data = self.open_data_session(features, payload, auth_response, close_data)
+            if is_data and data_token is None:
+                writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, self.DATA_TOKEN_EXPIRED))
+                await stream_writer.drain()
+                return
+
+            # 初始化处理器：终端输出由事件循环监听，文件操作按顺序在执行器中执行
+            if payload.get('terminal', True) and not is_data:
+                shell = None
+                if self.needs_shell(features, payload):
+                    # 池为空时要 fork/exec 登录shell，放到执行器中，不阻塞其他连接
+                    shell = await self.loop.run_in_executor(None, self.acquire_shell)
+                terminal_handler, session_token, viewer = self.open_terminal(
+                    writer, features, payload, auth_response, shell)
+                if terminal_handler is None:
+                    await stream_writer.drain()
+                    return
+            else:
+                # 只执行命令或传输文件的连接（如批量执行）不启动终端
+                writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, auth_response))
+            file_handler = FileHandler(writer)
+            file_handler.dedicated = terminal_handler is None
+            exec_handler = ExecHandler(writer, loop=self.loop)
+            file_tasks = asyncio.Queue(maxsize=self.max_file_tasks)
+            file_worker = asyncio.create_task(self.run_file_tasks(file_tasks, writer))
+
+            # 处理客户端消息
+            while self.running:
+                msg_type, payload, channel = await Protocol.read_frame(reader, typed)
+
+                if msg_type is None:
+                    print(f"[FlashControler] 客户端 {client_address} 断开连接")
+                    break
+
+                # 终端输入
+                if msg_type == Protocol.MSG_TERMINAL_INPUT:
+                    if terminal_handler and (viewer is None or viewer.can_write):
+                        terminal_handler.handle_input(payload)
+
+                # 流控额度：带通道ID的属于下载通道，否则属于终端输出（观看者不参与流控）
+                elif msg_type == Protocol.MSG_FLOW_CREDIT:
+                    if isinstance(payload, dict) and payload.get('channel'):
+                        file_handler.handle_channel_credit(payload)
+                    elif terminal_handler and viewer is None:
+                        terminal_handler.handle_flow_credit(payload)
+
+                # 执行命令 - 进程在执行器中启动，管道由事件循环监听，可同时运行多条
+                elif msg_type == Protocol.MSG_EXEC:
+                    exec_handler.handle_exec(payload)
+
+                # 文件上传/数据/完成 - 同一连接内必须按顺序执行
+                elif msg_type == Protocol.MSG_FILE_UPLOAD:
+                    await file_tasks.put((file_handler.handle_upload_start, payload))
+
+                elif msg_type == Protocol.MSG_FILE_DATA:
+                    await file_tasks.put((file_handler.handle_file_data, payload, channel))
+
+                elif msg_type == Protocol.MSG_FILE_COMPLETE:
+                    await file_tasks.put((file_handler.handle_upload_complete, payload))
+
+                # 增量上传 - 签名、指令和完成同样按顺序在执行器中执行
+                elif msg_type == Protocol.MSG_DELTA_SIGNATURE:
+                    await file_tasks.put((file_handler.handle_delta_signature, payload))
+
+                elif msg_type == Protocol.MSG_DELTA_DATA:
+                    await file_tasks.put((file_handler.handle_delta_data, payload))
+
+                elif msg_type == Protocol.MSG_DELTA_COMPLETE:
+                    await file_tasks.put((file_handler.handle_delta_complete, payload))
+
+                # 目录上传 - 数据块交给解包线程，完成时在执行器中等待解包结束
+                elif msg_type == Protocol.MSG_DIR_UPLOAD:
+                    await file_tasks.put((file_handler.handle_dir_upload_start, payload))
+
+                elif msg_type == Protocol.MSG_DIR_DATA:
+                    await file_tasks.put((file_handler.handle_dir_data, payload))
+
+                elif msg_type == Protocol.MSG_DIR_COMPLETE:
+                    await file_tasks.put((file_handler.handle_dir_upload_complete, payload))
+
+                # 文件下载 - 与其他请求并发执行，数据流由写入器依次发送
+                elif msg_type == Protocol.MSG_FILE_DOWNLOAD:
+                    self.loop.create_task(self.run_download(file_handler.handle_download_request, payload, writer))
+
+                # 批量下载 - 同样在执行器中发送
+                elif msg_type == Protocol.MSG_FILE_BATCH:
+                    self.loop.create_task(self.run_download(file_handler.handle_file_batch, payload, writer))
+
+                # 目录下载 - 同样在执行器中边打包边发送
+                elif msg_type == Protocol.MSG_DIR_DOWNLOAD:
+                    self.loop.create_task(self.run_download(file_handler.handle_dir_download, payload, writer))
+
+                # 更新检查
+                elif msg_type == Protocol.MSG_UPDATE_CHECK:
+                    self.handle_update_check(writer)
+
+                # 目录/文件列表 - 互不依赖，直接并发执行
+                elif msg_type == Protocol.MSG_LIST_DIR:
+                    self.loop.run_in_executor(None, self.handle_list_dir, writer, payload)
+
+                elif msg_type == Protocol.MSG_FILE_LIST:
+                    self.loop.run_in_executor(None, file_handler.handle_file_list_request, payload)
+
+                # 设置留言
+                elif msg_type == Protocol.MSG_SET_MESSAGE:
+                    self.custom_message = payload.get('message', '访问被拒绝')
+                    print(f"[留言] 已更新自定义留言: {self.custom_message}")
+                    writer.send_message(Protocol.MSG_SET_MESSAGE, {"status": "success"})
+
+                # 心跳包
+                elif msg_type == Protocol.MSG_HEARTBEAT:
+                    writer.send_message(Protocol.MSG_HEARTBEAT, "pong")
+
+        except Exception as e:
+            print(f"[错误] 处理客户端 {client_address} 时出错: {e}")
+        finally:
+            if file_worker:
+                file_worker.cancel()
+            if file_handler:
+                file_handler.close()
+            self.close_data_session(data_token, is_data, close_data)
+            if exec_handler:
+                exec_handler.stop()
+            if terminal_handler and not self.close_terminal(terminal_handler, session_token, writer, viewer):
+                # 停止监听后在执行器中结束shell，避免阻塞事件循环
+                terminal_handler.stop_reading()
+                await self.loop.run_in_executor(None, terminal_handler.stop)
+            if writer and writer.compressor:
+                print(f"[终端] 输出压缩: {writer.compressor.summary()}")
+            if writer:
+                writer.close()
+            else:
+                stream_writer.close()
+            print(f"[FlashControler] 客户端 {client_address} 连接已关闭")
+
+    async def run_file_tasks(self, file_tasks, writer):
+        """按顺序在执行器中执行同一连接的文件操作"""
+        while True:
+            func, *args = await file_tasks.get()
+            try:
+                await self.loop.run_in_executor(None, func, *args)
+            except ConnectionError as e:
+                # 数据流中断，连接已不可用
+                print(f"[错误] 文件传输中断: {e}")
+                writer.close()
+                return
+            except Exception as e:
+                print(f"[错误] 文件操作失败: {e}")
+
+    async def run_download(self, download, payload, writer):
+        """在执行器中发送下载的文件或目录"""
+        try:
+            await self.loop.run_in_executor(None, download, payload)
+        except ConnectionError as e:
+            print(f"[错误] 文件传输中断: {e}")
+            writer.close()
+        except Exception as e:
+            print(f"[错误] 文件操作失败: {e}")
+
+    def terminal_options(self, features, auth_payload):
+        """终端输出由事件循环监听"""
+        options = super().terminal_options(features, auth_payload)
+        options['loop'] = self.loop
+        return options
+
+    def stop(self):
+        """停止服务器"""
+        self.running = False
+        if self.async_server and self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.async_server.close)
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        if self.auth_executor:
+            self.auth_executor.shutdown(wait=False)
+        self.sessions.close()
+        if self.shell_pool:
+            self.shell_pool.close()
+        print("[FlashControler] 服务器已停止")
@@ -0,0 +1,430 @@
+"""
+连接写入器
+每个客户端连接一个写入器，所有发送都经由它的写线程串行完成，
+保证帧不会被多个线程交错写坏
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.protocol import Protocol
+
+
+class ConnectionWriter:
+    """
+    连接写入器（带优先级通道的有界发送队列）
+    交互通道优先发送；批量数据按逻辑通道（每个文件传输一个）分别排队，
+    各通道轮流发送一帧，多个传输之间公平交错
+    """
+
+    # 发送通道：交互通道优先于批量通道
+    LANE_INTERACTIVE = 0
+    LANE_BULK = 1
+
+    # 走批量通道的消息类型，其余消息（终端输出、心跳、控制应答）走交互通道
+    BULK_TYPES = (
+        Protocol.MSG_FILE_DATA,
+        Protocol.MSG_FILE_COMPLETE,
+        Protocol.MSG_FILE_STREAM,
+        Protocol.MSG_DIR_DATA,
+        Protocol.MSG_DIR_COMPLETE,
+        Protocol.MSG_FILE_BATCH,
+    )
+
+    def __init__(self, sock, typed_frames=False, max_pending=256, coalesce_limit=65536):
+        """
+        初始化连接写入器
+
+        Args:
+            sock: 客户端socket
+            typed_frames: 是否使用类型帧（认证时协商）
+            max_pending: 交互通道和每个批量通道最多排队的帧数，超过后发送方阻塞
+            coalesce_limit: 小帧合并为一次 sendmsg 的最大字节数
+        """
+        self.sock = sock
+        self.typed_frames = typed_frames
+        self.compressor = None  # 终端输出的压缩上下文，协商了压缩时由服务端设置
+        self.max_pending = max_pending
+        self.coalesce_limit = coalesce_limit
+        self.max_iov = 64  # 单次 sendmsg 最多合并的帧数
+
+        self.interactive = deque()  # 交互通道
+        self.bulk = {}  # 逻辑通道ID -> 排队中的批量帧
+        self.ready = deque()  # 有批量帧待发送的逻辑通道，轮流发送
+        self.condition = threading.Condition()
+        self.drain_callbacks = []
+        self.closed = False
+        self.draining = False  # 正在关闭：发送完已排队的帧后结束写线程
+        self.error = None
+
+        # 统计
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.writes = 0
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def lane_for(self, msg_type):
+        """根据消息类型选择发送通道"""
+        return self.LANE_BULK if msg_type in self.BULK_TYPES else self.LANE_INTERACTIVE
+
+    def send_message(self, msg_type, data, block=True, channel=0):
+        """打包消息并放入对应通道"""
+        frame = Protocol.pack_message(msg_type, data, self.typed_frames, channel)
+        self.send_frame(frame, self.lane_for(msg_type), block, channel)
+
+    def send_frame(self, frame, lane=LANE_INTERACTIVE, block=True, channel=0):
+        """
+        放入已打包的帧，批量帧按 channel 分别排队
+        block=True 时通道满则阻塞；事件回调中应传 block=False，
+        再通过 congested()/on_drain() 暂停数据来源
+        """
+        with self.condition:
+            while True:
+                queue = self._queue(lane, channel)
+                if not block or self.closed or len(queue) < self.max_pending:
+                    break
+                self.condition.wait()
+            if self.closed:
+                raise ConnectionError(f"连接已关闭: {self.error}" if self.error else "连接已关闭")
+            if lane == self.LANE_BULK:
+                if not queue:
+                    self.ready.append(channel)
+                self.bulk[channel] = queue
+            queue.append(frame)
+            self.condition.notify_all()
+
+    def _queue(self, lane, channel):
+        """发送队列（调用方持有锁），批量通道的队列在取空后删除"""
+        if lane == self.LANE_INTERACTIVE:
+            return self.interactive
+        return self.bulk.get(channel) or deque()
+
+    def send_file(self, msg_type, header, f, offset, count, hasher=None):
+        """
+        在写线程中发送一个头帧及其后的原始文件数据流
+        发送期间独占socket，调用方阻塞直到发送完成；hasher 见 Protocol.send_stream
+        返回: 实际发送的字节数
+        """
+        frame = Protocol.pack_message(msg_type, header, self.typed_frames)
+        op = _StreamOp(frame, f, offset, count, hasher)
+        self.send_frame(op, self.LANE_BULK)
+        op.done.wait()
+        if op.error:
+            raise op.error
+        return op.sent
+
+    def congested(self, lane=LANE_INTERACTIVE, channel=0):
+        """通道是否已满"""
+        return len(self._queue(lane, channel)) >= self.max_pending
+
+    def on_drain(self, callback):
+        """注册一次性回调：交互通道排空到一半以下时在写线程中调用"""
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.interactive) >= self.max_pending // 2:
+                self.drain_callbacks.append(callback)
+                return
+        callback()
+
+    def close(self, flush=False):
+        """
+        关闭写入器
+        flush=True 时先等待已排队的帧发送完毕，否则丢弃未发送的帧
+        """
+        if flush and threading.current_thread() is not self.thread:
+            with self.condition:
+                self.draining = True
+                self.condition.notify_all()
+            self.thread.join(timeout=5)
+
+        with self.condition:
+            self.closed = True
+            pending = [item for queue in self.bulk.values() for item in queue]
+            self.interactive.clear()
+            self.bulk.clear()
+            self.ready.clear()
+            self.drain_callbacks.clear()
+            self.condition.notify_all()
+
+        # 唤醒仍在等待的文件流发送方
+        for item in pending:
+            if isinstance(item, _StreamOp):
+                item.finish(ConnectionError("连接已关闭"))
+
+    def stats(self):
+        """返回发送统计"""
+        return {
+            "frames": self.frames_sent,
+            "bytes": self.bytes_sent,
+            "writes": self.writes,
+            "pending": [len(self.interactive), sum(len(queue) for queue in self.bulk.values())],
+        }
+
+    def _next_batch(self):
+        """
+        取出下一批要发送的内容
+        交互通道优先；批量通道轮流各取一帧；连续的小帧合并成一批
+        """
+        with self.condition:
+            while not self.closed and not self.draining and not self.interactive and not self.ready:
+                self.condition.wait()
+            if self.closed or (not self.interactive and not self.ready):
+                return None
+
+            batch = []
+            size = 0
+            while self.interactive and len(batch) < self.max_iov:
+                item = self.interactive[0]
+                if batch and size + len(item) > self.coalesce_limit:
+                    break
+                batch.append(self.interactive.popleft())
+                size += len(item)
+
+            while self.ready and len(batch) < self.max_iov and size < self.coalesce_limit:
+                channel = self.ready[0]
+                queue = self.bulk[channel]
+                item = queue[0]
+                if isinstance(item, _StreamOp):
+                    # 文件流只能单独发送
+                    if batch:
+                        break
+                elif batch and size + len(item) > self.coalesce_limit:
+                    break
+
+                queue.popleft()
+                self.ready.popleft()
+                if queue:
+                    self.ready.append(channel)
+                else:
+                    del self.bulk[channel]
+                batch.append(item)
+                if isinstance(item, _StreamOp):
+                    break
+                size += len(item)
+
+            self.condition.notify_all()
+            return batch
+
+    def _fire_drain_callbacks(self):
+        """交互通道排空到一半以下时执行等待中的回调"""
+        with self.condition:
+            if not self.drain_callbacks or len(self.interactive) >= self.max_pending // 2:
+                return
+            callbacks, self.drain_callbacks = self.drain_callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"[错误] 发送队列回调失败: {e}")
+
+    def _run(self):
+        """写线程主循环"""
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            self._fire_drain_callbacks()
+
+            try:
+                if isinstance(batch[0], _StreamOp):
+                    op = batch[0]
+                    try:
+                        self.sock.sendall(op.frame)
+                        op.sent = Protocol.send_stream(self.sock, op.file, op.offset, op.count, hasher=op.hasher)
+                    except Exception as e:
+                        op.finish(e)
+                        raise
+                    op.finish()
+                    self.bytes_sent += len(op.frame) + op.sent
+                    self.frames_sent += 1
+                elif len(batch) == 1:
+                    self.sock.sendall(batch[0])
+                    self.bytes_sent += len(batch[0])
+                    self.frames_sent += 1
+                else:
+                    self._sendmsg_all(batch)
+                    self.bytes_sent += sum(len(frame) for frame in batch)
+                    self.frames_sent += len(batch)
+                self.writes += 1
+
+            except Exception as e:
+                self.error = e
+                print(f"[错误] 发送数据失败: {e}")
+                self.close()
+                break
+
+    def _sendmsg_all(self, frames):
+        """用 sendmsg 分散写一次发出多帧，处理部分发送"""
+        if not hasattr(self.sock, 'sendmsg'):
+            self.sock.sendall(b''.join(frames))
+            return
+
+        views = [memoryview(frame) for frame in frames]
+        index = 0
+        while index < len(views):
+            sent = self.sock.sendmsg(views[index:])
+            while index < len(views) and sent >= len(views[index]):
+                sent -= len(views[index])
+                index += 1
+            if sent:
+                views[index] = views[index][sent:]
+
+
+class AsyncConnectionWriter:
+    """
+    asyncio模式下的连接写入器，接口与 ConnectionWriter 一致
+    事件循环线程中直接写入transport；执行器线程中的批量数据
+    等待缓冲区排空后才返回，形成背压
+    """
+
+    LANE_INTERACTIVE = ConnectionWriter.LANE_INTERACTIVE
+    LANE_BULK = ConnectionWriter.LANE_BULK
+    BULK_TYPES = ConnectionWriter.BULK_TYPES
+
+    def __init__(self, loop, stream_writer, typed_frames=False):
+        self.loop = loop
+        self.stream_writer = stream_writer
+        self.transport = stream_writer.transport
+        self.typed_frames = typed_frames
+        self.compressor = None  # 终端输出的压缩上下文，协商了压缩时由服务端设置
+        self.loop_thread = threading.get_ident()
+
+        self.closed = False
+        self.streaming = False  # sendfile期间transport不允许写入
+        self.held = deque()  # sendfile期间暂存的帧
+        self.stream_lock = asyncio.Lock()  # 数据流依次发送
+        self.high_water = 1024 * 1024  # 写缓冲区超过此值视为拥塞
+
+        # 统计
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.writes = 0
+
+    def lane_for(self, msg_type):
+        """根据消息类型选择发送通道"""
+        return self.LANE_BULK if msg_type in self.BULK_TYPES else self.LANE_INTERACTIVE
+
+    def send_message(self, msg_type, data, block=True, channel=0):
+        """打包消息并发送，可在任意线程调用"""
+        frame = Protocol.pack_message(msg_type, data, self.typed_frames, channel)
+        self.send_frame(frame, self.lane_for(msg_type), block, channel)
+
+    def send_frame(self, frame, lane=LANE_INTERACTIVE, block=True, channel=0):
+        """
+        发送已打包的帧，可在任意线程调用（事件循环线程中从不阻塞）
+        各通道的批量帧各自等待缓冲区排空后写入，自然按帧交错
+        """
+        if self.closed:
+            raise ConnectionError("连接已关闭")
+
+        if threading.get_ident() == self.loop_thread:
+            self._write(frame)
+        elif lane == self.LANE_BULK:
+            # 执行器线程：等待写缓冲区排空，避免批量数据堆积在内存中
+            asyncio.run_coroutine_threadsafe(self._write_and_drain(frame), self.loop).result()
+        else:
+            self.loop.call_soon_threadsafe(self._write, frame)
+
+    def send_file(self, msg_type, header, f, offset, count, hasher=None):
+        """
+        发送一个头帧及其后的原始文件数据流（在执行器线程中调用）
+        loop.sendfile 的数据不经过Python，hasher 由哈希线程从文件读取同一段
+        返回: 实际发送的字节数
+        """
+        frame = Protocol.pack_message(msg_type, header, self.typed_frames)
+        if hasher:
+            hasher.update_file(f.name, offset, count)
+        future = asyncio.run_coroutine_threadsafe(
+            self._send_file(frame, f, offset, count), self.loop
+        )
+        return future.result()
+
+    def congested(self, lane=LANE_INTERACTIVE):
+        """transport写缓冲区是否超过高水位"""
+        return self.transport.get_write_buffer_size() >= self.high_water
+
+    def on_drain(self, callback):
+        """注册一次性回调：写缓冲区排空后在事件循环中调用"""
+        self.loop.create_task(self._call_after_drain(callback))
+
+    def close(self, flush=False):
+        """关闭写入器（在事件循环线程中调用），transport关闭前总会发送完缓冲区"""
+        self.closed = True
+        self.held.clear()
+        self.transport.close()
+
+    def stats(self):
+        """返回发送统计"""
+        return {
+            "frames": self.frames_sent,
+            "bytes": self.bytes_sent,
+            "writes": self.writes,
+            "pending": [self.transport.get_write_buffer_size(), len(self.held)],
+        }
+
+    def _write(self, frame):
+        if self.closed or self.transport.is_closing():
+            return
+        if self.streaming:
+            self.held.append(frame)
+            return
+        self.transport.write(frame)
+        self.frames_sent += 1
+        self.bytes_sent += len(frame)
+        self.writes += 1
+
+    async def _write_and_drain(self, frame):
+        self._write(frame)
+        await self.stream_writer.drain()
+
+    async def _call_after_drain(self, callback):
+        try:
+            await self.stream_writer.drain()
+        except Exception:
+            return
+        if not self.closed:
+            callback()
+
+    async def _send_file(self, frame, f, offset, count):
+        # 同时进行的多个下载依次发送，数据流之间不能交错
+        async with self.stream_lock:
+            self._write(frame)
+            await self.stream_writer.drain()
+
+            self.streaming = True
+            try:
+                # loop.sendfile 优先使用 os.sendfile，不支持时自动回退（不接受0字节）
+                sent = await self.loop.sendfile(self.transport, f, offset, count) if count else 0
+            finally:
+                self.streaming = False
+                while self.held:
+                    self._write(self.held.popleft())
+
+        self.bytes_sent += sent
+        return sent
+
+
+class _StreamOp:
+    """写线程中执行的文件数据流发送任务"""
+
+    def __init__(self, frame, f, offset, count, hasher=None):
+        self.frame = frame
+        self.file = f
+        self.offset = offset
+        self.count = count
+        self.hasher = hasher
+        self.sent = 0
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self.done.set()
@@ -0,0 +1,276 @@
+"""
+命令执行处理器
+不经过伪终端和登录shell，直接用管道运行命令，
+stdout/stderr 分别流式返回，结束后返回退出码和耗时
+"""
+import math
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.protocol import Protocol
+from server.pty_reactor import PTYReactor
+
+
+class ExecHandler:
+    """命令执行处理器（同一连接可同时运行多条命令）"""
+
+    def __init__(self, writer, loop=None, max_running=64):
+        """
+        初始化命令执行处理器
+
+        Args:
+            writer: 连接写入器
+            loop: asyncio事件循环（进程在默认执行器中启动，fork/exec 不阻塞事件循环）；
+                  为None时使用共享的PTYReactor，进程在调用线程中启动
+            max_running: 同一连接同时运行的命令数上限
+        """
+        self.writer = writer
+        self.spawn_in_executor = loop is not None
+        self.loop = loop if loop is not None else PTYReactor.instance()
+        self.max_running = max_running
+        self.running = {}  # exec_id -> _Exec
+        self.starting = set()  # 正在执行器中启动的 exec_id
+        self.closed = False
+
+    def handle_exec(self, payload):
+        """
+        处理执行请求
+        payload: {"exec_id", "command": 字符串（由/bin/sh执行）或参数列表, "cwd", "env", "timeout"}
+        """
+        if not isinstance(payload, dict):
+            return
+        exec_id = payload.get('exec_id')
+        command = payload.get('command')
+
+        if not command:
+            self._send_exit(exec_id, None, 0, "缺少命令")
+            return
+        if exec_id in self.running or exec_id in self.starting:
+            self._send_exit(exec_id, None, 0, "exec_id 重复")
+            return
+        if len(self.running) + len(self.starting) >= self.max_running:
+            self._send_exit(exec_id, None, 0, f"同时运行的命令已达上限 ({self.max_running})")
+            return
+
+        # 参数在启动进程前检查，出错时只回复这条命令，不影响连接
+        extra_env = payload.get('env')
+        if extra_env is not None and not isinstance(extra_env, dict):
+            self._send_exit(exec_id, None, 0, "env 必须是对象")
+            return
+        timeout = payload.get('timeout')
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                    or not math.isfinite(timeout) or timeout < 0):
+            self._send_exit(exec_id, None, 0, "timeout 必须是正数")
+            return
+
+        env = None
+        if extra_env:
+            env = os.environ.copy()
+            env.update({str(k): str(v) for k, v in extra_env.items()})
+
+        start = time.monotonic()
+        cwd = payload.get('cwd') or None
+        if not self.spawn_in_executor:
+            try:
+                process = self._spawn(command, cwd, env)
+            except Exception as e:
+                self._send_exit(exec_id, None, time.monotonic() - start, str(e))
+                return
+            self._started(exec_id, process, start, timeout)
+            return
+
+        self.starting.add(exec_id)
+        future = self.loop.run_in_executor(None, self._spawn, command, cwd, env)
+        future.add_done_callback(lambda f: self._on_spawned(f, exec_id, start, timeout))
+
+    @staticmethod
+    def _spawn(command, cwd, env):
+        """启动命令进程"""
+        return subprocess.Popen(
+            command,
+            shell=isinstance(command, str),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            start_new_session=True  # 超时或断开时可以结束整个进程组
+        )
+
+    def _on_spawned(self, future, exec_id, start, timeout):
+        """执行器中的进程启动完成（在事件循环中回调）"""
+        self.starting.discard(exec_id)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            try:
+                self._send_exit(exec_id, None, time.monotonic() - start, str(error))
+            except ConnectionError:
+                pass
+            return
+        process = future.result()
+        if self.closed:
+            # 启动期间连接已断开
+            self._kill_process(process)
+            _Exec(exec_id, process, start).close_pipes()
+            threading.Thread(target=_reap, args=([process],), daemon=True).start()
+            return
+        self._started(exec_id, process, start, timeout)
+
+    def _started(self, exec_id, process, start, timeout):
+        """进程已启动：登记命令，开始监听stdout/stderr"""
+        job = _Exec(exec_id, process, start)
+        for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+            os.set_blocking(pipe.fileno(), False)
+            job.fds[pipe.fileno()] = name
+        if timeout:
+            job.timer = self.loop.call_later(timeout, self._on_timeout, job)
+
+        # 两个管道都登记后再开始监听，避免一个管道先关闭时误判命令已结束
+        self.running[exec_id] = job
+        for fd in list(job.fds):
+            self.loop.add_reader(fd, self._on_readable, job, fd)
+
+    def _on_readable(self, job, fd):
+        """管道可读回调（在事件循环/反应器线程中执行）"""
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._close_pipe(job, fd)
+            return
+
+        try:
+            self.writer.send_message(Protocol.MSG_EXEC_OUTPUT, {
+                "exec_id": job.exec_id,
+                "stream": job.fds[fd],
+                "data": data
+            }, block=False)
+        except ConnectionError:
+            self._kill(job)
+            return
+
+        if self.writer.congested():
+            # 发送队列已满：暂停读取该管道，命令随之阻塞，队列排空后恢复
+            self.loop.remove_reader(fd)
+            self.writer.on_drain(lambda: self._resume(job, fd))
+
+    def _resume(self, job, fd):
+        """恢复读取管道"""
+        if fd in job.fds:
+            self.loop.add_reader(fd, self._on_readable, job, fd)
+
+    def _close_pipe(self, job, fd):
+        """管道已关闭；stdout和stderr都关闭后等待进程退出"""
+        self.loop.remove_reader(fd)
+        job.fds.pop(fd, None)
+        if not job.fds:
+            self._check_exit(job)
+
+    def _check_exit(self, job):
+        """进程退出后发送退出码，管道关闭后进程可能稍晚才退出"""
+        returncode = job.process.poll()
+        if returncode is None:
+            self.loop.call_later(0.01, self._check_exit, job)
+            return
+
+        if job.timer is not None:
+            job.timer.cancel()
+        job.close_pipes()
+        if self.running.pop(job.exec_id, None) is None:
+            return
+
+        error = "执行超时" if job.timed_out else None
+        try:
+            self._send_exit(job.exec_id, returncode, time.monotonic() - job.start, error)
+        except ConnectionError:
+            pass
+
+    def _on_timeout(self, job):
+        """超过请求的超时时间，结束进程组"""
+        if job.process.poll() is None:
+            job.timed_out = True
+            self._kill(job)
+
+    def _kill(self, job):
+        """结束命令的整个进程组"""
+        self._kill_process(job.process)
+
+    @staticmethod
+    def _kill_process(process):
+        """结束进程所在的整个进程组"""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _send_exit(self, exec_id, returncode, elapsed, error=None):
+        """发送退出状态"""
+        message = {
+            "exec_id": exec_id,
+            "returncode": returncode,
+            "elapsed": round(elapsed, 6)
+        }
+        if error:
+            message["error"] = error
+        self.writer.send_message(Protocol.MSG_EXEC_EXIT, message, block=False)
+
+    def stop(self):
+        """连接断开：结束所有仍在运行的命令（仍在启动的命令启动后立即结束）"""
+        self.closed = True
+        jobs = list(self.running.values())
+        for job in jobs:
+            for fd in list(job.fds):
+                try:
+                    self.loop.remove_reader(fd)
+                except Exception:
+                    pass
+            if job.timer is not None:
+                job.timer.cancel()
+            self._kill(job)
+            job.close_pipes()
+        if jobs:
+            print(f"[执行] 连接断开，结束 {len(jobs)} 条运行中的命令")
+            # 回收被结束的进程，避免留下僵尸进程；stop 可能在事件循环中调用，不能在这里等待
+            threading.Thread(target=_reap, args=([job.process for job in jobs],), daemon=True).start()
+        self.running.clear()
+
+
+def _reap(processes, timeout=10):
+    """等待已发送 SIGKILL 的进程退出并回收"""
+    for process in processes:
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print(f"[执行] 进程 {process.pid} 未能结束")
+
+
+class _Exec:
+    """一条运行中的命令"""
+
+    def __init__(self, exec_id, process, start):
+        self.exec_id = exec_id
+        self.process = process
+        self.start = start
+        self.fds = {}  # 尚未关闭的管道fd -> 流名称
+        self.timer = None
+        self.timed_out = False
+
+    def close_pipes(self):
+        """关闭stdout/stderr管道"""
+        for pipe in (self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
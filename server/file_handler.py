@@ -1,125 +1,555 @@
 """
 文件处理器
 处理文件接收和存储
+
+客户端协商了 channels 特性时，每个传输在请求中指定自己的逻辑通道，
+同一连接可以同时接收多个上传、发送多个下载，各通道独立做窗口流控；
+不支持通道的客户端使用通道0，同一时间只有一个上传
+
+请求带 transfer_id 时可以断点续传：上传写入 .part 文件，
+连接断开后保留，同一传输再次开始时从已有的长度处继续，校验通过后才改名；
+请求带 checksum 时在数据经过时计算BLAKE2b，完成消息中与对方的摘要比较；
+增量上传按客户端的指令从已有文件复制块、写入新数据，校验后原子替换目标文件；
+目录传输为一个tar数据流，下载时边打包边发送，上传时由解包线程边收边解包；
+批量下载时小文件拼在同一帧中发送，大文件随后单独分块发送
 """
 import os
+import queue
+import stat
 import sys
+import threading
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.protocol import Protocol
+from common.channel import SendWindow, ReceiveWindow
+from common.transfer import valid_transfer_id, transfer_id, part_path, StreamHasher
+from common.delta import block_size_for, file_signature
+from common.archive import ChunkWriter, ChunkReader, write_tree, extract_tree
 
 
 class FileHandler:
     """文件处理器"""
 
-    def __init__(self, client_socket):
-        self.client_socket = client_socket
-        self.current_file = None
-        self.current_file_path = None
-        self.total_size = 0
-        self.received_size = 0
+    def __init__(self, writer):
+        self.writer = writer  # 连接写入器，所有发送经由它串行完成
+        self.uploads = {}  # 通道ID -> 正在接收的上传
+        self.send_windows = {}  # 通道ID -> 正在发送的下载的窗口
+        self.deltas = {}  # 请求ID -> 正在进行的增量上传
+        self.dir_uploads = {}  # 请求ID -> 正在解包的目录上传
         self.chunk_size = 65536  # 64KB 块大小，优化传输速度
+        self.batch_file_size = 65536  # 批量下载中不超过此大小的文件拼帧发送
+        self.batch_frame_size = 256 * 1024  # 拼帧的目标大小
+        # 客户端这么久不发放通道额度时放弃下载，不让发送线程无限期占用执行器
+        self.window_timeout = 30
+        # 连接上没有终端（数据连接、只传输文件的连接）：没有其他传输时下载可以独占连接
+        self.dedicated = False
+        self.streams = set()  # 正在以数据流发送的下载
+
+    def busy(self):
+        """连接上是否有正在进行的传输"""
+        return bool(self.send_windows or self.streams or self.uploads or self.deltas or self.dir_uploads)
+
+    @staticmethod
+    def channel_of(request):
+        """请求指定的逻辑通道，未指定时为0"""
+        return request.get('channel', 0) if isinstance(request, dict) else 0
 
     def handle_upload_start(self, file_info):
         """处理文件上传开始"""
         try:
             filename = file_info.get('filename') or 'unknown'
             target_path = file_info.get('target_path') or '/tmp'
-            self.total_size = file_info.get('size', 0)
-            self.received_size = 0
+            channel = self.channel_of(file_info)
 
             # 确保目标目录存在
             os.makedirs(target_path, exist_ok=True)
 
-            # 构建完整文件路径
-            self.current_file_path = os.path.join(target_path, filename)
-
-            # 打开文件准备写入
-            self.current_file = open(self.current_file_path, 'wb')
+            # 构建完整文件路径并打开文件准备写入
+            upload = _Upload(os.path.join(target_path, filename), file_info.get('size', 0))
+            tid = file_info.get('transfer_id')
+            if tid is None:
+                upload.file = open(upload.path, 'wb')
+            elif not valid_transfer_id(tid):
+                raise ValueError("无效的传输ID")
+            else:
+                # 可续传：写入 .part 文件，已有的数据从其末尾继续
+                upload.part = part_path(upload.path, tid)
+                offset = os.path.getsize(upload.part) if os.path.isfile(upload.part) else 0
+                if offset > upload.total_size:
+                    offset = 0
+                upload.file = open(upload.part, 'r+b' if offset else 'wb')
+                upload.file.seek(offset)
+                upload.file.truncate()
+                upload.received_size = offset
+            if file_info.get('checksum') or upload.part:
+                upload.hasher = StreamHasher()
+                if upload.received_size:
+                    # 续传前已有的部分由哈希线程从 .part 中读取
+                    upload.hasher.update_file(upload.part, 0, upload.received_size)
+            if channel:
+                upload.window = ReceiveWindow(Protocol.CHANNEL_WINDOW)
+            previous = self.uploads.pop(channel, None)
+            if previous:
+                previous.close()
+            self.uploads[channel] = upload
 
             print(f"[文件传输] 开始接收文件: {filename}")
-            print(f"[文件传输] 目标路径: {self.current_file_path}")
-            print(f"[文件传输] 文件大小: {self.total_size} 字节")
-
-            # 发送确认
-            response = Protocol.pack_message(
-                Protocol.MSG_FILE_UPLOAD,
-                {"status": "ready"}
-            )
-            self.client_socket.send(response)
+            print(f"[文件传输] 目标路径: {upload.path}")
+            print(f"[文件传输] 文件大小: {upload.total_size} 字节")
+            if upload.received_size:
+                print(f"[文件传输] 从第 {upload.received_size} 字节续传")
+
+            # 发送确认，使用通道时告知客户端窗口大小，续传时告知已收到的字节数
+            reply = {"status": "ready"}
+            if upload.part:
+                reply["offset"] = upload.received_size
+            if channel:
+                reply["window"] = Protocol.CHANNEL_WINDOW
+            self.writer.send_message(Protocol.MSG_FILE_UPLOAD, Protocol.reply_to(file_info, reply))
 
         except Exception as e:
             print(f"[错误] 准备接收文件失败: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": str(e)}
+                Protocol.reply_to(file_info, {"error": str(e)})
             )
-            self.client_socket.send(response)
 
-    def handle_file_data(self, data):
-        """处理文件数据"""
+    def handle_file_data(self, data, channel=0):
+        """处理文件数据（channel 为数据帧所在的逻辑通道）"""
         try:
-            if self.current_file is None:
+            upload = self.uploads.get(channel)
+            if upload is None:
                 print("[错误] 没有正在接收的文件")
                 return
 
-            # 如果data是字典，提取实际的数据
+            # 新客户端直接发送原始字节（类型帧）
+            # 兼容旧格式：字典中的base64字符串
             if isinstance(data, dict):
                 data = data.get('data', b'')
                 if isinstance(data, str):
                     # Base64解码或其他处理
                     import base64
                     data = base64.b64decode(data)
+            elif isinstance(data, str):
+                # 传统帧会把可解码为UTF-8的原始数据转成字符串，还原为字节
+                data = data.encode('utf-8')
 
             # 写入文件
-            self.current_file.write(data)
-            self.received_size += len(data)
+            upload.file.write(data)
+            upload.received_size += len(data)
+            if upload.hasher:
+                upload.hasher.update(data)
+
+            # 写入磁盘后向客户端发放通道额度
+            if upload.window:
+                credit = upload.window.consume(len(data))
+                if credit:
+                    self.writer.send_message(Protocol.MSG_FLOW_CREDIT, {"channel": channel, "bytes": credit})
 
             # 打印进度
-            progress = (self.received_size / self.total_size * 100) if self.total_size > 0 else 0
-            print(f"[文件传输] 接收进度: {progress:.1f}% ({self.received_size}/{self.total_size})")
+            progress = (upload.received_size / upload.total_size * 100) if upload.total_size > 0 else 0
+            print(f"[文件传输] 接收进度: {progress:.1f}% ({upload.received_size}/{upload.total_size})")
 
         except Exception as e:
             print(f"[错误] 写入文件数据失败: {e}")
 
-    def handle_upload_complete(self):
+    def handle_upload_complete(self, request=None):
         """处理文件上传完成"""
         try:
-            if self.current_file:
-                self.current_file.close()
-                print(f"[文件传输] 文件接收完成: {self.current_file_path}")
-                print(f"[文件传输] 总计接收: {self.received_size} 字节")
+            upload = self.uploads.pop(self.channel_of(request), None)
+            if upload:
+                upload.close()
+                reply = {
+                    "status": "success",
+                    "path": upload.path,
+                    "size": upload.received_size
+                }
+                digest = self.finish_upload(upload, request.get('blake2b'))
+                if digest:
+                    reply["blake2b"] = digest
+                print(f"[文件传输] 文件接收完成: {upload.path}")
+                print(f"[文件传输] 总计接收: {upload.received_size} 字节")
 
                 # 发送完成确认
-                response = Protocol.pack_message(
+                self.writer.send_message(
                     Protocol.MSG_FILE_COMPLETE,
-                    {
-                        "status": "success",
-                        "path": self.current_file_path,
-                        "size": self.received_size
-                    }
+                    Protocol.reply_to(request, reply)
                 )
-                self.client_socket.send(response)
-
-                # 重置状态
-                self.current_file = None
-                self.current_file_path = None
-                self.total_size = 0
-                self.received_size = 0
 
         except Exception as e:
             print(f"[错误] 完成文件接收失败: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": str(e)})
+            )
+
+    def finish_upload(self, upload, expected):
+        """
+        与客户端的摘要比较；可续传的上传校验通过后把 .part 改名为目标文件
+        返回: 收到数据的blake2b摘要，未计算时为None
+        """
+        if upload.part and upload.received_size != upload.total_size:
+            # 保留 .part，客户端可以继续传
+            raise ValueError(f"文件不完整: {upload.received_size}/{upload.total_size}")
+        digest = upload.hasher.hexdigest() if upload.hasher else None
+        if expected and digest and expected != digest:
+            os.remove(upload.part or upload.path)
+            raise ValueError("文件校验失败，已删除接收的数据")
+        if upload.part:
+            os.replace(upload.part, upload.path)
+        return digest
+
+    def handle_delta_signature(self, request):
+        """
+        处理增量上传请求：计算已有目标文件的块签名发给客户端，准备写出新文件
+        目标文件不存在时签名为空，客户端发送全部数据
+        """
+        try:
+            filename = request.get('filename') or 'unknown'
+            target_path = request.get('target_path') or '/tmp'
+            os.makedirs(target_path, exist_ok=True)
+
+            delta = _Delta(os.path.join(target_path, filename))
+            signature, blocks, size = b'', 0, 0
+            if os.path.isfile(delta.path):
+                delta.basis = open(delta.path, 'rb')
+                size = os.fstat(delta.basis.fileno()).st_size
+                delta.block_size = block_size_for(size)
+                signature, blocks = file_signature(delta.basis, delta.block_size)
+            delta.part = part_path(delta.path, transfer_id(delta.path, request.get('req_id'), time.time_ns()))
+            delta.file = open(delta.part, 'wb')
+            delta.hasher = StreamHasher()
+
+            previous = self.deltas.pop(request.get('req_id'), None)
+            if previous:
+                previous.discard()
+            self.deltas[request.get('req_id')] = delta
+
+            print(f"[增量上传] 目标文件: {delta.path} ({size} 字节, {blocks} 块)")
+            self.writer.send_message(
+                Protocol.MSG_DELTA_SIGNATURE,
+                Protocol.reply_to(request, {
+                    "status": "ready",
+                    "size": size,
+                    "block_size": delta.block_size,
+                    "data": signature
+                })
+            )
+
+        except Exception as e:
+            print(f"[错误] 准备增量上传失败: {e}")
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": str(e)})
+            )
+
+    def handle_delta_data(self, payload):
+        """处理增量上传的复制指令或原始数据"""
+        delta = self.deltas.get(payload.get('req_id'))
+        if delta is None:
+            print("[错误] 没有正在进行的增量上传")
+            return
+        if delta.error:
+            return
+        try:
+            if 'copy' in payload:
+                start, count = payload['copy']
+                delta.copy_blocks(start, count)
+            else:
+                delta.write(payload.get('data', b''))
+        except Exception as e:
+            # 在完成消息中报告，之后的指令忽略
+            print(f"[错误] 写入增量数据失败: {e}")
+            delta.error = str(e)
+
+    def handle_delta_complete(self, request):
+        """处理增量上传完成：校验新文件后原子替换目标文件"""
+        delta = self.deltas.pop(request.get('req_id'), None)
+        if delta is None:
+            return
+        try:
+            delta.close()
+            if delta.error:
+                raise ValueError(delta.error)
+            if request.get('size') is not None and request['size'] != delta.size:
+                raise ValueError(f"文件大小不一致: {delta.size}/{request['size']}")
+            digest = delta.hasher.hexdigest()
+            if request.get('blake2b') and request['blake2b'] != digest:
+                raise ValueError("文件校验失败")
+            if delta.mode is not None:
+                os.chmod(delta.part, delta.mode)
+            os.replace(delta.part, delta.path)
+
+            print(f"[增量上传] 完成: {delta.path} (复制 {delta.copied} 字节, 接收 {delta.received} 字节)")
+            self.writer.send_message(
+                Protocol.MSG_DELTA_COMPLETE,
+                Protocol.reply_to(request, {
+                    "status": "success",
+                    "path": delta.path,
+                    "size": delta.size,
+                    "copied": delta.copied,
+                    "received": delta.received,
+                    "blake2b": digest
+                })
+            )
+
+        except Exception as e:
+            print(f"[错误] 完成增量上传失败: {e}")
+            delta.discard()
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": str(e)})
+            )
+
+    def handle_dir_upload_start(self, request):
+        """处理目录上传请求：启动解包线程，之后收到的数据块交给它边收边解包"""
+        try:
+            target_path = request.get('target_path') or '/tmp'
+            channel = self.channel_of(request)
+            os.makedirs(target_path, exist_ok=True)
+
+            dir_upload = _DirUpload(target_path, self.writer, channel)
+            previous = self.dir_uploads.pop(request.get('req_id'), None)
+            if previous:
+                previous.abort()
+            self.dir_uploads[request.get('req_id')] = dir_upload
+
+            print(f"[目录传输] 开始接收目录到: {target_path}")
+            reply = {"status": "ready"}
+            if channel:
+                reply["window"] = Protocol.CHANNEL_WINDOW
+            self.writer.send_message(Protocol.MSG_DIR_UPLOAD, Protocol.reply_to(request, reply))
+
+        except Exception as e:
+            print(f"[错误] 准备接收目录失败: {e}")
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": str(e)})
+            )
+
+    def handle_dir_data(self, payload):
+        """处理目录数据流的一块"""
+        dir_upload = self.dir_uploads.get(payload.get('req_id'))
+        if dir_upload is None:
+            print("[错误] 没有正在接收的目录")
+            return
+        dir_upload.feed(payload.get('data', b''))
+
+    def handle_dir_upload_complete(self, request):
+        """处理目录上传完成：等解包线程处理完剩余数据后回复结果"""
+        dir_upload = self.dir_uploads.pop(request.get('req_id'), None)
+        if dir_upload is None:
+            return
+        try:
+            stats = dir_upload.finish()
+            print(f"[目录传输] 接收完成: {dir_upload.target} ({stats['files']} 个文件, {stats['bytes']} 字节)")
+            for skipped in stats['skipped']:
+                print(f"[目录传输] 跳过: {skipped}")
+            self.writer.send_message(
+                Protocol.MSG_DIR_COMPLETE,
+                Protocol.reply_to(request, {
+                    "status": "success",
+                    "path": dir_upload.target,
+                    "files": stats['files'],
+                    "bytes": stats['bytes'],
+                    "skipped": stats['skipped']
+                })
+            )
+
+        except Exception as e:
+            print(f"[错误] 解包目录失败: {e}")
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": f"解包目录失败: {e}"})
+            )
+
+    def handle_dir_download(self, request):
+        """
+        处理目录下载请求：边打包边发送tar数据流
+        使用逻辑通道时在通道上分帧发送并做窗口流控
+        """
+        channel = self.channel_of(request)
+        window = None
+        try:
+            dir_path = request.get('path')
+            if not dir_path:
+                raise ValueError("目录路径不能为空")
+            if not os.path.isdir(dir_path):
+                raise FileNotFoundError(f"目录不存在: {dir_path}")
+
+            print(f"[目录下载] 开始发送目录: {dir_path}")
+            reply = {"status": "ready", "path": dir_path}
+            self.writer.send_message(Protocol.MSG_DIR_DOWNLOAD, Protocol.reply_to(request, reply))
+
+            if channel:
+                window = SendWindow(request.get('window') or Protocol.CHANNEL_WINDOW)
+                self.send_windows[channel] = window
+
+            def send(chunk):
+                if window:
+                    window.acquire(len(chunk), timeout=self.window_timeout)
+                self.writer.send_message(
+                    Protocol.MSG_DIR_DATA,
+                    Protocol.reply_to(request, {"data": chunk}),
+                    channel=channel
+                )
+
+            output = ChunkWriter(send)
+            stats = write_tree(output, dir_path, request.get('include') or (), request.get('exclude') or ())
+            output.flush()
+            for skipped in stats['skipped']:
+                print(f"[目录下载] 跳过无法读取的文件: {skipped}")
+
+            # 完成消息与数据在同一通道，保证排在数据之后
+            self.writer.send_message(
+                Protocol.MSG_DIR_COMPLETE,
+                Protocol.reply_to(request, {
+                    "status": "success",
+                    "path": dir_path,
+                    "files": stats['files'],
+                    "bytes": stats['bytes'],
+                    "skipped": stats['skipped']
+                }),
+                channel=channel
+            )
+            print(f"[目录下载] 发送完成: {dir_path} ({stats['files']} 个文件, {output.total} 字节数据流)")
+
+        except ConnectionError:
+            raise
+
+        except Exception as e:
+            print(f"[错误] 目录下载失败: {e}")
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": str(e)}
+                Protocol.reply_to(request, {"error": str(e)}),
+                channel=channel
             )
-            self.client_socket.send(response)
+
+        finally:
+            if window:
+                self.send_windows.pop(channel, None)
+
+    def handle_file_batch(self, request):
+        """
+        处理批量下载请求：先发送清单，然后把小文件拼在同一帧中发送，
+        大文件随后单独分块发送；单个文件失败不影响其他文件
+        回复都在同一通道上发送，保证顺序
+        """
+        channel = self.channel_of(request)
+        window = None
+        try:
+            paths = request.get('paths')
+            if not isinstance(paths, list) or not paths:
+                raise ValueError("文件列表不能为空")
+
+            manifest = []
+            small, large = [], []
+            for i, path in enumerate(paths):
+                try:
+                    if not os.path.isfile(path):
+                        raise FileNotFoundError(f"不是有效的文件: {path}")
+                    size = os.path.getsize(path)
+                except OSError as e:
+                    manifest.append({"path": path, "error": str(e)})
+                    continue
+                manifest.append({"path": path, "size": size})
+                (small if size <= self.batch_file_size else large).append(i)
+
+            print(f"[批量下载] {len(paths)} 个文件: 拼帧 {len(small)} 个, 单独发送 {len(large)} 个")
+            if channel:
+                window = SendWindow(request.get('window') or Protocol.CHANNEL_WINDOW)
+                self.send_windows[channel] = window
+
+            def send(frame, nbytes=0):
+                if window and nbytes:
+                    window.acquire(nbytes, timeout=self.window_timeout)
+                self.writer.send_message(Protocol.MSG_FILE_BATCH, Protocol.reply_to(request, frame), channel=channel)
+
+            send({"status": "ready", "files": manifest})
+
+            sent_files, sent_size = 0, 0
+            index, data = [], bytearray()
+            for i in small:
+                try:
+                    with open(paths[i], 'rb') as f:
+                        content = f.read()
+                except OSError as e:
+                    send({"failed": i, "error": str(e)})
+                    continue
+                index.append([i, len(content)])
+                data += content
+                sent_files += 1
+                sent_size += len(content)
+                if len(data) >= self.batch_frame_size:
+                    send({"files": index, "data": bytes(data)}, len(data))
+                    index, data = [], bytearray()
+            if index:
+                send({"files": index, "data": bytes(data)}, len(data))
+
+            for i in large:
+                offset = 0
+                try:
+                    with open(paths[i], 'rb') as f:
+                        while True:
+                            chunk = f.read(self.chunk_size)
+                            if not chunk and offset:
+                                break
+                            # 读取时已被清空的文件也发送一块，客户端据此创建文件
+                            send({"file": i, "offset": offset, "data": chunk}, len(chunk))
+                            offset += len(chunk)
+                            if not chunk:
+                                break
+                except OSError as e:
+                    send({"failed": i, "error": str(e)})
+                    continue
+                sent_files += 1
+                sent_size += offset
+
+            self.writer.send_message(
+                Protocol.MSG_FILE_COMPLETE,
+                Protocol.reply_to(request, {"status": "success", "files": sent_files, "size": sent_size}),
+                channel=channel
+            )
+            print(f"[批量下载] 发送完成: {sent_files}/{len(paths)} 个文件, {sent_size} 字节")
+
+        except ConnectionError:
+            raise
+
+        except Exception as e:
+            print(f"[错误] 批量下载失败: {e}")
+            self.writer.send_message(
+                Protocol.MSG_ERROR,
+                Protocol.reply_to(request, {"error": str(e)}),
+                channel=channel
+            )
+
+        finally:
+            if window:
+                self.send_windows.pop(channel, None)
 
     def handle_download_request(self, file_info):
         """处理文件下载请求"""
+        hasher = None
+        stream_key = object()
         try:
             file_path = file_info.get('file_path') if isinstance(file_info, dict) else file_info
+            # 使用逻辑通道时分帧发送，与其他流量交错；
+            # 否则新客户端请求数据流模式：一个头帧 + 原始文件内容
+            channel = self.channel_of(file_info)
+            request = file_info if isinstance(file_info, dict) else {}
+            stream = request.get('stream', False)
+            if channel and stream and self.dedicated and not self.busy():
+                # 没有需要交错的流量，改用 sendfile 数据流，数据不经过Python
+                channel = 0
+            elif stream and not channel and not self.dedicated and not request.get('req_id'):
+                # 数据流发送期间写线程被独占，同一连接上的终端输出要等整个文件发完；
+                # 不带请求ID的旧客户端同样能接收分帧的数据，改为分帧发送
+                # （带请求ID但没有逻辑通道的客户端只能按请求ID接收数据流，仍然使用数据流）
+                stream = False
+            if stream and not channel:
+                self.streams.add(stream_key)
 
             # 验证文件路径
             if not file_path:
@@ -133,79 +563,188 @@ class FileHandler:
             if not os.path.isfile(file_path):
                 raise ValueError(f"不是有效的文件: {file_path}")
 
-            # 获取文件信息
-            file_size = os.path.getsize(file_path)
+            # 获取文件信息；请求可以只取从 offset 开始的 length 字节
+            file_stat = os.stat(file_path)
+            file_size = file_stat.st_size
             filename = os.path.basename(file_path)
+            offset = min(max(int(request.get('offset') or 0), 0), file_size)
+            length = file_size - offset
+            if request.get('length') is not None:
+                length = min(max(int(request['length']), 0), length)
 
             print(f"[文件下载] 开始发送文件: {filename}")
             print(f"[文件下载] 文件路径: {file_path}")
             print(f"[文件下载] 文件大小: {file_size} 字节")
+            if length != file_size:
+                print(f"[文件下载] 发送范围: {offset} - {offset + length}")
+
+            # 边发送边计算摘要；可续传的下载摘要覆盖整个文件，前面已发送的部分由哈希线程读取
+            if request.get('checksum') or request.get('transfer_id'):
+                hasher = StreamHasher()
+                if request.get('transfer_id') and offset:
+                    hasher.update_file(file_path, 0, offset)
 
             # 发送文件元数据
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_FILE_DOWNLOAD,
-                {
+                Protocol.reply_to(file_info, {
                     "status": "ready",
                     "filename": filename,
                     "size": file_size,
-                    "path": file_path
-                }
+                    "mtime": file_stat.st_mtime_ns,
+                    "path": file_path,
+                    "offset": offset,
+                    "length": length,
+                    "stream": bool(stream and not channel)
+                })
             )
-            self.client_socket.send(response)
 
             # 发送文件数据
-            sent_size = 0
-            with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(self.chunk_size)
-                    if not chunk:
-                        break
-
-                    # 发送数据块
-                    data_msg = Protocol.pack_message(Protocol.MSG_FILE_DATA, chunk)
-                    self.client_socket.send(data_msg)
-
-                    sent_size += len(chunk)
-                    progress = (sent_size / file_size * 100) if file_size > 0 else 0
-                    print(f"[文件下载] 发送进度: {progress:.1f}% ({sent_size}/{file_size})")
-
-            # 发送完成消息
-            complete_msg = Protocol.pack_message(
+            if channel:
+                sent_size = self.send_file_channel(file_path, channel, request.get('window'), offset, length, hasher)
+            elif stream:
+                sent_size = self.stream_file(file_path, offset, length, file_info, hasher)
+            else:
+                sent_size = self.send_file_frames(file_path, offset, length, hasher)
+
+            # 发送完成消息（与数据在同一通道，保证排在数据之后），附带摘要供客户端校验
+            complete = {
+                "status": "success",
+                "filename": filename,
+                "size": sent_size
+            }
+            if hasher:
+                complete["blake2b"] = hasher.hexdigest()
+            self.writer.send_message(
                 Protocol.MSG_FILE_COMPLETE,
-                {
-                    "status": "success",
-                    "filename": filename,
-                    "size": sent_size
-                }
+                Protocol.reply_to(file_info, complete),
+                channel=channel
             )
-            self.client_socket.send(complete_msg)
 
             print(f"[文件下载] 文件发送完成: {filename}")
             print(f"[文件下载] 总计发送: {sent_size} 字节")
 
+        except ConnectionError:
+            raise
+
         except FileNotFoundError as e:
             print(f"[错误] 文件不存在: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": f"文件不存在: {str(e)}"}
+                Protocol.reply_to(file_info, {"error": f"文件不存在: {str(e)}"})
             )
-            self.client_socket.send(response)
 
         except PermissionError as e:
             print(f"[错误] 权限不足: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": f"权限不足: {str(e)}"}
+                Protocol.reply_to(file_info, {"error": f"权限不足: {str(e)}"})
             )
-            self.client_socket.send(response)
 
         except Exception as e:
             print(f"[错误] 文件下载失败: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": str(e)}
+                Protocol.reply_to(file_info, {"error": str(e)})
             )
-            self.client_socket.send(response)
+
+        finally:
+            self.streams.discard(stream_key)
+            if hasher:
+                hasher.close()
+
+    def read_chunks(self, f, offset, length, hasher=None):
+        """从 offset 开始按块读取 length 字节，同时交给哈希线程"""
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if hasher:
+                hasher.update(chunk)
+            yield chunk
+
+    def send_file_frames(self, file_path, offset, length, hasher=None):
+        """按64KB数据帧发送文件（旧客户端兼容模式）"""
+        sent_size = 0
+        with open(file_path, 'rb') as f:
+            for chunk in self.read_chunks(f, offset, length, hasher):
+                # 发送数据块
+                self.writer.send_message(Protocol.MSG_FILE_DATA, chunk)
+
+                sent_size += len(chunk)
+                progress = (sent_size / length * 100) if length > 0 else 0
+                print(f"[文件下载] 发送进度: {progress:.1f}% ({sent_size}/{length})")
+
+        return sent_size
+
+    def send_file_channel(self, file_path, channel, window_size, offset, length, hasher=None):
+        """
+        在逻辑通道上分帧发送文件，与终端输出和其他传输按帧交错
+        未确认的数据不超过客户端的窗口，客户端写入磁盘后发放额度
+        """
+        window = SendWindow(window_size or Protocol.CHANNEL_WINDOW)
+        self.send_windows[channel] = window
+        sent_size = 0
+        try:
+            with open(file_path, 'rb') as f:
+                for chunk in self.read_chunks(f, offset, length, hasher):
+                    window.acquire(len(chunk), timeout=self.window_timeout)
+                    self.writer.send_message(Protocol.MSG_FILE_DATA, chunk, channel=channel)
+                    sent_size += len(chunk)
+        finally:
+            self.send_windows.pop(channel, None)
+
+        print(f"[文件下载] 通道 {channel} 发送完成: {sent_size} 字节")
+        return sent_size
+
+    def handle_channel_credit(self, payload):
+        """客户端为下载通道发放的额度"""
+        window = self.send_windows.get(payload.get('channel'))
+        if window:
+            window.release(payload.get('bytes', 0))
+
+    def close(self):
+        """连接断开：唤醒等待额度的下载，关闭未完成的上传"""
+        for window in list(self.send_windows.values()):
+            window.close()
+        for delta in list(self.deltas.values()):
+            delta.discard()
+        self.deltas.clear()
+        for dir_upload in list(self.dir_uploads.values()):
+            dir_upload.abort()
+            print(f"[目录传输] 连接断开，目录上传未完成: {dir_upload.target}")
+        self.dir_uploads.clear()
+        for upload in list(self.uploads.values()):
+            upload.close()
+            print(f"[文件传输] 连接断开，上传未完成: {upload.path} ({upload.received_size}/{upload.total_size})")
+            if upload.part:
+                print(f"[文件传输] 已保留 {upload.part}，重连后可续传")
+        self.uploads.clear()
+
+    def stream_file(self, file_path, offset, length, request=None, hasher=None):
+        """
+        以数据流模式发送文件
+        先发送一个带总长度的头帧，然后用 os.sendfile 由内核直接发送文件内容，
+        不支持时回退到 readinto + 复用缓冲区
+        回退时摘要直接使用读出的数据块；sendfile 的数据不经过Python，
+        摘要由哈希线程同时从文件读取（通常命中页缓存）
+        """
+        with open(file_path, 'rb') as f:
+            try:
+                sent_size = self.writer.send_file(
+                    Protocol.MSG_FILE_STREAM,
+                    Protocol.reply_to(request, {"size": length}),
+                    f, offset, length, hasher
+                )
+            except Exception as e:
+                # 头帧已发出，数据流中断后无法再发送错误帧，只能断开连接
+                raise ConnectionError(f"文件数据流中断: {e}") from e
+
+        print(f"[文件下载] 数据流发送完成: {sent_size}/{length}")
+        return sent_size
 
     def handle_file_list_request(self, path_info):
         """处理文件列表请求（包含文件和文件夹）"""
@@ -242,30 +781,166 @@ class FileHandler:
                 raise PermissionError(f"权限不足: {path}")
 
             # 发送文件列表
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_FILE_LIST,
-                {
+                Protocol.reply_to(path_info, {
                     "status": "success",
                     "path": path,
                     "items": items
-                }
+                })
             )
-            self.client_socket.send(response)
 
             print(f"[文件列表] 已发送目录内容: {path} ({len(items)} 项)")
 
         except (FileNotFoundError, ValueError, PermissionError) as e:
             print(f"[错误] 获取文件列表失败: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": str(e)}
+                Protocol.reply_to(path_info, {"error": str(e)})
             )
-            self.client_socket.send(response)
 
         except Exception as e:
             print(f"[错误] 处理文件列表请求失败: {e}")
-            response = Protocol.pack_message(
+            self.writer.send_message(
                 Protocol.MSG_ERROR,
-                {"error": str(e)}
+                Protocol.reply_to(path_info, {"error": str(e)})
             )
-            self.client_socket.send(response)
+
+
+class _Upload:
+    """一个正在接收的上传"""
+
+    def __init__(self, path, total_size):
+        self.path = path
+        self.file = None
+        self.total_size = total_size
+        self.received_size = 0
+        self.window = None  # 使用逻辑通道时的接收窗口
+        self.part = None  # 可续传时实际写入的 .part 文件
+        self.hasher = None  # 请求校验时计算收到数据的摘要
+
+    def close(self):
+        """关闭文件，停止哈希线程"""
+        self.file.close()
+        if self.hasher:
+            self.hasher.close()
+
+
+class _Delta:
+    """一个正在进行的增量上传：新文件先写入 .part，完成后替换目标文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.basis = None  # 已有的目标文件，复制指令从这里读取
+        self.block_size = 0
+        self.mode = None  # 替换后沿用原文件的权限
+        self.part = None
+        self.file = None
+        self.hasher = None
+        self.size = 0
+        self.copied = 0
+        self.received = 0
+        self.error = None
+
+    def write(self, data):
+        """写入一段新文件的数据"""
+        self.file.write(data)
+        self.hasher.update(data)
+        self.size += len(data)
+
+    def copy_blocks(self, start, count, chunk_size=1024 * 1024):
+        """从原文件复制连续的 count 个块"""
+        if self.basis is None:
+            raise ValueError("目标文件不存在，无法复制")
+        self.basis.seek(start * self.block_size)
+        remaining = count * self.block_size
+        while remaining > 0:
+            chunk = self.basis.read(min(chunk_size, remaining))
+            if not chunk:
+                raise ValueError(f"复制的块超出原文件: {start}+{count}")
+            self.write(chunk)
+            self.copied += len(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        """关闭文件，记录原文件的权限"""
+        self.received = self.size - self.copied
+        if self.basis:
+            self.mode = stat.S_IMODE(os.fstat(self.basis.fileno()).st_mode)
+            self.basis.close()
+            self.basis = None
+        if self.file:
+            self.file.close()
+        if self.hasher:
+            self.hasher.close()
+
+    def discard(self):
+        """放弃这次上传，删除 .part 文件"""
+        self.close()
+        if self.part:
+            try:
+                os.remove(self.part)
+            except OSError:
+                pass
+
+
+class _DirUpload:
+    """一个正在接收的目录上传：解包线程从队列中取数据块，边收边解包"""
+
+    def __init__(self, target, writer, channel=0, max_pending=256):
+        self.target = target
+        self.writer = writer
+        self.channel = channel
+        self.window = ReceiveWindow(Protocol.CHANNEL_WINDOW) if channel else None
+        self.chunks = queue.Queue(maxsize=max_pending)
+        self.aborted = threading.Event()
+        self.stats = None
+        self.error = None
+        self.thread = threading.Thread(target=self._extract, daemon=True)
+        self.thread.start()
+
+    def feed(self, data):
+        """交给解包线程；解包已经结束（出错）时丢弃"""
+        while self.thread.is_alive():
+            try:
+                self.chunks.put(data, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _next_chunk(self):
+        """解包线程取下一块，取出后（上一块已写入磁盘）向客户端发放通道额度"""
+        while True:
+            if self.aborted.is_set():
+                raise ConnectionError("连接已断开")
+            try:
+                data = self.chunks.get(timeout=1)
+                break
+            except queue.Empty:
+                continue
+        if data and self.window:
+            credit = self.window.consume(len(data))
+            if credit:
+                self.writer.send_message(Protocol.MSG_FLOW_CREDIT, {"channel": self.channel, "bytes": credit})
+        return data
+
+    def _extract(self):
+        try:
+            self.stats = extract_tree(ChunkReader(self._next_chunk), self.target)
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        """
+        数据流结束，等待解包完成
+        返回: {"files", "bytes", "skipped"}，解包出错时抛出异常
+        """
+        self.feed(b'')
+        self.thread.join()
+        if self.error:
+            raise self.error
+        return self.stats
+
+    def abort(self):
+        """放弃解包，已解出的文件保留"""
+        self.aborted.set()
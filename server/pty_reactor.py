@@ -0,0 +1,189 @@
+"""
+终端输出反应器
+一个线程通过 selectors（Linux上为epoll）监听所有终端会话的 master_fd
+以及命令执行的输出管道，有输出时回调对应会话，空闲时不会周期性唤醒
+接口与 asyncio 事件循环的 add_reader/remove_reader/call_later/call_soon_threadsafe 保持一致
+"""
+import heapq
+import os
+import selectors
+import threading
+import time
+
+
+class PTYReactor:
+    """共享的终端输出反应器"""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取全局共享的反应器（首次调用时启动）"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.readers = {}  # fd -> (callback, args)
+        self.sessions = set()  # 使用反应器的会话
+        self.pending = []  # 待反应器线程执行的注册/注销操作
+        self.timers = []  # 定时回调（按到期时间排列的堆）
+
+        # 自唤醒管道：其他线程修改监听集合时唤醒select
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+
+        # 统计
+        self.wakeups = 0
+        self.dispatches = 0
+
+        self.thread = threading.Thread(target=self._run, name='pty-reactor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_reader(self, fd, callback, *args):
+        """监听fd可读，可读时在反应器线程中调用 callback(*args)"""
+        with self.lock:
+            self.readers[fd] = (callback, args)
+            self.pending.append(('add', fd))
+        self._wake()
+
+    def remove_reader(self, fd):
+        """停止监听fd"""
+        with self.lock:
+            existed = self.readers.pop(fd, None) is not None
+            self.pending.append(('remove', fd))
+        self._wake()
+        return existed
+
+    def call_later(self, delay, callback, *args):
+        """delay秒后在反应器线程中调用 callback(*args)，返回可取消的句柄"""
+        timer = _Timer(time.monotonic() + delay, callback, args)
+        with self.lock:
+            heapq.heappush(self.timers, timer)
+        if threading.current_thread() is not self.thread:
+            self._wake()
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """从任意线程安排 callback(*args) 尽快在反应器线程中执行"""
+        return self.call_later(0, callback, *args)
+
+    def attach(self, session):
+        """登记使用反应器的会话"""
+        with self.lock:
+            self.sessions.add(session)
+
+    def detach(self, session):
+        """注销会话"""
+        with self.lock:
+            self.sessions.discard(session)
+
+    def stats(self):
+        """返回当前服务的fd数和会话数"""
+        with self.lock:
+            return {
+                "fds": len(self.readers),
+                "sessions": len(self.sessions),
+                "wakeups": self.wakeups,
+                "dispatches": self.dispatches,
+            }
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            pass  # 管道已满说明反应器必然会被唤醒
+
+    def _apply_pending(self):
+        """在反应器线程中执行注册/注销"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        for op, fd in pending:
+            registered = fd in self.selector.get_map()
+            try:
+                if op == 'add' and not registered:
+                    self.selector.register(fd, selectors.EVENT_READ)
+                elif op == 'remove' and registered:
+                    self.selector.unregister(fd)
+            except (KeyError, ValueError, OSError):
+                # fd可能已被关闭，忽略
+                pass
+
+    def _run(self):
+        """反应器主循环"""
+        while True:
+            self._apply_pending()
+            events = self.selector.select(self._next_timeout())
+            self.wakeups += 1
+
+            for key, _ in events:
+                if key.fd == self.wake_r:
+                    try:
+                        while os.read(self.wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                with self.lock:
+                    entry = self.readers.get(key.fd)
+                if entry is None:
+                    continue
+
+                callback, args = entry
+                self.dispatches += 1
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"[错误] 终端输出回调失败: {e}")
+
+            self._run_timers()
+
+    def _next_timeout(self):
+        """距最近一个定时回调的秒数，没有定时回调时无限等待"""
+        with self.lock:
+            while self.timers and self.timers[0].cancelled:
+                heapq.heappop(self.timers)
+            if not self.timers:
+                return None
+            return max(0, self.timers[0].when - time.monotonic())
+
+    def _run_timers(self):
+        """执行已到期的定时回调"""
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            while self.timers and self.timers[0].when <= now:
+                due.append(heapq.heappop(self.timers))
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"[错误] 定时回调失败: {e}")
+
+
+class _Timer:
+    """反应器定时回调句柄"""
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self.cancelled = True
@@ -6,6 +6,7 @@ import socket
 import threading
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # 添加项目根目录到路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,9 +14,14 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common.protocol import Protocol
 from common.config import Config
 from common.version import __version__, UPDATE_URL
+from common.compression import OutputCompressor
 from server.terminal_handler import TerminalHandler
 from server.file_handler import FileHandler
+from server.exec_handler import ExecHandler
+from server.connection_writer import ConnectionWriter
 from server.ip_blacklist import IPBlacklist
+from server.shell_pool import ShellPool, spawn_shell
+from server.session_manager import SessionManager, DataSessions
 
 
 class FlashServer:
@@ -33,6 +39,23 @@ class FlashServer:
         # 自定义留言
         self.custom_message = "访问被拒绝"
 
+        # 预启动shell池（启动服务器时创建）
+        self.pool_size = self.config.get('terminal', 'pool_size', 2)
+        self.pool_idle_timeout = self.config.get('terminal', 'pool_idle_timeout', 600)
+        self.shell_pool = None
+
+        # 可接回的终端会话
+        self.sessions = SessionManager(self.config.get('terminal', 'session_grace', 300))
+        # 共享会话的观看者是否允许请求输入权限
+        self.share_write = self.config.get('terminal', 'share_write', False)
+        # 终端输出压缩（客户端也请求时启用）
+        self.compression = self.config.get('terminal', 'compression', True)
+        self.compression_level = self.config.get('terminal', 'compression_level', 6)
+        # 数据连接：每个控制连接最多绑定的数据连接数
+        self.data_sessions = DataSessions(self.config.get('server', 'max_data_connections', 8))
+        # 每个连接同时执行的下载、签名等文件操作上限，超出的请求排队等待
+        self.max_file_workers = 8
+
         self.server_socket = None
         self.clients = []
         self.running = False
@@ -45,6 +68,7 @@ class FlashServer:
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
             self.running = True
+            self.start_shell_pool()
 
             print(f"[FlashControler] 服务器启动成功")
             print(f"[FlashControler] 监听地址: {self.host}:{self.port}")
@@ -54,6 +78,7 @@ class FlashServer:
                 try:
                     client_socket, client_address = self.server_socket.accept()
                     print(f"[FlashControler] 新连接来自: {client_address}")
+                    Protocol.set_nodelay(client_socket)
 
                     # 为每个客户端创建处理线程
                     client_thread = threading.Thread(
@@ -76,75 +101,81 @@ class FlashServer:
         """处理客户端连接"""
         client_ip = client_address[0]  # 提取IP地址
         authenticated = False
+        typed = False
+        writer = None
         terminal_handler = None
         file_handler = None
+        session_token = None
+        viewer = None
+        exec_handler = None
+        file_pool = None
+        data_token, is_data = None, False
+
+        def close_data():
+            """控制连接断开时关闭这条数据连接"""
+            client_socket.shutdown(socket.SHUT_RDWR)
 
         try:
             # 检查IP是否被封锁
-            is_blocked, block_reason = self.ip_blacklist.check_blocked(client_ip)
-            if is_blocked:
-                print(f"[安全] ❌ IP {client_ip} 已被封锁，拒绝连接")
-                print(f"[安全]    封锁原因: {block_reason}")
+            blocked_response = self.check_blocked(client_ip)
+            if blocked_response:
                 # 发送拒绝消息后立即关闭连接
                 try:
-                    response = Protocol.pack_message(Protocol.MSG_AUTH, {
-                        "status": "blocked",
-                        "reason": block_reason,
-                        "message": self.custom_message
-                    })
-                    client_socket.send(response)
+                    response = Protocol.pack_message(Protocol.MSG_AUTH, blocked_response)
+                    client_socket.sendall(response)
                 except:
                     pass
                 return
 
             # 等待认证
-            msg_type, payload = Protocol.receive_message(client_socket)
+            msg_type, payload = Protocol.receive_message(client_socket, max_size=Protocol.AUTH_FRAME_SIZE)
 
             if msg_type == Protocol.MSG_AUTH:
-                if payload == self.password:
-                    authenticated = True
-                    response = Protocol.pack_message(Protocol.MSG_AUTH, {"status": "success"})
-                    client_socket.send(response)
-
-                    # 记录认证成功
-                    self.ip_blacklist.record_auth_success(client_ip)
-                    print(f"[认证] ✓ IP {client_ip} 认证成功")
-
-                    # 初始化处理器
-                    terminal_handler = TerminalHandler(client_socket)
-                    file_handler = FileHandler(client_socket)
-                else:
-                    response = Protocol.pack_message(Protocol.MSG_AUTH, {
-                        "status": "failed",
-                        "message": self.custom_message
-                    })
-                    client_socket.send(response)
-
-                    # 记录认证失败
-                    auto_blocked = self.ip_blacklist.record_auth_failure(client_ip)
-                    status = self.ip_blacklist.blacklist.get(client_ip, {})
-                    fail_count = status.get('fail_count', 0)
-
-                    print(f"[认证] ✗ IP {client_ip} 认证失败 (失败次数: {fail_count}/{self.ip_blacklist.max_failures})")
-                    print(f"[安全] 🔍 尝试密码: {payload}")
+                payload = self.auth_payload(payload)
+                authenticated, features, auth_response = self.authenticate(client_ip, payload)
+                if not authenticated:
+                    response = Protocol.pack_message(Protocol.MSG_AUTH, auth_response)
+                    client_socket.sendall(response)
+                    return
 
-                    if auto_blocked:
-                        print(f"[安全] 🔒 IP {client_ip} 已自动封锁（认证失败{fail_count}次）")
-                        print(f"[安全]    使用 'python manage_ip.py unlock {client_ip}' 解锁")
+                # 认证响应之后的所有帧按协商结果编码，并统一经由写入器发送
+                typed = Protocol.FEATURE_TYPED_FRAMES in features
+                writer = ConnectionWriter(client_socket, typed)
 
+                data_token, is_data = self.open_data_session(features, payload, auth_response, close_data)
+                if is_data and data_token is None:
+                    writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, self.DATA_TOKEN_EXPIRED))
+                    writer.close(flush=True)
                     return
 
+                # 初始化处理器（新建、接回或观看终端会话）
+                if payload.get('terminal', True) and not is_data:
+                    terminal_handler, session_token, viewer = self.open_terminal(writer, features, payload, auth_response)
+                    if terminal_handler is None:
+                        writer.close(flush=True)
+                        return
+                else:
+                    # 只执行命令或传输文件的连接（如批量执行）不启动终端
+                    writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, auth_response))
+                file_handler = FileHandler(writer)
+                file_handler.dedicated = terminal_handler is None
+                exec_handler = ExecHandler(writer)
+                file_pool = ThreadPoolExecutor(
+                    max_workers=self.max_file_workers,
+                    thread_name_prefix='flash-file'
+                )
+
             if not authenticated:
                 # 非标准客户端，直接发送字符串
                 try:
-                    client_socket.send(self.custom_message.encode('utf-8'))
+                    client_socket.sendall(self.custom_message.encode('utf-8'))
                 except:
                     pass
                 return
 
             # 处理客户端消息
             while self.running:
-                msg_type, payload = Protocol.receive_message(client_socket)
+                msg_type, payload, channel = Protocol.receive_frame(client_socket, typed)
 
                 if msg_type is None:
                     print(f"[FlashControler] 客户端 {client_address} 断开连接")
@@ -152,7 +183,19 @@ class FlashServer:
 
                 # 终端输入
                 if msg_type == Protocol.MSG_TERMINAL_INPUT:
-                    terminal_handler.handle_input(payload)
+                    if terminal_handler and (viewer is None or viewer.can_write):
+                        terminal_handler.handle_input(payload)
+
+                # 流控额度：带通道ID的属于下载通道，否则属于终端输出（观看者不参与流控）
+                elif msg_type == Protocol.MSG_FLOW_CREDIT:
+                    if isinstance(payload, dict) and payload.get('channel'):
+                        file_handler.handle_channel_credit(payload)
+                    elif terminal_handler and viewer is None:
+                        terminal_handler.handle_flow_credit(payload)
+
+                # 执行命令（不经过终端）
+                elif msg_type == Protocol.MSG_EXEC:
+                    exec_handler.handle_exec(payload)
 
                 # 文件上传
                 elif msg_type == Protocol.MSG_FILE_UPLOAD:
@@ -160,78 +203,325 @@ class FlashServer:
 
                 # 文件数据
                 elif msg_type == Protocol.MSG_FILE_DATA:
-                    file_handler.handle_file_data(payload)
+                    file_handler.handle_file_data(payload, channel)
 
                 # 文件传输完成
                 elif msg_type == Protocol.MSG_FILE_COMPLETE:
-                    file_handler.handle_upload_complete()
+                    file_handler.handle_upload_complete(payload)
+
+                # 增量上传 - 计算签名要读完整个目标文件，在文件线程池中进行
+                elif msg_type == Protocol.MSG_DELTA_SIGNATURE:
+                    file_pool.submit(self.run_download, file_handler.handle_delta_signature, payload, client_socket)
+
+                elif msg_type == Protocol.MSG_DELTA_DATA:
+                    file_handler.handle_delta_data(payload)
+
+                elif msg_type == Protocol.MSG_DELTA_COMPLETE:
+                    file_handler.handle_delta_complete(payload)
+
+                # 目录上传 - 数据块交给解包线程，完成时等待解包结束
+                elif msg_type == Protocol.MSG_DIR_UPLOAD:
+                    file_handler.handle_dir_upload_start(payload)
+
+                elif msg_type == Protocol.MSG_DIR_DATA:
+                    file_handler.handle_dir_data(payload)
+
+                elif msg_type == Protocol.MSG_DIR_COMPLETE:
+                    file_pool.submit(self.run_download, file_handler.handle_dir_upload_complete, payload, client_socket)
 
                 # 更新检查
                 elif msg_type == Protocol.MSG_UPDATE_CHECK:
-                    self.handle_update_check(client_socket)
+                    self.handle_update_check(writer)
 
                 # 列出目录（只返回目录）
                 elif msg_type == Protocol.MSG_LIST_DIR:
-                    self.handle_list_dir(client_socket, payload)
+                    self.handle_list_dir(writer, payload)
 
                 # 文件列表（返回文件和目录）
                 elif msg_type == Protocol.MSG_FILE_LIST:
                     file_handler.handle_file_list_request(payload)
 
-                # 文件下载
+                # 文件下载 - 在文件线程池中发送，下载期间同一连接的其他请求照常处理
                 elif msg_type == Protocol.MSG_FILE_DOWNLOAD:
-                    file_handler.handle_download_request(payload)
+                    file_pool.submit(self.run_download, file_handler.handle_download_request, payload, client_socket)
+
+                # 批量下载 - 与文件下载一样在文件线程池中发送
+                elif msg_type == Protocol.MSG_FILE_BATCH:
+                    file_pool.submit(self.run_download, file_handler.handle_file_batch, payload, client_socket)
+
+                # 目录下载 - 与文件下载一样在文件线程池中边打包边发送
+                elif msg_type == Protocol.MSG_DIR_DOWNLOAD:
+                    file_pool.submit(self.run_download, file_handler.handle_dir_download, payload, client_socket)
 
                 # 设置留言
                 elif msg_type == Protocol.MSG_SET_MESSAGE:
                     self.custom_message = payload.get('message', '访问被拒绝')
                     print(f"[留言] 已更新自定义留言: {self.custom_message}")
-                    response = Protocol.pack_message(Protocol.MSG_SET_MESSAGE, {"status": "success"})
-                    client_socket.send(response)
+                    writer.send_message(Protocol.MSG_SET_MESSAGE, {"status": "success"})
 
                 # 心跳包
                 elif msg_type == Protocol.MSG_HEARTBEAT:
-                    response = Protocol.pack_message(Protocol.MSG_HEARTBEAT, "pong")
-                    client_socket.send(response)
+                    writer.send_message(Protocol.MSG_HEARTBEAT, "pong")
 
         except Exception as e:
             print(f"[错误] 处理客户端 {client_address} 时出错: {e}")
         finally:
-            if terminal_handler:
+            if exec_handler:
+                exec_handler.stop()
+            if file_handler:
+                file_handler.close()
+            if file_pool:
+                file_pool.shutdown(wait=False)
+            self.close_data_session(data_token, is_data, close_data)
+            if terminal_handler and not self.close_terminal(terminal_handler, session_token, writer, viewer):
                 terminal_handler.stop()
+            if writer and writer.compressor:
+                print(f"[终端] 输出压缩: {writer.compressor.summary()}")
+            if writer:
+                writer.close()
             client_socket.close()
             print(f"[FlashControler] 客户端 {client_address} 连接已关闭")
 
-    def handle_update_check(self, client_socket):
+    def terminal_options(self, features, auth_payload):
+        """
+        从配置和认证消息读取终端处理器参数
+        协商了流控特性时，初始窗口取客户端在认证消息中声明的 flow_window
+        """
+        flow_window = None
+        if Protocol.FEATURE_FLOW_CONTROL in features:
+            flow_window = auth_payload.get('flow_window', Protocol.FLOW_WINDOW)
+
+        return {
+            "coalesce_bytes": self.config.get('terminal', 'coalesce_bytes', 65536),
+            "coalesce_delay": self.config.get('terminal', 'coalesce_delay_ms', 5) / 1000.0,
+            "flow_window": flow_window,
+            "flood_mode": self.config.get('terminal', 'flood_mode', False),
+            "flood_tail": self.config.get('terminal', 'flood_tail', 4096),
+            "shell_pool": self.shell_pool,
+            "scrollback_size": self.config.get('terminal', 'scrollback_size', 1024 * 1024),
+        }
+
+    def needs_shell(self, features, auth_payload):
+        """认证后是否要为连接启动新的shell：不是加入共享会话，也不是接回仍在运行的会话"""
+        if Protocol.FEATURE_SHARED_SESSION in features and auth_payload.get('share'):
+            return False
+        if Protocol.FEATURE_SESSION_RESUME in features and self.sessions.get(auth_payload.get('session_token')):
+            return False
+        return True
+
+    def acquire_shell(self):
+        """取一个shell：优先使用预启动的，池为空时同步启动（fork/exec 登录shell）"""
+        return self.shell_pool.acquire() if self.shell_pool else spawn_shell()
+
+    def open_terminal(self, writer, features, auth_payload, auth_response, shell=None):
+        """
+        新建终端会话，按认证消息中的 session_token 接回断开的会话，
+        或按 share 以观看者身份加入其他连接的会话，然后经由写入器发送认证响应
+        shell 为调用方已取得的shell（见 needs_shell），没有用上时关闭
+        返回: (终端处理器, 会话令牌, 观看者)，共享会话不存在时终端处理器为None
+        """
+        options = self.terminal_options(features, auth_payload)
+        token = None
+        handler = None
+        if Protocol.FEATURE_COMPRESSION in features:
+            # 每个连接独立的压缩上下文，终端输出帧经由它打包
+            writer.compressor = OutputCompressor(self.compression_level)
+
+        share = auth_payload.get('share') if Protocol.FEATURE_SHARED_SESSION in features else None
+        if share:
+            handler = self.sessions.get(share)
+            if handler is None:
+                writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, {
+                    "status": "failed",
+                    "message": "共享会话不存在或已结束"
+                }))
+                return None, None, None
+
+            can_write = self.share_write and bool(auth_payload.get('write'))
+            auth_response['shared'] = True
+            auth_response['can_write'] = can_write
+            writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, auth_response))
+            return handler, None, handler.add_viewer(writer, can_write)
+
+        if Protocol.FEATURE_SESSION_RESUME in features:
+            token = auth_payload.get('session_token')
+            handler = self.sessions.resume(token, writer)
+            if handler is None:
+                token = self.sessions.new_token()
+            auth_response['session_token'] = token
+            auth_response['resumed'] = handler is not None
+
+        # 认证响应始终使用传统帧，排在写入器的所有帧之前
+        writer.send_frame(Protocol.pack_message(Protocol.MSG_AUTH, auth_response))
+
+        if handler:
+            if shell:
+                shell.close()
+            handler.attach(writer, auth_payload.get('resume_offset', 0), options['flow_window'])
+        else:
+            handler = TerminalHandler(writer, shell=shell, **options)
+            if token:
+                self.sessions.add(token, handler, writer)
+        return handler, token, None
+
+    # 数据连接绑定失败：令牌在认证后已失效，或控制连接的数据连接数已达上限
+    DATA_TOKEN_EXPIRED = {"status": "failed", "message": "数据连接令牌已失效或数据连接数已达上限"}
+
+    def open_data_session(self, features, auth_payload, auth_response, close):
+        """
+        数据连接凭令牌绑定到控制连接，控制连接断开时调用 close 关闭它；
+        协商了 data_connection 特性的控制连接分配令牌，放入认证响应
+        返回: (令牌, 是否为数据连接)，数据连接绑定失败时令牌为None
+        """
+        token = auth_payload.get('data_token')
+        if token is not None:
+            return (token if self.data_sessions.attach(token, close) else None), True
+        if Protocol.FEATURE_DATA_CONNECTION in features:
+            token = self.data_sessions.issue()
+            auth_response['data_token'] = token
+            return token, False
+        return None, False
+
+    def close_data_session(self, token, is_data, close):
+        """连接关闭：数据连接解除绑定，控制连接使令牌失效并关闭其数据连接"""
+        if token is None:
+            return
+        if is_data:
+            self.data_sessions.detach(token, close)
+        else:
+            self.data_sessions.revoke(token)
+
+    def run_download(self, download, payload, client_socket):
+        """发送下载的文件或目录，或执行其他耗时的文件操作（在文件线程池中执行）"""
+        try:
+            download(payload)
+        except ConnectionError as e:
+            # 数据流中断，连接已不可用：关闭socket让接收循环退出
+            print(f"[错误] 文件传输中断: {e}")
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        except Exception as e:
+            print(f"[错误] 文件操作失败: {e}")
+
+    def close_terminal(self, handler, token, writer, viewer=None):
+        """
+        连接断开时处理终端会话
+        返回: 会话是否继续运行（False时由调用方结束终端）
+        """
+        if viewer is not None:
+            # 观看者离开不影响会话本身
+            handler.remove_viewer(viewer)
+            return True
+        return bool(token) and self.sessions.detach(token, writer)
+
+    def start_shell_pool(self):
+        """按配置创建预启动shell池，pool_size 为0时不启用"""
+        if self.pool_size > 0 and self.shell_pool is None:
+            self.shell_pool = ShellPool(self.pool_size, self.pool_idle_timeout)
+            print(f"[FlashControler] 预启动shell池: {self.pool_size} 个")
+
+    def check_blocked(self, client_ip):
+        """
+        检查IP是否被封锁
+        返回: 被封锁时返回拒绝响应，否则返回None
+        """
+        is_blocked, block_reason = self.ip_blacklist.check_blocked(client_ip)
+        if not is_blocked:
+            return None
+
+        print(f"[安全] ❌ IP {client_ip} 已被封锁，拒绝连接")
+        print(f"[安全]    封锁原因: {block_reason}")
+        return {
+            "status": "blocked",
+            "reason": block_reason,
+            "message": self.custom_message
+        }
+
+    @staticmethod
+    def auth_payload(payload):
+        """认证消息统一为字典：旧客户端直接发送密码字符串"""
+        if isinstance(payload, dict):
+            return payload
+        return {'password': payload}
+
+    def authenticate(self, client_ip, payload):
+        """
+        校验认证消息并记录结果
+        新客户端发送 {"password": ..., "features": [...]}，旧客户端直接发送密码字符串
+        返回: (是否成功, 协商的特性, 认证响应)
+        """
+        payload = self.auth_payload(payload)
+        password = payload.get('password')
+        features = Protocol.negotiate_features(payload.get('features'))
+        if not self.compression or Protocol.FEATURE_TYPED_FRAMES not in features:
+            # 压缩帧只能以类型帧发送
+            features = [f for f in features if f != Protocol.FEATURE_COMPRESSION]
+        data_token = payload.get('data_token')
+
+        # 数据连接凭控制连接分配的令牌认证，不需要密码
+        if data_token is not None:
+            authenticated = self.data_sessions.valid(data_token)
+        else:
+            authenticated = password == self.password
+
+        if authenticated:
+            # 记录认证成功
+            self.ip_blacklist.record_auth_success(client_ip)
+            print(f"[认证] ✓ IP {client_ip} {'数据连接' if data_token is not None else ''}认证成功")
+            if features:
+                print(f"[认证]    协商特性: {', '.join(features)}")
+
+            return True, features, {
+                "status": "success",
+                "features": features
+            }
+
+        # 记录认证失败
+        auto_blocked = self.ip_blacklist.record_auth_failure(client_ip)
+        status = self.ip_blacklist.blacklist.get(client_ip, {})
+        fail_count = status.get('fail_count', 0)
+
+        print(f"[认证] ✗ IP {client_ip} 认证失败 (失败次数: {fail_count}/{self.ip_blacklist.max_failures})")
+        print(f"[安全] 🔍 尝试密码: {password}")
+
+        if auto_blocked:
+            print(f"[安全] 🔒 IP {client_ip} 已自动封锁（认证失败{fail_count}次）")
+            print(f"[安全]    使用 'python manage_ip.py unlock {client_ip}' 解锁")
+
+        return False, [], {
+            "status": "failed",
+            "message": self.custom_message
+        }
+
+    def handle_update_check(self, writer):
         """处理更新检查"""
         # 版本号和更新URL现在从代码中获取，不再从配置文件读取
         # 配置文件中的 update_url 可以覆盖默认值
         update_url = self.config.get('update', 'update_url', UPDATE_URL)
 
-        response = Protocol.pack_message(Protocol.MSG_UPDATE_INFO, {
+        writer.send_message(Protocol.MSG_UPDATE_INFO, {
             "current_version": __version__,
             "update_url": update_url
         })
-        client_socket.send(response)
 
-    def handle_list_dir(self, client_socket, payload):
+    def handle_list_dir(self, writer, payload):
         """处理目录列表请求"""
         try:
             path = payload.get('path', '/') if isinstance(payload, dict) else '/'
 
             # 确保路径存在且是目录
             if not os.path.exists(path):
-                response = Protocol.pack_message(Protocol.MSG_ERROR, {
+                writer.send_message(Protocol.MSG_ERROR, Protocol.reply_to(payload, {
                     "error": "路径不存在"
-                })
-                client_socket.send(response)
+                }))
                 return
 
             if not os.path.isdir(path):
-                response = Protocol.pack_message(Protocol.MSG_ERROR, {
+                writer.send_message(Protocol.MSG_ERROR, Protocol.reply_to(payload, {
                     "error": "不是目录"
-                })
-                client_socket.send(response)
+                }))
                 return
 
             # 获取目录内容
@@ -252,37 +542,46 @@ class FlashServer:
                         # 跳过没有权限的目录
                         continue
             except PermissionError:
-                response = Protocol.pack_message(Protocol.MSG_ERROR, {
+                writer.send_message(Protocol.MSG_ERROR, Protocol.reply_to(payload, {
                     "error": "权限不足"
-                })
-                client_socket.send(response)
+                }))
                 return
 
             # 发送目录列表
-            response = Protocol.pack_message(Protocol.MSG_LIST_DIR, {
+            writer.send_message(Protocol.MSG_LIST_DIR, Protocol.reply_to(payload, {
                 "path": path,
                 "items": items
-            })
-            client_socket.send(response)
+            }))
 
         except Exception as e:
             print(f"[错误] 列出目录失败: {e}")
-            response = Protocol.pack_message(Protocol.MSG_ERROR, {
+            writer.send_message(Protocol.MSG_ERROR, Protocol.reply_to(payload, {
                 "error": str(e)
-            })
-            client_socket.send(response)
+            }))
 
     def stop(self):
         """停止服务器"""
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        self.sessions.close()
+        if self.shell_pool:
+            self.shell_pool.close()
         print("[FlashControler] 服务器已停止")
 
 
+def create_server(config_file="config/settings.json"):
+    """根据配置中的 server.mode 创建服务端（thread 或 asyncio）"""
+    mode = Config(config_file).get('server', 'mode', 'thread')
+    if mode == 'asyncio':
+        from server.async_server import AsyncFlashServer
+        return AsyncFlashServer(config_file)
+    return FlashServer(config_file)
+
+
 def main():
     """主函数"""
-    server = FlashServer()
+    server = create_server()
     try:
         server.start()
     except KeyboardInterrupt:
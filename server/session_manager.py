@@ -0,0 +1,221 @@
+"""
+终端会话管理
+连接断开后终端会话在宽限期内继续运行，输出写入环形缓冲区；
+客户端用会话令牌重连时接回原会话，只补发断开期间错过的输出；
+其他连接也可以凭会话令牌以观看者身份加入；
+控制连接还可以分配数据连接令牌，客户端凭它另外建立只传输文件的数据连接
+"""
+import secrets
+import threading
+
+
+class ScrollbackBuffer:
+    """固定大小的终端输出环形缓冲区，按绝对偏移量定位"""
+
+    def __init__(self, size=1024 * 1024):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.end = 0  # 已写入的总字节数，即下一个字节的绝对偏移量
+
+    @property
+    def start(self):
+        """缓冲区中最早一个字节的绝对偏移量"""
+        return max(0, self.end - self.size)
+
+    def append(self, data):
+        """写入输出，超出容量时覆盖最旧的数据"""
+        total = len(data)
+        view = memoryview(data)[-self.size:]
+        pos = (self.end + total - len(view)) % self.size
+        first = min(len(view), self.size - pos)
+        self.buffer[pos:pos + first] = view[:first]
+        self.buffer[:len(view) - first] = view[first:]
+        self.end += total
+
+    def since(self, offset):
+        """
+        读取从绝对偏移量 offset 开始的输出
+        返回: (已被覆盖而无法补发的字节数, 数据)
+        """
+        offset = min(max(offset, 0), self.end)
+        skipped = max(0, self.start - offset)
+        offset += skipped
+        count = self.end - offset
+        pos = offset % self.size
+        if pos + count <= self.size:
+            return skipped, bytes(self.buffer[pos:pos + count])
+        return skipped, bytes(self.buffer[pos:]) + bytes(self.buffer[:pos + count - self.size])
+
+
+class _Session:
+    """一个可接回的终端会话"""
+
+    def __init__(self, handler, writer):
+        self.handler = handler
+        self.writer = writer  # 当前连接的写入器，断开期间为None
+        self.expiry = None  # 宽限期到期的定时回调
+
+
+class SessionManager:
+    """终端会话管理器"""
+
+    def __init__(self, grace_period=300):
+        """
+        初始化会话管理器
+
+        Args:
+            grace_period: 连接断开后会话保留的秒数，为0时断开即结束会话
+        """
+        self.grace_period = grace_period
+        self.sessions = {}  # 令牌 -> _Session
+        self.lock = threading.Lock()
+
+    def new_token(self):
+        """生成会话令牌"""
+        return secrets.token_urlsafe(16)
+
+    def add(self, token, handler, writer):
+        """登记新会话"""
+        with self.lock:
+            self.sessions[token] = _Session(handler, writer)
+
+    def get(self, token):
+        """
+        查找仍在运行的会话（供观看者加入）
+        返回: 终端处理器，不存在时返回None
+        """
+        if not token:
+            return None
+        with self.lock:
+            session = self.sessions.get(token)
+        if session is None or not session.handler.alive():
+            return None
+        return session.handler
+
+    def resume(self, token, writer):
+        """
+        接回会话，由新连接的写入器接管
+        旧连接尚未发现断开时同样可以接管
+        返回: 终端处理器，会话不存在或shell已退出时返回None
+        """
+        if not token:
+            return None
+
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if not session.handler.alive():
+                del self.sessions[token]
+                return None
+            if session.expiry is not None:
+                session.expiry.cancel()
+                session.expiry = None
+            session.writer = writer
+            return session.handler
+
+    def detach(self, token, writer):
+        """
+        连接断开：保留会话直到宽限期结束
+        返回: 会话是否保留（False时由调用方结束终端）
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return False
+            if session.writer is not writer:
+                # 会话已被新连接接管
+                return True
+            if self.grace_period <= 0 or not session.handler.alive():
+                del self.sessions[token]
+                return False
+
+            session.writer = None
+            handler = session.handler
+            handler.detach()
+            session.expiry = handler.loop.call_later(self.grace_period, self._expire, token, session)
+
+        print(f"[会话] 连接已断开，会话保留 {self.grace_period} 秒等待重连")
+        return True
+
+    def close(self):
+        """结束所有会话"""
+        with self.lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+        for session in sessions:
+            if session.expiry is not None:
+                session.expiry.cancel()
+            session.handler.stop()
+
+    def _expire(self, token, session):
+        """宽限期到期仍未重连，结束会话（在事件循环/反应器线程中执行）"""
+        with self.lock:
+            if self.sessions.get(token) is not session or session.writer is not None:
+                return
+            del self.sessions[token]
+
+        print("[会话] 宽限期已过，结束会话")
+        session.handler.stop_reading()
+        # 结束shell可能需要等待，不阻塞事件循环/反应器线程
+        threading.Thread(target=session.handler.stop, daemon=True).start()
+
+
+class DataSessions:
+    """
+    数据连接令牌
+    控制连接认证时分配令牌，数据连接凭令牌认证并绑定到该控制连接；
+    控制连接断开时令牌失效，绑定的数据连接一并关闭
+    """
+
+    def __init__(self, max_connections=8):
+        """
+        初始化
+
+        Args:
+            max_connections: 每个控制连接最多绑定的数据连接数
+        """
+        self.max_connections = max_connections
+        self.sessions = {}  # 令牌 -> 绑定的数据连接的关闭函数列表
+        self.lock = threading.Lock()
+
+    def issue(self):
+        """为控制连接分配令牌"""
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.sessions[token] = []
+        return token
+
+    def valid(self, token):
+        """令牌是否有效且还能绑定数据连接"""
+        with self.lock:
+            closers = self.sessions.get(token) if isinstance(token, str) else None
+            return closers is not None and len(closers) < self.max_connections
+
+    def attach(self, token, close):
+        """
+        绑定一个数据连接，控制连接断开时调用 close 关闭它
+        返回: 是否绑定成功（令牌已失效或数据连接已满时失败）
+        """
+        with self.lock:
+            closers = self.sessions.get(token)
+            if closers is None or len(closers) >= self.max_connections:
+                return False
+            closers.append(close)
+            return True
+
+    def detach(self, token, close):
+        """数据连接断开"""
+        with self.lock:
+            closers = self.sessions.get(token)
+            if closers and close in closers:
+                closers.remove(close)
+
+    def revoke(self, token):
+        """控制连接断开：令牌失效，关闭绑定的数据连接"""
+        with self.lock:
+            closers = self.sessions.pop(token, None) or []
+        for close in closers:
+            try:
+                close()
+            except OSError:
+                pass
@@ -0,0 +1,205 @@
+"""
+预启动shell池
+服务端预先启动若干个 PTY+bash 登录shell，认证成功后直接分配，
+新会话不必等待登录shell启动完成
+"""
+import os
+import pty
+import signal
+import subprocess
+import threading
+import time
+import locale
+
+
+# 终端环境变量中的locale（首次检测后缓存）
+_shell_locale = None
+_locale_lock = threading.Lock()
+
+
+def shell_locale():
+    """检测系统是否支持中文locale，不支持时回退到英文UTF-8"""
+    global _shell_locale
+    with _locale_lock:
+        if _shell_locale is None:
+            try:
+                locale.setlocale(locale.LC_ALL, 'zh_CN.UTF-8')
+                _shell_locale = 'zh_CN.UTF-8'
+            except locale.Error:
+                _shell_locale = 'en_US.UTF-8'
+                print("[终端] 警告：系统不支持中文locale，使用英文UTF-8")
+        return _shell_locale
+
+
+def spawn_shell():
+    """
+    启动一个伪终端上的登录shell
+    返回: Shell
+    """
+    master_fd, slave_fd = pty.openpty()
+
+    # 设置环境变量，确保UTF-8编码支持中文
+    env = os.environ.copy()
+    env['LANG'] = shell_locale()
+    env['LC_ALL'] = env['LANG']
+    env['TERM'] = 'xterm-256color'
+
+    try:
+        process = subprocess.Popen(
+            ['/bin/bash', '--login'],  # 使用登录shell，加载完整环境
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            env=env,  # 传递环境变量
+            preexec_fn=os.setsid
+        )
+    except Exception:
+        os.close(master_fd)
+        os.close(slave_fd)
+        raise
+
+    return Shell(master_fd, slave_fd, process)
+
+
+class Shell:
+    """一个伪终端及运行在其上的shell进程"""
+
+    def __init__(self, master_fd, slave_fd, process):
+        self.master_fd = master_fd
+        self.slave_fd = slave_fd
+        self.process = process
+        self.created = time.monotonic()
+
+    def alive(self):
+        """shell进程是否仍在运行"""
+        return self.process.poll() is None
+
+    def close(self):
+        """结束shell进程并关闭伪终端"""
+        try:
+            # 交互式bash忽略SIGTERM，发送挂断信号（与关闭终端一致）
+            self.process.send_signal(signal.SIGHUP)
+            self.process.wait(timeout=2)
+        except Exception:
+            try:
+                self.process.kill()
+                self.process.wait(timeout=2)
+            except Exception:
+                pass
+
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class ShellPool:
+    """预启动shell池"""
+
+    def __init__(self, size=2, idle_timeout=600):
+        """
+        初始化shell池
+
+        Args:
+            size: 保持就绪的shell数量
+            idle_timeout: 空闲shell的最长存活时间（秒），超时后换成新的shell
+        """
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.shells = []  # 就绪的shell，按启动时间排列
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.spawned = 0
+        self.recycled = 0
+
+        self.thread = threading.Thread(target=self._run, name='shell-pool')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def acquire(self):
+        """
+        取出一个就绪的shell，池为空时同步启动一个
+        返回: Shell
+        """
+        with self.condition:
+            while self.shells:
+                shell = self.shells.pop(0)
+                if shell.alive():
+                    self.hits += 1
+                    self.condition.notify_all()  # 通知后台线程补充
+                    return shell
+                shell.close()
+            self.misses += 1
+            self.condition.notify_all()
+
+        return spawn_shell()
+
+    def stats(self):
+        """返回池状态和命中统计"""
+        with self.condition:
+            return {
+                "ready": len(self.shells),
+                "hits": self.hits,
+                "misses": self.misses,
+                "spawned": self.spawned,
+                "recycled": self.recycled,
+            }
+
+    def close(self):
+        """关闭池并结束所有空闲shell"""
+        with self.condition:
+            self.closed = True
+            shells, self.shells = self.shells, []
+            self.condition.notify_all()
+        for shell in shells:
+            shell.close()
+
+    def _expired(self):
+        """取出空闲超时或已退出的shell"""
+        now = time.monotonic()
+        expired = [shell for shell in self.shells
+                   if now - shell.created >= self.idle_timeout or not shell.alive()]
+        for shell in expired:
+            self.shells.remove(shell)
+        return expired
+
+    def _run(self):
+        """后台线程：回收空闲超时的shell，并把池补充到目标数量"""
+        while True:
+            with self.condition:
+                if self.closed:
+                    return
+                expired = self._expired()
+                self.recycled += len(expired)
+                missing = self.size - len(self.shells)
+                if not expired and missing <= 0:
+                    # 等待被取用，或等到最早的shell空闲超时
+                    timeout = self.idle_timeout
+                    if self.shells:
+                        timeout = max(0, self.shells[0].created + self.idle_timeout - time.monotonic())
+                    self.condition.wait(timeout)
+                    continue
+
+            for shell in expired:
+                shell.close()
+
+            for _ in range(missing):
+                try:
+                    shell = spawn_shell()
+                except Exception as e:
+                    print(f"[错误] 预启动shell失败: {e}")
+                    with self.condition:
+                        self.condition.wait(5)
+                    break
+
+                with self.condition:
+                    if self.closed:
+                        shell.close()
+                        return
+                    self.shells.append(shell)
+                    self.spawned += 1
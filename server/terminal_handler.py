@@ -4,70 +4,103 @@
 支持UTF-8编码，正确显示中文
 """
 import os
-import pty
-import select
-import subprocess
-import threading
 import sys
-import locale
+import time
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common.protocol import Protocol
+from server.pty_reactor import PTYReactor
+from server.shell_pool import spawn_shell
+from server.session_manager import ScrollbackBuffer
 
 
 class TerminalHandler:
     """终端处理器"""
 
-    def __init__(self, client_socket):
-        self.client_socket = client_socket
+    def __init__(self, writer, loop=None, coalesce_bytes=65536, coalesce_delay=0.005,
+                 flow_window=None, flood_mode=False, flood_tail=4096, shell_pool=None,
+                 scrollback_size=1024 * 1024, shell=None):
+        """
+        初始化终端处理器
+
+        Args:
+            writer: 连接写入器
+            loop: asyncio事件循环；为None时使用共享的PTYReactor
+            coalesce_bytes: 输出合并的字节上限，达到后立即发送
+            coalesce_delay: 输出合并的最长等待时间（秒）
+            flow_window: 流控初始窗口（字节）；为None时不启用流控
+            flood_mode: 额度耗尽时是否丢弃中间输出，只保留末尾
+            flood_tail: 丢弃输出时保留的末尾字节数
+            shell_pool: 预启动shell池；为None时每次同步启动shell
+            scrollback_size: 输出环形缓冲区大小，用于重连后补发
+            shell: 调用方已经启动的shell（asyncio模式下在执行器中取得）；为None时由处理器自己取
+        """
+        self.writer = writer  # 连接写入器，所有发送经由它串行完成；会话断开期间为None
+        # 监听终端输出的事件循环：asyncio模式下为事件循环，线程模式下为共享的反应器
+        self.reactor = None
+        if loop is None:
+            self.reactor = PTYReactor.instance()
+            loop = self.reactor
+        self.loop = loop
+        self.shell_pool = shell_pool
+        self.shell = shell
         self.master_fd = None
         self.slave_fd = None
         self.process = None
         self.running = False
-        self.output_thread = None
+
+        # 输出合并：空闲后的第一块输出（按键回显、提示符）立即发送，
+        # 持续输出时在字节上限或等待时间内合并为一帧
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay
+        self.pending_output = bytearray()
+        self.flush_timer = None
+        self.last_output_time = 0
+        self.reads = 0  # 从终端读取的次数
+        self.frames_sent = 0  # 实际发送的输出帧数
+
+        # 流控：每发送一字节消耗一个额度，额度耗尽时停止读取终端，
+        # 由客户端处理完输出后发放新额度（额度只在事件循环/反应器线程中修改）
+        self.credits = flow_window
+        self.waiting_credit = False
+        # 泛洪模式：额度耗尽时继续读取终端但丢弃输出，只保留末尾
+        self.flood_mode = flood_mode
+        self.flood_tail = flood_tail
+        self.flooding = False
+        self.flood_buffer = bytearray()
+        self.skipped_bytes = 0  # 当前泛洪期间跳过的字节数
+        self.total_skipped = 0
+
+        # 最近的输出（按绝对偏移量定位），断开期间的输出只写入这里
+        self.scrollback = ScrollbackBuffer(scrollback_size)
+
+        # 共享会话的观看者（只在事件循环/反应器线程中替换，遍历时无需加锁）
+        self.viewers = ()
 
         self.start_terminal()
 
     def start_terminal(self):
-        """启动终端"""
+        """启动终端（优先使用预启动的shell）"""
         try:
-            # 创建伪终端
-            self.master_fd, self.slave_fd = pty.openpty()
-
-            # 设置环境变量，确保UTF-8编码支持中文
-            env = os.environ.copy()
-            env['LANG'] = 'zh_CN.UTF-8'
-            env['LC_ALL'] = 'zh_CN.UTF-8'
-            env['TERM'] = 'xterm-256color'
-
-            # 如果系统没有中文locale，回退到英文UTF-8
-            try:
-                import locale
-                locale.setlocale(locale.LC_ALL, 'zh_CN.UTF-8')
-            except:
-                env['LANG'] = 'en_US.UTF-8'
-                env['LC_ALL'] = 'en_US.UTF-8'
-                print("[终端] 警告：系统不支持中文locale，使用英文UTF-8")
-
-            # 启动shell进程
-            self.process = subprocess.Popen(
-                ['/bin/bash', '--login'],  # 使用登录shell，加载完整环境
-                stdin=self.slave_fd,
-                stdout=self.slave_fd,
-                stderr=self.slave_fd,
-                env=env,  # 传递环境变量
-                preexec_fn=os.setsid
-            )
+            if self.shell is None:
+                self.shell = self.shell_pool.acquire() if self.shell_pool else spawn_shell()
+            self.master_fd = self.shell.master_fd
+            self.slave_fd = self.shell.slave_fd
+            self.process = self.shell.process
 
             self.running = True
 
-            # 启动输出读取线程
-            self.output_thread = threading.Thread(target=self.read_output)
-            self.output_thread.daemon = True
-            self.output_thread.start()
+            # 事件循环/反应器监听master_fd可读
+            self.loop.add_reader(self.master_fd, self._on_readable)
 
             print("[终端] 终端会话已启动（UTF-8编码）")
+            if self.shell_pool:
+                stats = self.shell_pool.stats()
+                print(f"[终端] shell池: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 就绪 {stats['ready']} 个")
+            if self.reactor:
+                self.reactor.attach(self)
+                self._print_reactor_stats()
 
         except Exception as e:
             print(f"[错误] 启动终端失败: {e}")
@@ -85,57 +118,350 @@ class TerminalHandler:
         except Exception as e:
             print(f"[错误] 写入终端失败: {e}")
 
-    def read_output(self):
-        """读取终端输出"""
-        while self.running:
-            try:
-                # 使用select检查是否有数据可读
-                r, _, _ = select.select([self.master_fd], [], [], 0.1)
-
-                if r:
-                    try:
-                        output = os.read(self.master_fd, 8192)
-                        if output:
-                            # 发送输出到客户端
-                            msg = Protocol.pack_message(
-                                Protocol.MSG_TERMINAL_OUTPUT,
-                                output
-                            )
-                            self.client_socket.send(msg)
-                    except OSError:
-                        # 终端已关闭
-                        break
-
-            except Exception as e:
-                print(f"[错误] 读取终端输出失败: {e}")
-                break
-
-        print("[终端] 输出读取线程已停止")
+    def read_available(self):
+        """
+        读取一次终端输出并发送给客户端
+        返回: 终端是否仍然可用
+        """
+        try:
+            output = os.read(self.master_fd, 8192)
+        except OSError:
+            # 终端已关闭
+            return False
+        if not output:
+            return False
 
-    def stop(self):
-        """停止终端"""
-        self.running = False
+        self.reads += 1
+        self.scrollback.append(output)
+        if self.writer is None and not self.viewers:
+            # 会话已断开且无人观看，等待重连后从缓冲区补发
+            return True
+        if self.flooding:
+            self._keep_tail(output)
+            return True
 
-        if self.process:
-            try:
-                self.process.terminate()
-                self.process.wait(timeout=2)
-            except:
-                try:
-                    self.process.kill()
-                except:
-                    pass
-
-        if self.master_fd:
+        now = time.monotonic()
+        idle = now - self.last_output_time >= self.coalesce_delay
+        self.last_output_time = now
+
+        if not self.pending_output and idle:
+            # 空闲后的第一块输出立即发送，保证交互延迟
+            self._send_output(output)
+            return True
+
+        self.pending_output += output
+        if len(self.pending_output) >= self.coalesce_bytes:
+            self.flush_output()
+        elif self.flush_timer is None:
+            self.flush_timer = self.loop.call_later(self.coalesce_delay, self.flush_output)
+        return True
+
+    def flush_output(self):
+        """发送合并中的输出"""
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.pending_output or not self.running:
+            return
+
+        output = bytes(self.pending_output)
+        self.pending_output.clear()
+        try:
+            self._send_output(output)
+        except Exception as e:
+            print(f"[错误] 发送终端输出失败: {e}")
+            self.stop_reading()
+
+    def _send_output(self, output):
+        """发送输出给会话所有者和所有观看者（不阻塞事件循环/反应器线程）"""
+        self._broadcast(Protocol.MSG_TERMINAL_OUTPUT, output, len(output))
+        self.frames_sent += 1
+        if self.credits is not None:
+            self.credits -= len(output)
+
+    def _broadcast(self, msg_type, data, nbytes):
+        """
+        每种帧格式只打包一次，同一帧放入每个连接的写入器；
+        压缩的连接各有自己的压缩上下文，终端输出分别打包
+        nbytes 为消息代表的输出字节数，观看者跟不上时计入其跳过字节数
+        """
+        frames = {}
+
+        def frame_for(writer):
+            if msg_type == Protocol.MSG_TERMINAL_OUTPUT and writer.compressor is not None:
+                return writer.compressor.pack(data)
+            frame = frames.get(writer.typed_frames)
+            if frame is None:
+                frame = frames[writer.typed_frames] = Protocol.pack_message(msg_type, data, writer.typed_frames)
+            return frame
+
+        writer = self.writer
+        if writer is not None:
             try:
-                os.close(self.master_fd)
-            except:
-                pass
+                writer.send_frame(frame_for(writer), block=False)
+            except ConnectionError:
+                if writer is self.writer:
+                    raise
+                # 发送期间会话已断开
+
+        for viewer in self.viewers:
+            viewer.send(frame_for, nbytes)
+
+    def add_viewer(self, writer, can_write=False):
+        """
+        以观看者身份加入会话（可在任意线程调用）
+        观看者先收到环形缓冲区中的最近输出，之后与会话所有者收到相同的帧
+        返回: Viewer
+        """
+        viewer = Viewer(writer, can_write)
+        self.loop.call_soon_threadsafe(self._on_viewer_joined, viewer)
+        return viewer
+
+    def remove_viewer(self, viewer):
+        """观看者离开（可在任意线程调用）"""
+        self.loop.call_soon_threadsafe(self._on_viewer_left, viewer)
+
+    def _on_viewer_joined(self, viewer):
+        """发送最近输出后加入广播列表（在事件循环/反应器线程中执行）"""
+        if not self.running:
+            return
+        _, recent = self.scrollback.since(0)
+        try:
+            for start in range(0, len(recent), self.coalesce_bytes):
+                self._send_replay(viewer.writer, recent[start:start + self.coalesce_bytes])
+        except ConnectionError:
+            return
+        self.viewers = self.viewers + (viewer,)
+        print(f"[会话] 观看者加入{'（可输入）' if viewer.can_write else '（只读）'}，当前 {len(self.viewers)} 个观看者")
+
+    def _on_viewer_left(self, viewer):
+        """从广播列表中移除观看者（在事件循环/反应器线程中执行）"""
+        if viewer in self.viewers:
+            self.viewers = tuple(v for v in self.viewers if v is not viewer)
+            print(f"[会话] 观看者离开，当前 {len(self.viewers)} 个观看者")
+
+    def alive(self):
+        """shell是否仍在运行"""
+        return self.running and self.process is not None and self.process.poll() is None
+
+    def detach(self):
+        """连接断开：停止发送，继续读取终端输出到环形缓冲区（可在任意线程调用）"""
+        self.writer = None
+        self.loop.call_soon_threadsafe(self._on_detached)
 
-        if self.slave_fd:
+    def attach(self, writer, resume_offset, flow_window=None):
+        """
+        接回会话（可在任意线程调用）
+        补发绝对偏移量 resume_offset 之后的输出，之后继续实时发送
+        """
+        self.loop.call_soon_threadsafe(self._on_attached, writer, resume_offset, flow_window)
+
+    def _reset_output(self):
+        """丢弃合并中和泛洪中的输出，它们都已在环形缓冲区中"""
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        self.pending_output.clear()
+        self.flooding = False
+        self.flood_buffer.clear()
+        self.total_skipped += self.skipped_bytes
+        self.skipped_bytes = 0
+        self.waiting_credit = False
+
+    def _on_detached(self):
+        """会话断开后的清理（在事件循环/反应器线程中执行）"""
+        if self.writer is not None:
+            return  # 已被重新接回
+        self._reset_output()
+        self.credits = None
+        # 无论之前因何暂停，都恢复读取，避免shell阻塞
+        self.resume_reading()
+
+    def _on_attached(self, writer, resume_offset, flow_window):
+        """接回会话并补发错过的输出（在事件循环/反应器线程中执行）"""
+        self._reset_output()
+        self.writer = writer
+        self.credits = flow_window
+
+        # 只补发给接回的连接，观看者已实时收到这些输出
+        skipped, missed = self.scrollback.since(resume_offset)
+        if skipped:
+            writer.send_message(Protocol.MSG_TERMINAL_SKIP, {"skipped": skipped}, block=False)
+        for start in range(0, len(missed), self.coalesce_bytes):
+            self._send_replay(writer, missed[start:start + self.coalesce_bytes])
+        if self.credits is not None:
+            self.credits -= len(missed)
+        print(f"[会话] 会话已接回，补发 {len(missed)} 字节输出")
+
+        self.resume_reading()
+
+    @staticmethod
+    def _send_replay(writer, output):
+        """补发环形缓冲区中的输出（只发给一个连接）"""
+        if writer.compressor is not None:
+            writer.send_frame(writer.compressor.pack(output), block=False)
+        else:
+            writer.send_message(Protocol.MSG_TERMINAL_OUTPUT, output, block=False)
+
+    def out_of_credit(self):
+        """流控额度是否已耗尽"""
+        return self.credits is not None and self.credits <= 0
+
+    def handle_flow_credit(self, payload):
+        """处理客户端发放的流控额度（可在任意线程调用）"""
+        amount = payload.get('bytes', 0) if isinstance(payload, dict) else 0
+        if amount > 0:
+            self.loop.call_soon_threadsafe(self._add_credit, amount)
+
+    def _add_credit(self, amount):
+        """增加额度，必要时结束泛洪或恢复读取（在事件循环/反应器线程中执行）"""
+        if self.credits is None or not self.running:
+            return
+        self.credits += amount
+        if self.out_of_credit():
+            return
+
+        if self.flooding:
+            self._end_flood()
+        if self.waiting_credit:
+            self.waiting_credit = False
+            self.resume_reading()
+
+    def _start_flood(self):
+        """额度耗尽：开始丢弃输出，合并中的输出并入末尾缓冲"""
+        self.flooding = True
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        output = bytes(self.pending_output)
+        self.pending_output.clear()
+        self._keep_tail(output)
+
+    def _keep_tail(self, output):
+        """只保留最后 flood_tail 字节输出，其余计入跳过字节数"""
+        self.flood_buffer += output
+        excess = len(self.flood_buffer) - self.flood_tail
+        if excess > 0:
+            del self.flood_buffer[:excess]
+            self.skipped_bytes += excess
+
+    def _end_flood(self):
+        """额度恢复：先发送跳过标记，再发送保留的末尾输出"""
+        self.flooding = False
+        if self.skipped_bytes:
+            print(f"[终端] 输出过快，已跳过 {self.skipped_bytes} 字节")
+            self._broadcast(Protocol.MSG_TERMINAL_SKIP, {"skipped": self.skipped_bytes}, self.skipped_bytes)
+            self.total_skipped += self.skipped_bytes
+            self.skipped_bytes = 0
+        if self.flood_buffer:
+            output = bytes(self.flood_buffer)
+            self.flood_buffer.clear()
+            self._send_output(output)
+
+    def output_stats(self):
+        """返回输出合并和流控统计"""
+        return {
+            "reads": self.reads,
+            "frames": self.frames_sent,
+            "frames_saved": max(0, self.reads - self.frames_sent),
+            "skipped": self.total_skipped + self.skipped_bytes,
+        }
+
+    def _on_readable(self):
+        """master_fd可读回调（在事件循环/反应器线程中执行）"""
+        try:
+            if self.read_available():
+                writer = self.writer
+                if self.flooding or writer is None:
+                    return
+                if self.out_of_credit():
+                    if self.flood_mode:
+                        self._start_flood()
+                    else:
+                        # 额度耗尽：暂停读取终端，背压传递给shell，收到新额度后恢复
+                        self.stop_reading()
+                        self.waiting_credit = True
+                elif writer.congested():
+                    # 发送队列已满：暂停读取终端，背压传递给shell，队列排空后恢复
+                    self.stop_reading()
+                    writer.on_drain(self.resume_reading)
+                return
+        except Exception as e:
+            print(f"[错误] 读取终端输出失败: {e}")
+
+        self.stop_reading()
+
+    def stop_reading(self):
+        """停止监听master_fd"""
+        if self.master_fd is not None:
             try:
-                os.close(self.slave_fd)
-            except:
+                self.loop.remove_reader(self.master_fd)
+            except Exception:
                 pass
 
+    def resume_reading(self):
+        """恢复监听master_fd"""
+        if self.out_of_credit() and not self.flood_mode:
+            self.waiting_credit = True
+            return
+        if self.running and self.master_fd is not None:
+            self.loop.add_reader(self.master_fd, self._on_readable)
+
+    def _print_reactor_stats(self):
+        """打印共享反应器当前服务的会话数"""
+        stats = self.reactor.stats()
+        print(f"[终端] 共享反应器: {stats['sessions']} 个会话, {stats['fds']} 个fd")
+
+    def stop(self):
+        """停止终端"""
+        self.running = False
+        self.viewers = ()
+        self.stop_reading()
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+
+        if self.shell:
+            self.shell.close()
+            self.shell = None
+            self.master_fd = None
+
         print("[终端] 终端会话已停止")
+        stats = self.output_stats()
+        print(f"[终端] 输出合并: 读取 {stats['reads']} 次, 发送 {stats['frames']} 帧, 节省 {stats['frames_saved']} 帧")
+        if stats['skipped']:
+            print(f"[终端] 泛洪保护共跳过 {stats['skipped']} 字节输出")
+        if self.reactor:
+            self.reactor.detach(self)
+            self._print_reactor_stats()
+
+
+class Viewer:
+    """共享会话的观看者，拥有独立的写入器，跟不上时跳过输出而不拖慢其他连接"""
+
+    def __init__(self, writer, can_write=False):
+        self.writer = writer
+        self.can_write = can_write  # 是否允许向终端输入
+        self.skipped = 0  # 因发送队列已满而跳过、尚未通知的字节数
+        self.lagging = False
+
+    def send(self, frame_for, nbytes):
+        """
+        放入 frame_for(写入器) 打包的帧，发送队列已满时跳过（在事件循环/反应器线程中调用）
+        跳过时不打包，压缩上下文中只有实际发送的输出
+        """
+        if self.writer.congested():
+            if not self.lagging:
+                self.lagging = True
+                print("[会话] 观看者网络较慢，跳过部分输出")
+            self.skipped += nbytes
+            return
+
+        try:
+            if self.skipped:
+                self.writer.send_message(Protocol.MSG_TERMINAL_SKIP, {"skipped": self.skipped}, block=False)
+                self.skipped = 0
+                self.lagging = False
+            self.writer.send_frame(frame_for(self.writer), block=False)
+        except ConnectionError:
+            pass  # 连接已关闭，等待服务端移除该观看者
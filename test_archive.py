@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+目录传输测试脚本
+验证目录经tar数据流打包、解包后内容、权限和修改时间不变，以及路径规则和越界检查
+"""
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.archive import ChunkWriter, ChunkReader, write_tree, extract_tree
+
+
+def make_tree(root):
+    """创建测试目录"""
+    for i in range(50):
+        sub = os.path.join(root, f"d{i % 5}")
+        os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, f"f{i}.txt"), 'wb') as f:
+            f.write(os.urandom(i * 37))
+    os.makedirs(os.path.join(root, "node_modules", "pkg"))
+    with open(os.path.join(root, "node_modules", "pkg", "index.js"), 'w') as f:
+        f.write("x")
+    with open(os.path.join(root, "build.log"), 'w') as f:
+        f.write("log")
+    os.chmod(os.path.join(root, "d1", "f1.txt"), 0o741)
+    os.chmod(os.path.join(root, "d3", "f3.txt"), 0o664)
+    os.utime(os.path.join(root, "d2", "f2.txt"), (1_000_000_000, 1_000_000_000))
+
+
+def transfer(root, target, include=(), exclude=()):
+    """经 ChunkWriter/ChunkReader 分块打包、解包，模拟网络传输"""
+    chunks = []
+    output = ChunkWriter(chunks.append, chunk_size=1000)
+    write_tree(output, root, include, exclude)
+    output.flush()
+    assert all(len(c) <= 1000 for c in chunks)
+    chunks.reverse()
+    return extract_tree(ChunkReader(lambda: chunks.pop() if chunks else b''), target)
+
+
+def relative_files(root):
+    """目录下所有文件的相对路径"""
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, files in os.walk(root) for f in files)
+
+
+def test_archive():
+    """测试目录传输"""
+    print("=" * 60)
+    print("目录传输测试")
+    print("=" * 60)
+
+    work = tempfile.mkdtemp()
+    try:
+        src = os.path.join(work, "proj")
+        make_tree(src)
+
+        # 测试1: 内容、权限和修改时间不变
+        print("\n测试 1: 完整目录")
+        stats = transfer(src, os.path.join(work, "out1"))
+        out = os.path.join(work, "out1", "proj")
+        assert relative_files(out) == relative_files(src), "文件列表不一致"
+        for name in relative_files(src):
+            with open(os.path.join(src, name), 'rb') as a, open(os.path.join(out, name), 'rb') as b:
+                assert a.read() == b.read(), f"{name}: 内容不一致"
+        assert os.stat(os.path.join(out, "d1", "f1.txt")).st_mode & 0o777 == 0o741, "权限未保留"
+        assert os.stat(os.path.join(out, "d3", "f3.txt")).st_mode & 0o777 == 0o664, "组写权限未保留"
+        assert int(os.stat(os.path.join(out, "d2", "f2.txt")).st_mtime) == 1_000_000_000, "修改时间未保留"
+        assert stats["files"] == 52
+        print(f"  {stats['files']} 个文件, {stats['bytes']} 字节")
+        print("  ✓ 测试通过")
+
+        # 测试2: 排除目录和文件
+        print("\n测试 2: 排除规则")
+        transfer(src, os.path.join(work, "out2"), exclude=["node_modules", "*.log"])
+        files = relative_files(os.path.join(work, "out2", "proj"))
+        assert len(files) == 50 and not any("node_modules" in f or f.endswith(".log") for f in files)
+        print("  ✓ 测试通过")
+
+        # 测试3: 只包含匹配的文件
+        print("\n测试 3: 包含规则")
+        transfer(src, os.path.join(work, "out3"), include=["d3/*"])
+        files = relative_files(os.path.join(work, "out3", "proj"))
+        assert files and all(f.startswith("d3" + os.sep) for f in files), files
+        print("  ✓ 测试通过")
+
+        # 测试4: 拒绝解包到目标目录之外
+        print("\n测试 4: 越界路径")
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w') as tar:
+            info = tarfile.TarInfo("../evil.txt")
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"evil"))
+        data.seek(0)
+        try:
+            extract_tree(data, os.path.join(work, "out4"))
+            raise AssertionError("越界路径未被拒绝")
+        except tarfile.TarError:
+            pass
+        assert not os.path.exists(os.path.join(work, "evil.txt"))
+        print("  ✓ 测试通过")
+
+        # 测试5: 指向目标目录外的符号链接跳过，不中止解包
+        print("\n测试 5: 越界链接")
+        outside = os.path.join(work, "outside")
+        os.makedirs(outside)
+        for i, linkname in enumerate((outside, "../outside", "sub/../../outside")):
+            data = io.BytesIO()
+            with tarfile.open(fileobj=data, mode='w') as tar:
+                info = tarfile.TarInfo("link")
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+                tar.addfile(info)
+                info = tarfile.TarInfo("link/evil.txt")
+                info.size = 4
+                tar.addfile(info, io.BytesIO(b"evil"))
+            data.seek(0)
+            stats = extract_tree(data, os.path.join(work, f"out5-{i}"))
+            assert len(stats["skipped"]) == 1 and stats["skipped"][0].startswith("link:"), stats
+            assert not os.path.islink(os.path.join(work, f"out5-{i}", "link")), linkname
+        assert os.listdir(outside) == []
+        print("  ✓ 测试通过")
+
+        # 测试6: 目录中的绝对路径链接（如 lib -> /usr/lib）跳过，其余文件照常传输
+        print("\n测试 6: 绝对路径链接")
+        os.symlink("/etc/hostname", os.path.join(src, "abslink"))
+        os.symlink("d1/f1.txt", os.path.join(src, "rellink"))
+        stats = transfer(src, os.path.join(work, "out6"))
+        out = os.path.join(work, "out6", "proj")
+        assert stats["skipped"] == ["proj/abslink: 链接指向目标目录外 (/etc/hostname)"], stats["skipped"]
+        assert not os.path.lexists(os.path.join(out, "abslink"))
+        assert os.readlink(os.path.join(out, "rellink")) == "d1/f1.txt", "目录内的链接未保留"
+        assert stats["files"] == 52
+        print("  ✓ 测试通过")
+
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！目录传输功能正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_archive()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+终端输出压缩测试脚本
+验证压缩帧与普通帧交替时解压结果不变，以及压缩率低时暂停压缩
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.protocol import Protocol
+from common.compression import OutputCompressor, OutputDecompressor
+
+
+def transfer(compressor, decompressor, chunks):
+    """打包、解包每块输出，返回收到的内容和压缩帧数"""
+    received = bytearray()
+    compressed = 0
+    for chunk in chunks:
+        frame = compressor.pack(chunk)
+        msg_type, payload = Protocol.unpack_message(frame, True)
+        if msg_type == Protocol.MSG_TERMINAL_OUTPUT_Z:
+            payload = decompressor.decompress(payload)
+            compressed += 1
+        else:
+            assert msg_type == Protocol.MSG_TERMINAL_OUTPUT
+        received += payload
+    return bytes(received), compressed
+
+
+def test_compression():
+    """测试终端输出压缩"""
+    print("=" * 60)
+    print("终端输出压缩测试")
+    print("=" * 60)
+
+    rng = random.Random(1)
+    compressor = OutputCompressor(sample_size=16384, bypass_size=65536)
+    decompressor = OutputDecompressor()
+
+    # 测试1: 日志类输出，小帧也能利用之前的内容
+    print("\n测试 1: 文本输出")
+    chunks = [f"2024-01-01 12:00:{i % 60:02d} INFO worker-{i % 4} processed item {i}\r\n".encode()
+              for i in range(2000)]
+    received, compressed = transfer(compressor, decompressor, chunks)
+    assert received == b''.join(chunks), "解压结果不一致"
+    assert compressed == len(chunks), "文本输出应全部压缩"
+    stats = compressor.stats()
+    assert stats['sent'] < stats['raw'] / 4, f"压缩效果太差: {stats}"
+    print(f"  {compressor.summary()}")
+    print("  ✓ 测试通过")
+
+    # 测试2: 按键回显等很小的输出不压缩
+    print("\n测试 2: 小输出")
+    received, compressed = transfer(compressor, decompressor, [b"l", b"s", b"\r\n"])
+    assert received == b"ls\r\n" and compressed == 0
+    print("  ✓ 测试通过")
+
+    # 测试3: 随机数据压缩率低，暂停压缩；之后的文本仍能正确解压
+    print("\n测试 3: 压缩率低时暂停压缩")
+    noise = [bytes(rng.getrandbits(8) for _ in range(4096)) for _ in range(40)]
+    received, _ = transfer(compressor, decompressor, noise)
+    assert received == b''.join(noise), "解压结果不一致"
+    assert compressor.stats()['bypasses'] >= 1 and compressor.stats()['bypassed'] > 0, compressor.stats()
+    received, compressed = transfer(compressor, decompressor, chunks[:100])
+    assert received == b''.join(chunks[:100]), "暂停压缩后解压结果不一致"
+    print(f"  {compressor.summary()}")
+    print("  ✓ 测试通过")
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！终端输出压缩功能正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_compression()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
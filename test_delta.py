@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+增量传输测试脚本
+验证按指令重建的文件与新文件一致，以及局部修改时只发送少量数据
+"""
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.delta import block_size_for, file_signature, parse_signature, compute_delta
+
+
+def random_bytes(rng, n):
+    """可复现的随机数据"""
+    return rng.getrandbits(n * 8).to_bytes(n, 'little')
+
+
+def rebuild(basis, new, block_size):
+    """按指令重建新文件，返回 (重建结果, 原始数据字节数)"""
+    signature, _ = file_signature(io.BytesIO(basis), block_size)
+    index = parse_signature(signature, block_size, len(basis))
+    out = bytearray()
+    literal = 0
+    for op in compute_delta(new, index, block_size):
+        if op[0] == 'copy':
+            out += basis[op[1] * block_size:(op[1] + op[2]) * block_size]
+        else:
+            out += new[op[1]:op[2]]
+            literal += op[2] - op[1]
+    return bytes(out), literal
+
+
+def test_delta():
+    """测试增量传输"""
+    print("=" * 60)
+    print("增量传输测试")
+    print("=" * 60)
+
+    rng = random.Random(20)
+    basis = random_bytes(rng, 4 * 1024 * 1024 + 123)
+    block_size = block_size_for(len(basis))
+
+    # 测试1: 各种修改方式重建后与新文件一致
+    print("\n测试 1: 重建结果")
+    patched = bytearray(basis)
+    for offset in (0, 1_000_000, 3_000_000):
+        patched[offset:offset + 100] = random_bytes(rng, 100)
+    cases = {
+        "未修改": basis,
+        "原地修改": bytes(patched),
+        "插入": basis[:500_000] + b'inserted' + basis[500_000:],
+        "删除": basis[:500_000] + basis[500_777:],
+        "追加": basis + random_bytes(rng, 5000),
+        "截断": basis[:2_000_000],
+        "全新内容": random_bytes(rng, 1_000_000),
+        "空文件": b'',
+    }
+    results = {}
+    for name, new in cases.items():
+        rebuilt, literal = rebuild(basis, new, block_size)
+        assert rebuilt == new, f"{name}: 重建结果不一致"
+        results[name] = literal
+        print(f"  {name}: 原始数据 {literal}/{len(new)} 字节")
+    print("  ✓ 测试通过")
+
+    # 测试2: 局部修改时发送的数据不超过新文件的10%
+    print("\n测试 2: 发送的数据量")
+    for name in ("未修改", "原地修改", "插入", "删除", "追加"):
+        assert results[name] <= len(cases[name]) // 10, f"{name}: 发送的数据过多"
+    assert results["全新内容"] == len(cases["全新内容"])
+    print("  ✓ 测试通过")
+
+    # 测试3: 原文件为空时全部作为原始数据
+    print("\n测试 3: 原文件为空")
+    rebuilt, literal = rebuild(b'', basis, block_size_for(0))
+    assert rebuilt == basis and literal == len(basis)
+    print("  ✓ 测试通过")
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！增量传输功能正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_delta()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
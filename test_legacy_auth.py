@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+旧客户端认证测试脚本
+旧客户端的认证消息是密码字符串，不协商任何特性；验证线程和asyncio两种服务端
+认证后都能正常打开终端。另外验证只支持数据流、不带请求ID的旧客户端在终端连接上
+下载时改为分帧接收，数据流不会独占终端所在的连接
+"""
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.protocol import Protocol
+from server.server import create_server
+
+
+def free_port():
+    """取一个空闲端口"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def legacy_session(port, password):
+    """以旧客户端方式认证并执行一条命令，返回 (认证响应, 终端输出)"""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(Protocol.pack_message(Protocol.MSG_AUTH, password))
+        msg_type, response = Protocol.receive_message(sock)
+        if not isinstance(response, dict) or response.get('status') != 'success':
+            return response, b''
+        sock.sendall(Protocol.pack_message(Protocol.MSG_TERMINAL_INPUT, 'echo legacy$((6*7))\n'))
+        output = b''
+        deadline = time.monotonic() + 10
+        while b'legacy42' not in output and time.monotonic() < deadline:
+            msg_type, payload = Protocol.receive_message(sock)
+            if msg_type is None:
+                break
+            if msg_type == Protocol.MSG_TERMINAL_OUTPUT:
+                output += payload.encode('utf-8') if isinstance(payload, str) else payload
+        return response, output
+
+
+def legacy_download(port, password, path):
+    """以支持数据流但不带请求ID的旧客户端下载文件，返回 (就绪回复, 收到的帧类型集合, 文件内容)"""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        features = [Protocol.FEATURE_TYPED_FRAMES, Protocol.FEATURE_FILE_STREAM]
+        sock.sendall(Protocol.pack_message(Protocol.MSG_AUTH, {'password': password, 'features': features}))
+        msg_type, response = Protocol.receive_message(sock)
+        assert response.get('features') == features, f"特性协商结果不符: {response}"
+        sock.sendall(Protocol.pack_message(Protocol.MSG_FILE_DOWNLOAD, {'file_path': path, 'stream': True}, True))
+        ready, types, data = None, set(), bytearray()
+        while True:
+            msg_type, payload = Protocol.receive_message(sock, True)
+            if msg_type in (None, Protocol.MSG_FILE_COMPLETE, Protocol.MSG_ERROR):
+                return ready, types, bytes(data)
+            types.add(msg_type)
+            if msg_type == Protocol.MSG_FILE_DOWNLOAD:
+                ready = payload
+            elif msg_type == Protocol.MSG_FILE_DATA:
+                data += payload
+            elif msg_type == Protocol.MSG_FILE_STREAM:
+                for chunk in Protocol.recv_stream(sock, payload.get('size', 0)):
+                    data += chunk
+
+
+def test_legacy_auth():
+    """测试旧客户端认证"""
+    print("=" * 60)
+    print("旧客户端认证测试")
+    print("=" * 60)
+
+    cwd = os.getcwd()
+    work = tempfile.mkdtemp()
+    try:
+        os.chdir(work)
+        os.makedirs('config')
+        for i, mode in enumerate(('thread', 'asyncio')):
+            print(f"\n测试 {i + 1}: {mode} 服务端")
+            port = free_port()
+            with open('config/settings.json', 'w') as f:
+                json.dump({"server": {"host": "127.0.0.1", "port": port, "password": "pw", "mode": mode},
+                           "terminal": {"pool_size": 0}}, f)
+            server = create_server('config/settings.json')
+            threading.Thread(target=server.start, daemon=True).start()
+            try:
+                time.sleep(0.5)
+                response, output = legacy_session(port, 'pw')
+                assert isinstance(response, dict) and response.get('status') == 'success', f"认证失败: {response}"
+                assert response.get('features') == [], f"旧客户端不应协商特性: {response}"
+                assert b'legacy42' in output, f"没有收到终端输出: {output!r}"
+
+                content = os.urandom(300000)
+                with open('data.bin', 'wb') as f:
+                    f.write(content)
+                ready, types, data = legacy_download(port, 'pw', os.path.abspath('data.bin'))
+                assert ready and ready.get('stream') is False, f"终端连接上不应使用数据流: {ready}"
+                assert Protocol.MSG_FILE_STREAM not in types and data == content, "分帧下载的内容不一致"
+            finally:
+                server.stop()
+            print("  ✓ 测试通过")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！旧客户端认证正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_legacy_auth()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
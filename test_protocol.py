@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+通信协议测试脚本
+验证消息打包、分片接收和payload解析
+"""
+import hashlib
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.protocol import Protocol
+from common.transfer import StreamHasher, DIGEST_SIZE
+
+
+class RecordingHasher(StreamHasher):
+    """记录交给哈希线程从文件读取的文件段"""
+
+    def __init__(self):
+        super().__init__()
+        self.files = []
+
+    def update_file(self, path, offset, length):
+        self.files.append((path, offset, length))
+        super().update_file(path, offset, length)
+
+
+class ChunkedSocket:
+    """每次最多返回少量字节的socket，模拟网络分片"""
+
+    def __init__(self, data, max_chunk=3):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.max_chunk = max_chunk
+
+    def recv(self, size):
+        n = min(size, self.max_chunk, len(self.data) - self.pos)
+        chunk = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return chunk
+
+    def recv_into(self, view, size):
+        n = min(size, self.max_chunk, len(self.data) - self.pos)
+        view[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def test_protocol():
+    """测试协议收发"""
+    print("=" * 60)
+    print("通信协议测试")
+    print("=" * 60)
+
+    # 测试1: 各类payload的打包与解析
+    print("\n测试 1: 打包/解包往返")
+    cases = [
+        (Protocol.MSG_AUTH, {"status": "success"}, {"status": "success"}),
+        (Protocol.MSG_TERMINAL_INPUT, "ls -la\n", "ls -la\n"),
+        (Protocol.MSG_FILE_DATA, b'\xff\xfe\x00', b'\xff\xfe\x00'),
+    ]
+    for msg_type, data, expected in cases:
+        packed = Protocol.pack_message(msg_type, data)
+        result_type, payload = Protocol.unpack_message(packed)
+        print(f"  {msg_type}: {data!r} -> {payload!r}")
+        assert result_type == msg_type, "消息类型不一致"
+        assert payload == expected, "payload解析错误"
+    print("  ✓ 测试通过")
+
+    # 测试2: 分片到达的数据能够完整重组
+    print("\n测试 2: 分片接收")
+    body = bytes(range(256)) * 1024
+    stream = (Protocol.pack_message(Protocol.MSG_FILE_DATA, body)
+              + Protocol.pack_message(Protocol.MSG_HEARTBEAT, "pong"))
+    sock = ChunkedSocket(stream, max_chunk=7)
+    msg_type, payload = Protocol.receive_message(sock)
+    assert msg_type == Protocol.MSG_FILE_DATA and payload == body, "大帧重组失败"
+    msg_type, payload = Protocol.receive_message(sock)
+    assert msg_type == Protocol.MSG_HEARTBEAT and payload == "pong", "后续帧解析失败"
+    msg_type, payload = Protocol.receive_message(sock)
+    assert msg_type is None, "连接关闭时应返回None"
+    print("  ✓ 测试通过")
+
+    # 测试3: 真实socket上的大帧
+    print("\n测试 3: socketpair 传输 4MB 帧")
+    left, right = socket.socketpair()
+    big = os.urandom(4 * 1024 * 1024)
+    sender = threading.Thread(
+        target=lambda: left.sendall(Protocol.pack_message(Protocol.MSG_FILE_DATA, big))
+    )
+    sender.start()
+    msg_type, payload = Protocol.receive_message(right)
+    sender.join()
+    left.close()
+    right.close()
+    assert msg_type == Protocol.MSG_FILE_DATA and payload == big, "大帧内容不一致"
+    print("  ✓ 测试通过")
+
+    # 测试4: 帧长度超过上限时拒绝，不按声明的长度分配缓冲区
+    print("\n测试 4: 帧长度上限")
+    left, right = socket.socketpair()
+    left.sendall(struct.pack('!IB', 1024 * 1024 * 1024, Protocol.MSG_AUTH) + b'x')
+    try:
+        Protocol.receive_message(right, max_size=Protocol.AUTH_FRAME_SIZE)
+        raise AssertionError("超长的帧应被拒绝")
+    except ValueError:
+        pass
+    left.close()
+    right.close()
+    left, right = socket.socketpair()
+    left.sendall(Protocol.pack_message(Protocol.MSG_AUTH, "pw"))
+    assert Protocol.receive_message(right, max_size=Protocol.AUTH_FRAME_SIZE) == (Protocol.MSG_AUTH, "pw")
+    # 上限之内声明32MB却只发送1字节，缓冲区只随实际数据扩大
+    left.sendall(struct.pack('!IB', 32 * 1024 * 1024, Protocol.MSG_FILE_DATA) + b'x')
+    left.shutdown(socket.SHUT_WR)
+    tracemalloc.start()
+    assert Protocol.receive_message(right) == (None, None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 4 * 1024 * 1024, f"按声明的长度分配了缓冲区: {peak} 字节"
+    left.close()
+    right.close()
+    print("  ✓ 测试通过")
+
+    # 测试5: 类型帧按编码字段解析
+    print("\n测试 5: 类型帧编码")
+    cases = [
+        (Protocol.MSG_TERMINAL_OUTPUT, b'{"a": 1}', b'{"a": 1}'),
+        (Protocol.MSG_FILE_DATA, b'plain text', b'plain text'),
+        (Protocol.MSG_TERMINAL_INPUT, "pwd\n", "pwd\n"),
+        (Protocol.MSG_FILE_LIST, {"path": "/"}, {"path": "/"}),
+        (Protocol.MSG_FILE_DATA, {"seq": 1, "data": b'\x00\xff'}, {"seq": 1, "data": b'\x00\xff'}),
+    ]
+    for msg_type, data, expected in cases:
+        packed = Protocol.pack_message(msg_type, data, typed=True)
+        result_type, payload = Protocol.receive_message(ChunkedSocket(packed), typed=True)
+        print(f"  {msg_type}: {data!r} -> {payload!r}")
+        assert result_type == msg_type, "消息类型不一致"
+        assert payload == expected, "类型帧不应改变payload类型"
+    print("  ✓ 测试通过")
+
+    # 测试6: 特性协商
+    print("\n测试 6: 特性协商")
+    assert Protocol.negotiate_features(None) == [], "旧客户端不应启用任何特性"
+    assert Protocol.negotiate_features(['unknown', 'typed_frames']) == ['typed_frames']
+    print("  ✓ 测试通过")
+
+    # 测试7: 数据流发送的同时计算摘要，回退路径不再重新读取文件
+    print("\n测试 7: 数据流摘要")
+    content = os.urandom(3 * 1024 * 1024 + 123)
+    offset, count = 1000, len(content) - 2000
+    expected = hashlib.blake2b(content[offset:offset + count], digest_size=DIGEST_SIZE).hexdigest()
+    with tempfile.NamedTemporaryFile() as tmp:
+        tmp.write(content)
+        tmp.flush()
+        for use_sendfile in (False, True):
+            left, right = socket.socketpair()
+            received = bytearray()
+            receiver = threading.Thread(
+                target=lambda: received.extend(b''.join(Protocol.recv_stream(right, count)))
+            )
+            receiver.start()
+            hasher = RecordingHasher()
+            with open(tmp.name, 'rb') as f:
+                sent = Protocol.send_stream(left, f, offset, count, use_sendfile, hasher)
+            receiver.join()
+            left.close()
+            right.close()
+            assert sent == count and received == content[offset:offset + count], "数据流内容不一致"
+            assert hasher.hexdigest() == expected, "摘要不一致"
+            if not use_sendfile:
+                assert hasher.files == [], f"回退路径不应再读取文件: {hasher.files}"
+            elif hasattr(os, 'sendfile'):
+                assert hasher.files == [(tmp.name, offset, count)], hasher.files
+    print("  ✓ 测试通过")
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！通信协议功能正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_protocol()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()
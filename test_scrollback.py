@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+终端输出环形缓冲区测试脚本
+验证按绝对偏移量补发输出和覆盖旧数据后的跳过字节数
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server.session_manager import ScrollbackBuffer
+
+
+def test_scrollback():
+    """测试环形缓冲区"""
+    print("=" * 60)
+    print("终端输出环形缓冲区测试")
+    print("=" * 60)
+
+    # 测试1: 未写满时按偏移量读取
+    print("\n测试 1: 未写满时按偏移量读取")
+    buffer = ScrollbackBuffer(16)
+    buffer.append(b'hello ')
+    buffer.append(b'world')
+    assert buffer.since(0) == (0, b'hello world')
+    assert buffer.since(6) == (0, b'world')
+    assert buffer.since(11) == (0, b''), "客户端已收到全部输出时不应补发"
+    print("  ✓ 测试通过")
+
+    # 测试2: 回绕后仍能按偏移量读取
+    print("\n测试 2: 写入回绕")
+    stream = bytes(range(256)) * 4
+    buffer = ScrollbackBuffer(100)
+    for start in range(0, len(stream), 37):
+        buffer.append(stream[start:start + 37])
+    assert buffer.end == len(stream)
+    for offset in (buffer.start, buffer.start + 1, len(stream) - 60, len(stream) - 1):
+        skipped, data = buffer.since(offset)
+        assert skipped == 0
+        assert data == stream[offset:], f"偏移量 {offset} 处的数据不一致"
+    print(f"  已写入 {buffer.end} 字节，保留 [{buffer.start}, {buffer.end})")
+    print("  ✓ 测试通过")
+
+    # 测试3: 请求的数据已被覆盖
+    print("\n测试 3: 已被覆盖的数据")
+    skipped, data = buffer.since(0)
+    assert skipped == buffer.start, "跳过的字节数应为被覆盖的部分"
+    assert data == stream[-100:]
+    print(f"  跳过 {skipped} 字节，补发 {len(data)} 字节")
+    print("  ✓ 测试通过")
+
+    # 测试4: 单次写入超过容量
+    print("\n测试 4: 单次写入超过容量")
+    buffer = ScrollbackBuffer(10)
+    buffer.append(b'abc')
+    buffer.append(b'0123456789ABCDEF')
+    assert buffer.since(0) == (9, b'6789ABCDEF')
+    print("  ✓ 测试通过")
+
+    print("\n" + "=" * 60)
+    print("✓ 所有测试通过！环形缓冲区功能正常。")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    try:
+        test_scrollback()
+    except AssertionError as e:
+        print(f"\n✗ 测试失败: {e}")
+    except Exception as e:
+        print(f"\n✗ 发生错误: {e}")
+        import traceback
+        traceback.print_exc()